@@ -3,27 +3,25 @@ import os
 import logging
 from dotenv import load_dotenv
 from blueprints import register_blueprints
+from commands import register_commands
+from user_cache import init_user_cache
+from db_pool import build_engine_options
+from instrumentation import init_instrumentation
+from password_hashing import init_password_hashing
+from token_revocation import init_token_revocation
+from serializers import init_json_provider
+from recommendations import init_recommendations
+from deletion import init_deletion_worker
 from flask_cors import CORS
 from flask import Flask, jsonify
 from models import db
 from flask_jwt_extended import JWTManager
 from logger_config import setup_logger
 
+load_dotenv()
 setup_logger()
 logger = logging.getLogger(__name__)
-logger.info("Starting the Flask application...")
-
-load_dotenv()
-app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')  # Add a secret key for JWT
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
-db.init_app(app)
-jwt = JWTManager(app)
-
-register_blueprints(app)
 
-@app.errorhandler(404)
 def page_not_found(error):
     """ Handle 404 errors """
     return jsonify({
@@ -34,5 +32,57 @@ def page_not_found(error):
         )
     }), 404
 
+def create_app(test_config=None):
+    """ Create and configure the Flask application; test_config overrides the environment settings """
+    logger.info("Starting the Flask application...")
+    app = Flask(__name__)
+    CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
+    app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')  # Add a secret key for JWT
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(os.getenv('DATABASE_URI'))
+    app.config['SEARCH_INDEX_MAX_AGE'] = int(os.getenv('SEARCH_INDEX_MAX_AGE', '300'))  # Seconds between index rebuilds
+    app.config['USER_CACHE_BACKEND'] = os.getenv('USER_CACHE_BACKEND', 'local')  # local, shared or none
+    app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', '60'))
+    app.config['USER_CACHE_MAX_ENTRIES'] = int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000'))
+    app.config['USER_CACHE_URL'] = os.getenv('USER_CACHE_URL')  # e.g. redis://cache:6379/0, for the shared backend
+    # Shared by workers forked from a preloaded app; gunicorn.conf.py sets a file when the app is not preloaded
+    app.config['USER_CACHE_INVALIDATION_FILE'] = os.getenv('USER_CACHE_INVALIDATION_FILE')
+    app.config['HTTP_CACHE_MAX_AGE'] = int(os.getenv('HTTP_CACHE_MAX_AGE', '0'))  # Cache-Control max-age for GETs
+    app.config['SLOW_QUERY_THRESHOLD'] = float(os.getenv('SLOW_QUERY_THRESHOLD', '0.5'))  # Seconds
+    app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', '10'))  # Repeats of one statement
+    app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')  # Werkzeug method
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', '1'))  # 0 hashes on the request thread
+    app.config['PASSWORD_HASH_MAX_CONCURRENCY'] = int(os.getenv('PASSWORD_HASH_MAX_CONCURRENCY', '4'))
+    app.config['PASSWORD_HASH_WAIT_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_WAIT_TIMEOUT', '5'))
+    app.config['LOG_BODY_SAMPLE_RATE'] = float(os.getenv('LOG_BODY_SAMPLE_RATE', '0'))  # Bodies logged at DEBUG
+    app.config['JSON_BACKEND'] = os.getenv('JSON_BACKEND', 'auto')  # auto, orjson or stdlib
+    app.config['RECOMMENDATION_INDEX_MAX_AGE'] = int(os.getenv('RECOMMENDATION_INDEX_MAX_AGE', '600'))  # Seconds
+    app.config['RECOMMENDATION_TOP_K'] = int(os.getenv('RECOMMENDATION_TOP_K', '50'))
+    app.config['RECOMMENDATION_CACHE_ENTRIES'] = int(os.getenv('RECOMMENDATION_CACHE_ENTRIES', '10000'))
+    app.config['RECOMMENDATION_CACHE_TTL'] = int(os.getenv('RECOMMENDATION_CACHE_TTL', '300'))
+    app.config['DELETION_WORKER'] = os.getenv('DELETION_WORKER', 'true').lower() in ('1', 'true', 'yes')
+    app.config['DELETION_CHUNK_SIZE'] = int(os.getenv('DELETION_CHUNK_SIZE', '1000'))  # Edges per transaction
+    app.config['DELETION_CHUNK_PAUSE'] = float(os.getenv('DELETION_CHUNK_PAUSE', '0.05'))  # Seconds between chunks
+    app.config['DELETION_POLL_INTERVAL'] = float(os.getenv('DELETION_POLL_INTERVAL', '5'))  # Seconds
+    app.config['DELETION_STALE_AFTER'] = int(os.getenv('DELETION_STALE_AFTER', '300'))  # Seconds without progress
+    if test_config:
+        app.config.update(test_config)
+
+    init_json_provider(app)
+    db.init_app(app)
+    init_user_cache(app)
+    init_instrumentation(app)
+    init_password_hashing(app)
+    init_token_revocation(app, JWTManager(app))
+    init_recommendations(app)
+    init_deletion_worker(app)
+
+    register_blueprints(app)
+    register_commands(app)
+    app.register_error_handler(404, page_not_found)
+    return app
+
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', debug=True)
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    create_app().run(host='0.0.0.0', debug=os.getenv('FLASK_ENV') == 'development')
@@ -6,20 +6,33 @@ getting, editing, and deleting a user's bio.
 """
 from logging import getLogger
 import sqlalchemy.exc
-from utils import return_500_response, get_user_or_404, log_request, validate_required_fields
+from sqlalchemy import or_
+from utils import return_500_response, get_user_or_404, create_user_token, validate_required_fields
 from flask import Blueprint, jsonify, request
 from models import db, User
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import get_jwt, jwt_required
+from search_index import index_user
+from password_hashing import hash_password, verify_password
+from token_revocation import get_revocation_store
+from serializers import AUTH_USER
 
 auth_bp = Blueprint('auth_routes', __name__)
 logger = getLogger(__name__)
 
+def _upgrade_password_hash(user, new_hash):
+    """ Store a hash made with the current method; a failure here must not fail the login """
+    try:
+        user.password = new_hash
+        db.session.commit()
+        logger.info('Upgraded password hash for user: %s', user.username)
+    except sqlalchemy.exc.SQLAlchemyError as exception:
+        logger.warning('Could not upgrade password hash for user %s: %s', user.username, str(exception))
+        db.session.rollback()
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     """ Log in a user """
     try:
-        log_request(request)
         logger.debug('Attempting to log in user with username: %s', request.get_json().get('username', ''))
         data = request.get_json()
 
@@ -32,22 +45,25 @@ def login():
         username = data.get('username')
         password = data.get('password')
 
-        user, error_response, status = get_user_or_404(username)
+        # The password hash is never cached, so login always reads the row
+        user, error_response, status = get_user_or_404(username, fresh=True)
         if error_response:
             return error_response, status
 
-        if not check_password_hash(user.password, password):
+        verified, error_response, status = verify_password(user.password, password)
+        if error_response:
+            return error_response, status
+        matches, upgraded_hash = verified
+        if not matches:
             return jsonify({'message': 'Invalid username or password'}), 401
+        if upgraded_hash:
+            _upgrade_password_hash(user, upgraded_hash)
 
-        access_token = create_access_token(identity=user.username)
+        access_token = create_user_token(user)
 
         return jsonify({
             'message': 'Logged in successfully',
-            'user_id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'bio': user.bio,
-            'date_joined': user.created_at,
+            **AUTH_USER.serialize(user),
             'access_token': access_token
         }), 200
     except sqlalchemy.exc.SQLAlchemyError as exception:
@@ -60,11 +76,46 @@ def login():
         db.session.rollback()
         return return_500_response(exception=sql_error)
 
+def _validate_registration(username, password, email, bio):
+    """ Check a registration's field types and lengths without touching the database """
+    text_fields = {'username': username, 'password': password, 'email': email}
+    if bio is not None:
+        text_fields['bio'] = bio
+    not_text = [name for name, value in text_fields.items() if not isinstance(value, str) or not value.strip()]
+    if not_text:
+        return jsonify({'message': 'Must be non-empty strings: ' + ', '.join(not_text)}), 400
+    too_long = [name for name in ('username', 'email', 'bio')
+                if name in text_fields and len(text_fields[name]) > getattr(User, name).type.length]
+    if too_long:
+        return jsonify({'message': 'Too long: ' + ', '.join(too_long)}), 400
+    return None, None
+
+def _conflicting_field(exception):
+    """ The unique column named by an IntegrityError from inserting a user, or None if it names neither """
+    message = str(exception.orig)
+    # MySQL: "Duplicate entry 'x' for key 'users.email'"; SQLite: "UNIQUE constraint failed: users.email"
+    key = message.rsplit('for key', 1)[-1] if 'for key' in message else message.rsplit('failed:', 1)[-1]
+    for field in ('email', 'username'):
+        if field in key:
+            return field
+    return None
+
+def _registration_conflict(exception, username, email):
+    """ Return a 409 naming the field that is already taken """
+    field = _conflicting_field(exception)
+    if field is None:
+        # Unrecognized driver message: look the clash up, which only costs a query on this rare path
+        taken = User.query.filter(or_(User.username == username, User.email == email)).first()
+        if taken is None:
+            raise exception
+        field = 'username' if taken.username.lower() == username.lower() else 'email'
+    logger.info('Registration rejected, %s already taken', field)
+    return jsonify({'message': f'{field.capitalize()} already taken', 'field': field}), 409
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     """ Register a new user """
     try:
-        log_request(request)
         logger.debug('Attempting to register user with username: %s', request.get_json().get('username', ''))
 
         data = request.get_json()
@@ -80,26 +131,34 @@ def register():
             return jsonify({'error': 'Missing fields in request: ' + (', '.join(missing_fields))}), 400
 
         bio = data.get('bio')
+        # Forms send an empty bio when the field is left blank; store that as no bio
+        if isinstance(bio, str) and not bio.strip():
+            bio = None
 
-        user_exists = User.query.filter_by(username=username).first()
-        email_exists = User.query.filter_by(email=email).first()
+        error_response, status = _validate_registration(username, password, email, bio)
+        if error_response:
+            return error_response, status
 
-        if user_exists is not None or email_exists is not None:
-            return jsonify({'message': 'Username/Email already taken'}), 401
+        # Only requests that passed the checks above pay for the hash
+        hashed_password, error_response, status = hash_password(password)
+        if error_response:
+            return error_response, status
 
-        hashed_password = generate_password_hash(password)
+        # The unique constraints decide whether the name and email are free, so concurrent signups cannot both win
         new_user = User(username=username, password=hashed_password, email=email, bio=bio)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except sqlalchemy.exc.IntegrityError as exception:
+            db.session.rollback()
+            return _registration_conflict(exception, username, email)
+        index_user(new_user)
 
-        access_token = create_access_token(identity=new_user.username)
+        access_token = create_user_token(new_user)
 
         return jsonify({
             'message': 'Registered successfully',
-            'username': new_user.username,
-            'email': new_user.email,
-            'bio': new_user.bio,
-            'date_joined': str(new_user.created_at),
+            **AUTH_USER.serialize(new_user),
             'access_token': access_token
         }), 200
     except sqlalchemy.exc.SQLAlchemyError as exception:
@@ -111,3 +170,10 @@ def register():
         logger.error('Unexpected error in /register: %s', str(sql_error))
         db.session.rollback()
         return return_500_response(exception=sql_error)
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """ Revoke the token used for this request """
+    get_revocation_store().revoke_token(get_jwt())
+    return jsonify({'message': 'Logged out successfully'}), 200
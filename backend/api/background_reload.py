@@ -0,0 +1,61 @@
+"""
+background_reload.py
+-----------------------------
+This module keeps per-process in-memory indexes (the search index, the follow
+graph) fresh without rebuilding them on a request thread. Only one load runs at
+a time in a process: the first load blocks the requests that need the index
+(unless they have a fallback), and once it is older than its max age a daemon
+thread rebuilds it while requests keep reading the current copy.
+"""
+from logging import getLogger
+from threading import Lock, Thread
+import time
+from flask import current_app
+
+logger = getLogger(__name__)
+
+
+class BackgroundReload:
+    """ Single-flight loader for one index; load() rebuilds it and loaded_at() returns its monotonic load time """
+
+    def __init__(self, name, load, loaded_at):
+        self.name = name
+        self._load = load
+        self._loaded_at = loaded_at
+        self._lock = Lock()
+
+    def ensure_fresh(self, max_age, wait=True):
+        """
+        Load now if nothing is loaded yet, or start a background reload once older than max_age seconds.
+        With wait=False the first load also runs in the background, and callers check whether it is done.
+        """
+        loaded_at = self._loaded_at()
+        if loaded_at is None and wait:
+            # Requests arriving during the first load wait for it instead of repeating it
+            with self._lock:
+                if self._loaded_at() is None:
+                    self._load()
+            return
+        if loaded_at is not None and time.monotonic() - loaded_at < max_age:
+            return
+        # Held until the reload thread finishes, so a reload already running is not started again
+        if not self._lock.acquire(blocking=False): # pylint: disable=consider-using-with
+            return
+        app_obj = current_app._get_current_object() # pylint: disable=protected-access
+        try:
+            Thread(target=self._reload, args=(app_obj,), name=f'{self.name}-reload', daemon=True).start()
+        except RuntimeError:
+            self._lock.release()
+            raise
+
+    def _reload(self, app_obj):
+        started = time.monotonic()
+        try:
+            with app_obj.app_context():
+                self._load()
+            logger.info('Reloaded the %s in %.2fs', self.name, time.monotonic() - started)
+        except Exception as error: # pylint: disable=broad-exception-caught
+            # The current copy keeps serving and the next request past max_age tries again
+            logger.error('Reloading the %s failed: %s', self.name, error)
+        finally:
+            self._lock.release()
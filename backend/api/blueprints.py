@@ -9,6 +9,9 @@ from user_routes import user_bp
 from follow_routes import follow_bp
 from search_routes import search_bp
 from settings_routes import settings_bp
+from health_routes import health_bp
+from metrics_routes import metrics_bp
+from request_logging import register_request_logging
 
 def register_blueprints(app_obj=None):
     """ Register all blueprints for the application """
@@ -18,3 +21,6 @@ def register_blueprints(app_obj=None):
     app_obj.register_blueprint(follow_bp, url_prefix='/api/users')
     app_obj.register_blueprint(search_bp, url_prefix='/api/users')
     app_obj.register_blueprint(settings_bp, url_prefix='/api/users')
+    app_obj.register_blueprint(health_bp, url_prefix='/api')
+    app_obj.register_blueprint(metrics_bp)
+    register_request_logging(app_obj)
@@ -0,0 +1,166 @@
+"""
+commands.py
+-----------------------------
+This module registers the Flask CLI commands for maintaining the database.
+Run them with `flask --app api/api.py <group> <command>` from the backend folder.
+"""
+from logging import getLogger
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from models import db, DeletionJob
+from relationships import reconcile_follow_counts
+from migrations import MigrationError, check_schema, pending_migrations, run_migrations
+from deletion import DONE, process_pending_jobs, retry_job
+from password_hashing import BatchHasher
+from user_transfer import (FORMATS, TransferError, export_follows, export_users, file_format, import_follows,
+                           import_users, open_transfer_file)
+
+logger = getLogger(__name__)
+
+counters_cli = AppGroup('counters', help='Maintain the denormalized follower/following counters.')
+schema_cli = AppGroup('schema', help='Apply and verify schema migrations.')
+deletions_cli = AppGroup('deletions', help='Inspect and run account deletion jobs.')
+users_cli = AppGroup('users', help='Import and export users and follower edges in bulk.')
+
+
+@counters_cli.command('reconcile')
+@click.option('--batch-size', default=1000, show_default=True, help='Users checked per batch.')
+@click.option('--dry-run', is_flag=True, help='Report drift without writing.')
+def reconcile_counters(batch_size, dry_run):
+    """ Recompute follower/following counters from the followers table and repair any drift """
+    repaired = reconcile_follow_counts(batch_size=batch_size, dry_run=dry_run)
+    logger.info('Counter reconciliation found %s drifted users (dry run: %s)', repaired, dry_run)
+    click.echo(f'{"Found" if dry_run else "Repaired"} {repaired} users with drifted counters')
+
+
+@schema_cli.command('status')
+def schema_status():
+    """ List migrations that have not been applied """
+    pending = pending_migrations(db.engine)
+    for version, description in pending:
+        click.echo(f'pending  {version}  {description}')
+    click.echo(f'{len(pending)} pending migrations')
+
+
+@schema_cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='Print the statements without running them.')
+def schema_migrate(dry_run):
+    """ Apply pending migrations in order """
+    try:
+        results = run_migrations(db.engine, dry_run=dry_run)
+    except MigrationError as error:
+        raise click.ClickException(str(error)) from error
+    for version, description, statements in results:
+        click.echo(f'{"would apply" if dry_run else "applied"}  {version}  {description}')
+        for statement in statements:
+            click.echo(f'    {statement}')
+    if not results:
+        click.echo('Schema is up to date')
+
+
+@schema_cli.command('check')
+def schema_check():
+    """ Exit non-zero if the database is missing migrations, tables, columns or indexes from the models """
+    problems = check_schema(db.engine, db.metadata)
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise SystemExit(1)
+    click.echo('Schema matches the models')
+
+
+@deletions_cli.command('status')
+@click.option('--all', 'show_all', is_flag=True, help='Include finished jobs.')
+def deletions_status(show_all):
+    """ List deletion jobs with their progress """
+    query = DeletionJob.query.order_by(DeletionJob.created_at)
+    if not show_all:
+        query = query.filter(DeletionJob.status != DONE)
+    jobs = query.all()
+    for job in jobs:
+        click.echo(f'{job.status:<8} {job.id}  {job.username} ({job.user_id})  '
+                   f'{job.edges_removed}/{job.edges_total} edges  updated {job.updated_at}'
+                   + (f'  error: {job.error}' if job.error else ''))
+    click.echo(f'{len(jobs)} jobs')
+
+
+@deletions_cli.command('run')
+@click.option('--max-jobs', type=int, help='Stop after this many jobs.')
+def deletions_run(max_jobs):
+    """ Run pending deletion jobs in this process until none are left """
+    processed = process_pending_jobs(max_jobs=max_jobs)
+    click.echo(f'Ran {processed} deletion jobs')
+
+
+@deletions_cli.command('retry')
+@click.argument('job_id')
+def deletions_retry(job_id):
+    """ Queue a failed deletion job again """
+    if not retry_job(job_id):
+        raise click.ClickException(f'No failed deletion job with id {job_id}')
+    click.echo(f'Queued {job_id} again')
+
+
+
+def _transfer_options(command):
+    """ The file and batching options shared by users import and users export """
+    command = click.option('--users', 'users_path', help='Users file (CSV or NDJSON); - for stdin/stdout.')(command)
+    command = click.option('--follows', 'follows_path', help='Follower edges file; - for stdin/stdout.')(command)
+    command = click.option('--format', 'requested_format', type=click.Choice(('auto',) + FORMATS), default='auto',
+                           show_default=True, help='File format; auto picks ndjson for .ndjson/.jsonl files.')(command)
+    return click.option('--batch-size', default=1000, show_default=True, help='Rows per statement.')(command)
+
+
+def _echo_summary(kind, summary):
+    click.echo(f'{kind}: {summary.written} imported, {summary.skipped} already present or repeated, '
+               f'{summary.invalid} rejected ({summary.read} read)')
+
+
+@users_cli.command('import')
+@_transfer_options
+@click.option('--hash-workers', default=0, show_default=True,
+              help='Processes hashing plain-text passwords in parallel; 0 hashes in this process.')
+def users_import(users_path, follows_path, requested_format, batch_size, hash_workers):
+    """ Import users, then follower edges between them; rows that already exist are skipped """
+    if not users_path and not follows_path:
+        raise click.UsageError('Give --users, --follows or both')
+
+    def report(message):
+        click.echo(message, err=True)
+
+    try:
+        if users_path:
+            method = current_app.config['PASSWORD_HASH_METHOD']
+            with open_transfer_file(users_path, 'r') as stream, BatchHasher(method, hash_workers) as hasher:
+                summary = import_users(stream, file_format(users_path, requested_format), batch_size, hasher, report)
+            _echo_summary('users', summary)
+        if follows_path:
+            with open_transfer_file(follows_path, 'r') as stream:
+                summary = import_follows(stream, file_format(follows_path, requested_format), batch_size, report)
+            _echo_summary('follows', summary)
+    except (OSError, TransferError) as error:
+        raise click.ClickException(str(error)) from error
+
+
+@users_cli.command('export')
+@_transfer_options
+def users_export(users_path, follows_path, requested_format, batch_size):
+    """ Export users (with password hashes) and follower edges, leaving out accounts being deleted """
+    if not users_path and not follows_path:
+        raise click.UsageError('Give --users, --follows or both')
+    for path, export, kind in ((users_path, export_users, 'users'), (follows_path, export_follows, 'follows')):
+        if not path:
+            continue
+        with open_transfer_file(path, 'w') as stream:
+            count = export(stream, file_format(path, requested_format), batch_size)
+        # Counts go to stderr so they do not end up in an export written to stdout
+        click.echo(f'Exported {count} {kind}', err=True)
+
+
+def register_commands(app_obj):
+    """ Register all CLI command groups for the application """
+    app_obj.cli.add_command(counters_cli)
+    app_obj.cli.add_command(schema_cli)
+    app_obj.cli.add_command(deletions_cli)
+    app_obj.cli.add_command(users_cli)
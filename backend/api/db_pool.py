@@ -0,0 +1,98 @@
+"""
+db_pool.py
+-----------------------------
+This module configures the SQLAlchemy connection pool from the environment and
+tracks live pool statistics (checked-out connections, overflow, checkout wait time).
+"""
+import os
+from threading import Lock
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """ Running totals for connection checkouts from one pool """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        """ Record one checkout attempt and how long it waited """
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self):
+        """ Return the totals as a dict """
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'total_wait_seconds': round(self.total_wait, 6),
+                'avg_wait_seconds': round(self.total_wait / self.checkouts, 6) if self.checkouts else 0.0,
+                'max_wait_seconds': round(self.max_wait, 6),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ QueuePool that records how long each checkout waits for a connection """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+def build_engine_options(database_uri):
+    """ Build SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* environment variables """
+    if not database_uri or database_uri.startswith('sqlite'):
+        # SQLite uses its own single-connection pools; sizing options do not apply
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        # Recycle before MySQL's wait_timeout (or a proxy's idle timeout) drops the connection
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', 'true'),
+    }
+
+
+def get_pool_status(engine):
+    """ Return live statistics for an engine's pool """
+    pool = engine.pool
+    status = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,  # pylint: disable=protected-access
+            'timeout_seconds': pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        status.update(pool.stats.snapshot())
+    return status
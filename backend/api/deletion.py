@@ -0,0 +1,209 @@
+"""
+deletion.py
+-----------------------------
+This module deletes accounts in two steps so no request holds locks on a large
+share of the followers table:
+
+1. start_user_deletion tombstones the user (users.deleted_at) and records a
+   deletion job in the request's transaction. The account disappears from every
+   lookup, list and search right away.
+2. A background thread in each API worker claims pending jobs and removes the
+   user's edges in chunks of DELETION_CHUNK_SIZE, one short transaction each,
+   decrementing the other side's counters as it goes. Once no edges are left the
+   user row is deleted.
+
+Jobs live in the deletion_jobs table, so progress can be read from any worker and
+a job interrupted by a restart is picked up again once its heartbeat is older
+than DELETION_STALE_AFTER seconds. `flask deletions run` processes jobs from the
+command line when the in-process worker is disabled.
+"""
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+import os
+from threading import Event, Lock, Thread
+import time
+import uuid
+from flask import current_app
+from sqlalchemy import and_, delete, or_, select, update
+from models import db, DeletionJob, User
+from relationships import commit_with_deadlock_retry, release_edges_chunk
+from recommendations import record_user_removal
+from user_cache import mark_users_stale
+
+logger = getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def _utcnow():
+    # Naive UTC, matching how the DateTime columns are stored
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def start_user_deletion(user):
+    """ Tombstone a user and queue the job that removes their edges; commits and returns the DeletionJob """
+    job = DeletionJob(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        username=user.username,
+        status=PENDING,
+        edges_total=user.follower_count + user.following_count,
+        edges_removed=0,
+        updated_at=_utcnow(),
+    )
+    user.deleted_at = _utcnow()
+    db.session.add(job)
+    # Suggestions stop offering the user now rather than when the job finishes
+    record_user_removal(db.session, user.id)
+    db.session.commit()
+    return job
+
+
+def _claim_next_job(stale_after):
+    """ Mark the oldest pending (or abandoned running) job as running in this process and return it, or None """
+    now = _utcnow()
+    claimable = or_(DeletionJob.status == PENDING,
+                    and_(DeletionJob.status == RUNNING, DeletionJob.updated_at < now - timedelta(seconds=stale_after)))
+    candidate = db.session.execute(
+        select(DeletionJob.id, DeletionJob.status, DeletionJob.updated_at)
+        .where(claimable).order_by(DeletionJob.created_at).limit(1)).first()
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    # Only one worker wins the compare-and-set on (status, updated_at)
+    claimed = db.session.execute(
+        update(DeletionJob)
+        .where(DeletionJob.id == candidate.id, DeletionJob.status == candidate.status,
+               DeletionJob.updated_at == candidate.updated_at)
+        .values(status=RUNNING, updated_at=now, error=None)).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.get(DeletionJob, candidate.id)
+
+
+def _release_chunk(job, chunk_size):
+    removed = release_edges_chunk(job.user_id, chunk_size)
+    job.edges_removed += removed
+    job.updated_at = _utcnow()
+    return removed
+
+
+def _run_job(job, chunk_size, chunk_pause):
+    """ Remove the job's edges chunk by chunk, then delete the user row """
+    logger.info('Deletion job %s started for user %s', job.id, job.user_id)
+    while True:
+        removed = commit_with_deadlock_retry(lambda: _release_chunk(job, chunk_size))
+        if not removed:
+            break
+        time.sleep(chunk_pause)
+
+    # No edges are left, so the cascade on followers has nothing to do
+    mark_users_stale(db.session, [job.user_id])
+    db.session.execute(delete(User.__table__).where(User.__table__.c.id == job.user_id))
+    job.status = DONE
+    job.finished_at = _utcnow()
+    db.session.commit()
+    logger.info('Deletion job %s finished after removing %s edges', job.id, job.edges_removed)
+
+
+def process_pending_jobs(max_jobs=None):
+    """ Run claimable jobs one after another until none are left (or max_jobs ran); returns the number run """
+    config = current_app.config
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = _claim_next_job(config.get('DELETION_STALE_AFTER', 300))
+        if job is None:
+            return processed
+        processed += 1
+        try:
+            _run_job(job, config.get('DELETION_CHUNK_SIZE', 1000), config.get('DELETION_CHUNK_PAUSE', 0.05))
+        except Exception as error: # pylint: disable=broad-exception-caught
+            logger.error('Deletion job %s failed: %s', job.id, error)
+            db.session.rollback()
+            db.session.execute(update(DeletionJob).where(DeletionJob.id == job.id).values(
+                status=FAILED, error=str(error)[:255], updated_at=_utcnow()))
+            db.session.commit()
+    return processed
+
+
+def retry_job(job_id):
+    """ Queue a failed job again; returns False if there is no failed job with that id """
+    retried = db.session.execute(
+        update(DeletionJob).where(DeletionJob.id == job_id, DeletionJob.status == FAILED)
+        .values(status=PENDING, updated_at=_utcnow())).rowcount
+    db.session.commit()
+    return bool(retried)
+
+
+def job_status(job):
+    """ Public view of a DeletionJob """
+    return {
+        'jobId': job.id,
+        'status': job.status,
+        'edgesTotal': job.edges_total,
+        'edgesRemoved': job.edges_removed,
+        'createdAt': job.created_at,
+        'updatedAt': job.updated_at,
+        'finishedAt': job.finished_at,
+        'error': job.error,
+    }
+
+
+class DeletionWorker:
+    """ Daemon thread running deletion jobs for one process, started lazily after any fork """
+
+    def __init__(self, app_obj, poll_interval=5):
+        self.app = app_obj
+        self.poll_interval = poll_interval
+        self._wake = Event()
+        self._lock = Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        """ Start the thread in this process if it is not running (threads do not survive gunicorn's fork) """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = Thread(target=self._run, name='deletion-worker', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """ Look for new jobs now instead of at the next poll """
+        self.ensure_started()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            # Polling also picks up jobs queued by other workers and jobs abandoned by a restart
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    process_pending_jobs()
+            except Exception as error: # pylint: disable=broad-exception-caught
+                logger.error('Deletion worker error: %s', error)
+
+
+def init_deletion_worker(app_obj):
+    """ Create the per-process deletion worker unless DELETION_WORKER is off """
+    if not app_obj.config.get('DELETION_WORKER', True):
+        app_obj.extensions['deletion_worker'] = None
+        return None
+    worker = DeletionWorker(app_obj, poll_interval=app_obj.config.get('DELETION_POLL_INTERVAL', 5))
+    app_obj.extensions['deletion_worker'] = worker
+    # The first request in each worker process starts its thread
+    app_obj.before_request(worker.ensure_started)
+    return worker
+
+
+def wake_deletion_worker():
+    """ Nudge this process's worker after queueing a job; a no-op when the worker is disabled """
+    worker = current_app.extensions.get('deletion_worker')
+    if worker is not None:
+        worker.wake()
@@ -4,56 +4,136 @@ user_profile_routes.py
 This module contains the routes for user profile management, including
 getting, editing, and deleting a user's bio.
 """
+from collections import namedtuple
 from logging import getLogger
 import sqlalchemy.exc
+from sqlalchemy import and_, select
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
-from utils import get_user_or_404, check_for_token, log_request
-from models import db, User
+from utils import get_user_or_404, get_authorized_user, check_for_token, validate_required_fields
+from models import db, User, followers as followers_table
+from pagination import get_page_args, split_page
+from relationships import (
+    resolve_user_ids, add_follow_edge, remove_follow_edge, add_follow_edges, remove_follow_edges, get_follow_counts,
+    get_viewer_flags, commit_with_deadlock_retry
+)
+from streaming import get_stream_format, iterate_rows, stream_response
+from http_cache import make_etag, not_modified, with_cache_headers
+from serializers import USER_CARD
+from recommendations import get_recommender
 
 follow_bp = Blueprint('follow_bp', __name__)
 logger = getLogger(__name__)
 
+MAX_BATCH_SIZE = 100
+DEFAULT_SUGGESTIONS = 20
+
+# One side of a user's edges. edge_columns is (column holding user_id, column holding the related user);
+# also_follows_id, when set, keeps only the related users who also follow that user
+RelatedUsers = namedtuple('RelatedUsers', ['key', 'user_id', 'edge_columns', 'also_follows_id'])
+FOLLOWER_EDGES = (followers_table.c.followee_id, followers_table.c.follower_id)
+FOLLOWING_EDGES = (followers_table.c.follower_id, followers_table.c.followee_id)
+
+def _follow_change_response(message, follower_id, followee_id, followee_username):
+    """
+    Build the follow/unfollow response from the changed edge and the new counts.
+    Clients that still want the full following list can opt in with ?include=following.
+    """
+    counts = get_follow_counts([follower_id, followee_id])
+    body = {
+        'message': message,
+        'edge': {'followerId': follower_id, 'followeeId': followee_id, 'username': followee_username},
+        'followingCount': counts[follower_id][1],
+        'followerCount': counts[followee_id][0]
+    }
+    if request.args.get('include') == 'following':
+        following = (db.session.query(*USER_CARD.columns(USER_CARD.default_fields))
+                     .join(followers_table, followers_table.c.followee_id == User.id)
+                     .filter(followers_table.c.follower_id == follower_id, User.deleted_at.is_(None))
+                     .order_by(followers_table.c.followee_id))
+        body['following'] = [USER_CARD.serialize(row) for row in following]
+    return jsonify(body), 200
+
+def _related_users_query(related, columns):
+    """ Select columns of the users on the other side of related.user_id's edges """
+    user_column, other_column = related.edge_columns
+    query = (db.session.query(*columns)
+             .join(followers_table, other_column == User.id)
+             .filter(user_column == related.user_id, User.deleted_at.is_(None)))
+    if related.also_follows_id is not None:
+        # Self-join on the (follower_id, followee_id) primary key: one point lookup per related user
+        also_follows = followers_table.alias('also_follows')
+        query = query.join(also_follows, and_(also_follows.c.follower_id == other_column,
+                                              also_follows.c.followee_id == related.also_follows_id))
+    return query
+
+def _page_related_users(related, page_args, fields):
+    """ Return one keyset page of the users on the other side of related.user_id's edges, or 304 if unchanged """
+    other_column = related.edge_columns[1]
+    limit, cursor = page_args
+    # Only the requested columns, plus the id and version the cursor and ETag need
+    query = _related_users_query(related, USER_CARD.columns(fields, User.id, User.version))
+    if cursor:
+        query = query.filter(other_column > cursor[0])
+    page, next_cursor = split_page(query.order_by(other_column).limit(limit + 1).all(), limit,
+                                   lambda related: [related.id])
+
+    # The page is identified by every selected value: counters change without bumping the row version
+    etag = make_etag(related.key, related.user_id, related.also_follows_id, limit, cursor, fields,
+                     [tuple(row) for row in page], next_cursor)
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
+
+    users = [USER_CARD.serialize(row, fields) for row in page]
+    return with_cache_headers(jsonify({related.key: users, 'nextCursor': next_cursor}), etag), 200
+
+def _stream_related_users(stream_format, related, fields):
+    """ Stream every user on the other side of related.user_id's edges as plain row tuples """
+    query = _related_users_query(related, USER_CARD.columns(fields)).order_by(related.edge_columns[1])
+    return stream_response(stream_format, related.key, iterate_rows(query),
+                           lambda row: USER_CARD.serialize(row, fields))
+
+def _read_also_follows(args):
+    """
+    Resolve the optional alsoFollows query parameter to a user id.
+    Returns (id or None, None, None) or (None, error_response, 404).
+    """
+    username = args.get('alsoFollows')
+    if not username:
+        return None, None, None
+    user_ids = resolve_user_ids([username])
+    if username not in user_ids:
+        return None, jsonify({'message': 'No user found with the alsoFollows username'}), 404
+    return user_ids[username], None, None
+
 @follow_bp.route('/<string:username>/follow', methods=['POST'])
 @jwt_required()
 def follow_user(username):
     """Follow a user"""
     try:
-        log_request(request)
         logger.debug('Following user %s', username)
-        current_user_identity, error_response, status = check_for_token()
+        current_user, error_response, status = check_for_token()
         if error_response:
             return error_response, status
 
-        if current_user_identity == username:  # User cannot follow themselves
+        if current_user.username == username:  # User cannot follow themselves
             return jsonify({'message': 'You cannot follow yourself'}), 400
 
-        user_to_follow = User.query.filter_by(username=username).first()
-
-        if user_to_follow is None:
+        # The follower comes from the token; only the followee needs a lookup
+        user_ids = resolve_user_ids([username])
+        if username not in user_ids:
             return jsonify({'message': 'No user found with that username'}), 404
 
-        current_user_obj = User.query.filter_by(username=current_user_identity).first()
-        if not current_user_obj:
-            return jsonify({'message': 'Current user not found'}), 404
+        current_user_id, followee_id = current_user.id, user_ids[username]
+        if current_user_id == followee_id:  # Same account under a different letter case
+            return jsonify({'message': 'You cannot follow yourself'}), 400
 
-        if user_to_follow in current_user_obj.following:
+        # Insert-or-ignore on the edge primary key instead of loading the following collection
+        if not commit_with_deadlock_retry(lambda: add_follow_edge(current_user_id, followee_id)):
             return jsonify({'message': 'You are already following this user'}), 400
 
-        current_user_obj.following.append(user_to_follow)
-        db.session.commit()
-
-        following_list = [{
-            'username': user.username,
-            'userId': user.id,
-            'email': user.email,
-            'bio': user.bio,
-            'dateJoined': str(user.created_at)} for user in current_user_obj.following]
-
-        return jsonify({
-            'message': 'Followed user successfully',
-            'following': following_list
-        }), 200
+        return _follow_change_response('Followed user successfully', current_user_id, followee_id, username)
     except sqlalchemy.exc.SQLAlchemyError:
         logger.error('Database error while following user %s', username)
         db.session.rollback()
@@ -69,41 +149,25 @@ def follow_user(username):
 def unfollow_user(username):
     """Unfollow a user"""
     try:
-        log_request(request)
         logger.debug('Unfollowing user %s', username)
-        current_user_identity, error_response, status = check_for_token()
+        current_user, error_response, status = check_for_token()
         if error_response:
             return error_response, status
 
-        if current_user_identity == username:  # User cannot unfollow themselves
+        if current_user.username == username:  # User cannot unfollow themselves
             return jsonify({'message': 'You cannot unfollow yourself'}), 400
 
-        user_to_unfollow = User.query.filter_by(username=username).first()
-
-        if user_to_unfollow is None:
+        user_ids = resolve_user_ids([username])
+        if username not in user_ids:
             return jsonify({'message': 'User not found'}), 404
 
-        current_user_obj = User.query.filter_by(username=current_user_identity).first()
-        if not current_user_obj:  # Should not happen
-            return jsonify({'message': 'Current user not found'}), 404 # More specific message
+        current_user_id, followee_id = current_user.id, user_ids[username]
 
-        if user_to_unfollow not in current_user_obj.following:
+        # A single DELETE on the edge; no rows means there was nothing to unfollow
+        if not commit_with_deadlock_retry(lambda: remove_follow_edge(current_user_id, followee_id)):
             return jsonify({'message': 'You are not following this user'}), 400
 
-        current_user_obj.following.remove(user_to_unfollow)
-        db.session.commit()
-
-        # Serialize the 'following' list to be JSON-friendly
-        following_list = [{'username': user.username,
-                           'userId': user.id,
-                           'email': user.email,
-                           'bio': user.bio,
-                           'dateJoined': str(user.created_at)} for user in current_user_obj.following]
-
-        return jsonify({
-            'message': f'You have unfollowed {username}',
-            'following': following_list # Return list of usernames
-        }), 200
+        return _follow_change_response(f'You have unfollowed {username}', current_user_id, followee_id, username)
     except sqlalchemy.exc.SQLAlchemyError:
         logger.error('Database error while unfollowing user %s', username)
         db.session.rollback()  # Ensure rollback on error
@@ -118,20 +182,34 @@ def unfollow_user(username):
 def get_followers(username):
     """Get followers of a user"""
     try:
-        log_request(request)
         logger.debug('Getting followers for user %s', username)
 
+        stream_format, error_response, status = get_stream_format(request.args)
+        if error_response:
+            return error_response, status
+
+        page_args, error_response, status = get_page_args(request.args)
+        if error_response:
+            return error_response, status
+
+        fields, error_response, status = USER_CARD.parse_fields(request.args)
+        if error_response:
+            return error_response, status
+
         user, error_response, status = get_user_or_404(username)
         if error_response:
             return error_response, status
 
-        followers = [{'username': follower.username,
-                      'dateJoined': str(follower.created_at),
-                      'userId': follower.id,
-                      'email': follower.email,
-                      'bio': follower.bio} for follower in user.followers]
+        also_follows_id, error_response, status = _read_also_follows(request.args)
+        if error_response:
+            return error_response, status
+
+        related = RelatedUsers('followers', user.id, FOLLOWER_EDGES, also_follows_id)
+        if stream_format:
+            return _stream_related_users(stream_format, related, fields)
 
-        return jsonify({'followers': followers}), 200
+        # Keyset scan over the (followee_id, follower_id) edge index
+        return _page_related_users(related, page_args, fields)
     except sqlalchemy.exc.SQLAlchemyError:
         logger.error('Database error while retrieving followers for user %s', username)
         db.session.rollback()
@@ -146,20 +224,34 @@ def get_followers(username):
 def get_following(username):
     """Get users that a user is following"""
     try:
-        log_request(request)
         logger.debug('Getting following for user %s', username)
 
+        stream_format, error_response, status = get_stream_format(request.args)
+        if error_response:
+            return error_response, status
+
+        page_args, error_response, status = get_page_args(request.args)
+        if error_response:
+            return error_response, status
+
+        fields, error_response, status = USER_CARD.parse_fields(request.args)
+        if error_response:
+            return error_response, status
+
         user, error_response, status = get_user_or_404(username)
         if error_response:
             return error_response, status
 
-        following = [{'username': followed.username,
-                      'dateJoined': str(followed.created_at),
-                      'userId': followed.id,
-                      'email': followed.email,
-                      'bio': followed.bio} for followed in user.following]
+        also_follows_id, error_response, status = _read_also_follows(request.args)
+        if error_response:
+            return error_response, status
+
+        related = RelatedUsers('following', user.id, FOLLOWING_EDGES, also_follows_id)
+        if stream_format:
+            return _stream_related_users(stream_format, related, fields)
 
-        return jsonify({'following': following}), 200
+        # Keyset scan over the (follower_id, followee_id) primary key
+        return _page_related_users(related, page_args, fields)
 
     except sqlalchemy.exc.SQLAlchemyError:
         logger.error('Database error while retrieving followed users for %s', username)
@@ -170,3 +262,214 @@ def get_following(username):
         logger.error('Unexpected error while retrieving followed users for %s: %s', username, str(sql_error))
         db.session.rollback()
         return jsonify({'message': f'An unexpected error occurred: {str(sql_error)}'}), 500
+
+def _read_suggestion_limit(args, top_k):
+    """ Read the limit query parameter for suggestions; returns (limit, None, None) or (None, error_response, 400) """
+    try:
+        limit = int(args.get('limit', min(DEFAULT_SUGGESTIONS, top_k)))
+    except ValueError:
+        return None, jsonify({'message': 'limit must be an integer'}), 400
+    if limit < 1 or limit > top_k:
+        return None, jsonify({'message': f'limit must be between 1 and {top_k}'}), 400
+    return limit, None, None
+
+@follow_bp.route('/<string:username>/suggestions', methods=['GET'])
+@jwt_required()
+def get_suggestions(username):
+    """Suggest users to follow, ranked from friends of friends and follow-backs"""
+    try:
+        logger.debug('Getting follow suggestions for user %s', username)
+
+        user, error_response, status = get_authorized_user(username, 'view these suggestions')
+        if error_response:
+            return error_response, status
+
+        recommender = get_recommender()
+        limit, error_response, status = _read_suggestion_limit(request.args, recommender.top_k)
+        if error_response:
+            return error_response, status
+
+        fields, error_response, status = USER_CARD.parse_fields(request.args)
+        if error_response:
+            return error_response, status
+
+        ranked = recommender.suggestions(user.id, limit)
+        rows = db.session.execute(select(*USER_CARD.columns(fields, User.id))
+                                  .where(User.id.in_([candidate_id for candidate_id, _, _, _ in ranked]),
+                                         User.deleted_at.is_(None)))
+        users_by_id = {row.id: row for row in rows}
+
+        # Users deleted in another worker may still be in this worker's graph
+        suggestions = [{
+            **USER_CARD.serialize(users_by_id[candidate_id], fields),
+            'score': score,
+            'mutualCount': mutual_count,
+            'followsYou': follows_you
+        } for candidate_id, score, mutual_count, follows_you in ranked if candidate_id in users_by_id]
+        return jsonify({'suggestions': suggestions}), 200
+    except sqlalchemy.exc.SQLAlchemyError:
+        logger.error('Database error while getting suggestions for user %s', username)
+        db.session.rollback()
+        return jsonify({'message': 'Internal server error retrieving suggestions'}), 500
+
+    except Exception as sql_error: # pylint: disable=broad-exception-caught
+        logger.error('Unexpected error while getting suggestions for user %s: %s', username, str(sql_error))
+        db.session.rollback()
+        return jsonify({'message': f'An unexpected error occurred: {str(sql_error)}'}), 500
+
+def _read_usernames(usernames):
+    """
+    Validate the usernames list of a batch body.
+    Returns (usernames without duplicates, None, None) or (None, error_response, 400).
+    """
+    if not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+        return None, jsonify({'message': 'usernames must be a list of strings'}), 400
+    usernames = list(dict.fromkeys(usernames))  # Drop duplicates, keep request order
+    if len(usernames) > MAX_BATCH_SIZE:
+        return None, jsonify({'message': f'At most {MAX_BATCH_SIZE} usernames can be sent per request'}), 400
+    return usernames, None, None
+
+def _read_batch_request(data):
+    """
+    Validate a batch follow body.
+    Returns ((action, usernames), None, None) or (None, error_response, 400).
+    """
+    valid_data, missing_fields = validate_required_fields(data, ['action', 'usernames'], "batch_follow")
+    if not valid_data:
+        return None, jsonify({'error': 'Missing data from request'}), 400
+    if len(missing_fields) > 0:
+        return None, jsonify({'error': 'Missing fields in request: ' + (', '.join(missing_fields))}), 400
+
+    action = data.get('action')
+    if action not in ('follow', 'unfollow'):
+        return None, jsonify({'message': 'action must be follow or unfollow'}), 400
+    usernames, error_response, status = _read_usernames(data.get('usernames'))
+    if error_response:
+        return None, error_response, status
+    return (action, usernames), None, None
+
+def _batch_status(user_id, current_user_id, changed_ids, statuses):
+    """ Report what a batch did for one target; statuses is the (changed, unchanged) pair for the action """
+    if user_id is None:
+        return 'not_found'
+    if user_id == current_user_id:
+        return 'self'
+    return statuses[0] if user_id in changed_ids else statuses[1]
+
+@follow_bp.route('/follows/batch', methods=['POST'])
+@jwt_required()
+def batch_follow():
+    """Follow or unfollow many users in one transaction"""
+    try:
+        current_user, error_response, status = check_for_token()
+        if error_response:
+            return error_response, status
+
+        batch, error_response, status = _read_batch_request(request.get_json(silent=True))
+        if error_response:
+            return error_response, status
+        action, usernames = batch
+        logger.debug('Batch %s of %s users by %s', action, len(usernames), current_user.username)
+
+        user_ids = resolve_user_ids(usernames)
+        current_user_id = current_user.id
+
+        target_ids = {user_ids[name] for name in usernames if name in user_ids and user_ids[name] != current_user_id}
+        if action == 'follow':
+            changed_ids = commit_with_deadlock_retry(lambda: add_follow_edges(current_user_id, target_ids))
+            statuses = ('followed', 'already_following')
+        else:
+            changed_ids = commit_with_deadlock_retry(lambda: remove_follow_edges(current_user_id, target_ids))
+            statuses = ('unfollowed', 'not_following')
+
+        results = [{
+            'username': name,
+            'userId': user_ids.get(name),
+            'status': _batch_status(user_ids.get(name), current_user_id, changed_ids, statuses)
+        } for name in usernames]
+
+        return jsonify({
+            'message': f'Batch {action} complete',
+            'results': results,
+            'followingCount': get_follow_counts([current_user_id])[current_user_id][1]
+        }), 200
+    except sqlalchemy.exc.SQLAlchemyError:
+        logger.error('Database error during batch follow')
+        db.session.rollback()
+        return jsonify({'message': 'Internal server error during batch follow'}), 500
+
+    except Exception as sql_error: # pylint: disable=broad-exception-caught
+        logger.error('Unexpected error during batch follow: %s', str(sql_error))
+        db.session.rollback()
+        return jsonify({'message': f'An unexpected error occurred: {str(sql_error)}'}), 500
+
+def _relationship(user_id, other_id, flags):
+    """ Describe user_id's relationship to other_id from get_viewer_flags sets """
+    following, followed_by = other_id in flags[0], other_id in flags[1]
+    return {'following': following, 'followedBy': followed_by, 'mutual': following and followed_by,
+            'self': user_id == other_id}
+
+@follow_bp.route('/<string:username>/relationship/<string:other_username>', methods=['GET'])
+def get_relationship(username, other_username):
+    """Check whether a user follows another and whether they follow back"""
+    try:
+        logger.debug('Checking relationship between %s and %s', username, other_username)
+
+        # Both ids in one query, then both directions as point lookups on the edge indexes
+        user_ids = resolve_user_ids([username, other_username])
+        missing = [name for name in (username, other_username) if name not in user_ids]
+        if missing:
+            return jsonify({'message': f'User not found: {missing[0]}'}), 404
+        user_id, other_id = user_ids[username], user_ids[other_username]
+
+        return jsonify({
+            'username': username,
+            'otherUsername': other_username,
+            **_relationship(user_id, other_id, get_viewer_flags(user_id, [other_id]))
+        }), 200
+    except sqlalchemy.exc.SQLAlchemyError:
+        logger.error('Database error while checking relationship between %s and %s', username, other_username)
+        db.session.rollback()
+        return jsonify({'message': 'Internal server error checking relationship'}), 500
+
+    except Exception as sql_error: # pylint: disable=broad-exception-caught
+        logger.error('Unexpected error while checking relationship: %s', str(sql_error))
+        db.session.rollback()
+        return jsonify({'message': f'An unexpected error occurred: {str(sql_error)}'}), 500
+
+@follow_bp.route('/relationships', methods=['POST'])
+@jwt_required()
+def get_relationships():
+    """Check the caller's relationship to many users in one request"""
+    try:
+        current_user, error_response, status = check_for_token()
+        if error_response:
+            return error_response, status
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Missing data from request'}), 400
+        usernames, error_response, status = _read_usernames(data.get('usernames'))
+        if error_response:
+            return error_response, status
+        logger.debug('Checking relationships of %s to %s users', current_user.username, len(usernames))
+
+        user_ids = resolve_user_ids(usernames)
+        flags = get_viewer_flags(current_user.id, set(user_ids.values()))
+        results = []
+        for name in usernames:
+            if name not in user_ids:
+                results.append({'username': name, 'userId': None, 'status': 'not_found'})
+                continue
+            results.append({'username': name, 'userId': user_ids[name], 'status': 'found',
+                            **_relationship(current_user.id, user_ids[name], flags)})
+        return jsonify({'results': results}), 200
+    except sqlalchemy.exc.SQLAlchemyError:
+        logger.error('Database error while checking relationships')
+        db.session.rollback()
+        return jsonify({'message': 'Internal server error checking relationships'}), 500
+
+    except Exception as sql_error: # pylint: disable=broad-exception-caught
+        logger.error('Unexpected error while checking relationships: %s', str(sql_error))
+        db.session.rollback()
+        return jsonify({'message': f'An unexpected error occurred: {str(sql_error)}'}), 500
@@ -0,0 +1,36 @@
+"""
+health_routes.py
+-----------------------------
+This module contains the health check routes, including live database pool
+statistics used to size workers against database capacity.
+"""
+from logging import getLogger
+import time
+import sqlalchemy.exc
+from sqlalchemy import text
+from flask import Blueprint, jsonify
+from models import db
+from db_pool import get_pool_status
+
+health_bp = Blueprint('health_bp', __name__)
+logger = getLogger(__name__)
+
+@health_bp.route('/health', methods=['GET'])
+def health():
+    """ Report that the API process is up """
+    return jsonify({'status': 'ok'}), 200
+
+@health_bp.route('/health/db', methods=['GET'])
+def database_health():
+    """ Ping the database and report this worker's connection pool statistics """
+    pool = get_pool_status(db.engine)
+    try:
+        start = time.perf_counter()
+        db.session.execute(text('SELECT 1'))
+        latency = time.perf_counter() - start
+    except sqlalchemy.exc.SQLAlchemyError as exception:
+        logger.error('Database health check failed: %s', exception)
+        db.session.rollback()
+        return jsonify({'status': 'unavailable', 'pool': pool}), 503
+
+    return jsonify({'status': 'ok', 'ping_seconds': round(latency, 6), 'pool': pool}), 200
@@ -0,0 +1,51 @@
+"""
+http_cache.py
+-----------------------------
+This module contains helpers for HTTP conditional requests. Routes derive an
+ETag from row versions and counters before serializing, so a matching
+If-None-Match (or If-Modified-Since) is answered with 304 and no body.
+"""
+from datetime import timezone
+import hashlib
+from flask import Response, current_app, request
+
+
+def make_etag(*parts):
+    """ Build a short, stable ETag value from version/counter parts """
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12)
+    return digest.hexdigest()
+
+
+def _as_utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def _cache_control():
+    return f'public, max-age={current_app.config.get("HTTP_CACHE_MAX_AGE", 0)}, must-revalidate'
+
+
+def not_modified(etag, last_modified=None):
+    """ Return a 304 response if the client already holds this version, otherwise None """
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(etag):
+            return None
+    else:
+        last_modified = _as_utc(last_modified)
+        if last_modified is None or request.if_modified_since is None or last_modified > request.if_modified_since:
+            return None
+
+    response = Response(status=304)
+    return with_cache_headers(response, etag, last_modified)
+
+
+def with_cache_headers(response, etag, last_modified=None):
+    """ Attach ETag, Last-Modified and Cache-Control to a response """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+    response.headers['Cache-Control'] = _cache_control()
+    return response
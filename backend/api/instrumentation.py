@@ -0,0 +1,211 @@
+"""
+instrumentation.py
+-----------------------------
+This module measures where request time goes. SQLAlchemy engine events count
+queries and SQL time per request, Flask hooks record per-endpoint latency
+histograms, and named spans (see timed) time individual steps. Each response
+carries a Server-Timing header, slow queries and N+1 patterns are logged, and
+the totals are rendered in the Prometheus text format for /metrics.
+
+Metrics are kept per worker process.
+"""
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Lock
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_LOGGED_STATEMENT = 500
+
+
+class Histogram:
+    """ Cumulative bucket counts, sum and count for one label set """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Record one observation """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Yield (upper bound label, cumulative count) pairs, ending with +Inf """
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), running
+
+
+def _format_labels(labels):
+    return ','.join(f'{name}="{str(value)}"' for name, value in labels)
+
+
+class Metrics:
+    """ Thread-safe registry of the counters and histograms exported on /metrics """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.latency = {}
+        self.requests = Counter()
+        self.queries = Counter()
+        self.sql_seconds = Counter()
+        self.slow_queries = Counter()
+        self.n_plus_one = Counter()
+
+    def record_request(self, endpoint, method, status, timing):
+        """ Record one finished request; timing is (elapsed seconds, query count, SQL seconds) """
+        elapsed, query_count, sql_time = timing
+        with self._lock:
+            key = (('endpoint', endpoint), ('method', method))
+            self.latency.setdefault(key, Histogram()).observe(elapsed)
+            self.requests[key + (('status', status),)] += 1
+            self.queries[key] += query_count
+            self.sql_seconds[key] += sql_time
+
+    def record_slow_query(self, endpoint):
+        """ Count one query over the slow query threshold """
+        with self._lock:
+            self.slow_queries[(('endpoint', endpoint),)] += 1
+
+    def record_n_plus_one(self, endpoint):
+        """ Count one request flagged with a repeated-statement pattern """
+        with self._lock:
+            self.n_plus_one[(('endpoint', endpoint),)] += 1
+
+    def render(self, gauges=None):
+        """ Render every metric in the Prometheus text exposition format """
+        lines = []
+
+        def counter(name, description, values, metric_type='counter'):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in sorted(values.items()):
+                lines.append(f'{name}{{{_format_labels(labels)}}} {value}' if labels else f'{name} {value}')
+
+        with self._lock:
+            lines.append('# HELP http_request_duration_seconds Request latency by endpoint')
+            lines.append('# TYPE http_request_duration_seconds histogram')
+            for labels, histogram in sorted(self.latency.items()):
+                label_text = _format_labels(labels)
+                for bound, count in histogram.cumulative():
+                    lines.append(f'http_request_duration_seconds_bucket{{{label_text},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_sum{{{label_text}}} {histogram.total}')
+                lines.append(f'http_request_duration_seconds_count{{{label_text}}} {histogram.count}')
+            counter('http_requests_total', 'Requests by endpoint and status', self.requests)
+            counter('db_queries_total', 'SQL statements executed by endpoint', self.queries)
+            counter('db_query_seconds_total', 'Time spent in SQL by endpoint', self.sql_seconds)
+            counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_THRESHOLD', self.slow_queries)
+            counter('db_n_plus_one_total', 'Requests that repeated one statement N_PLUS_ONE_THRESHOLD times or more',
+                    self.n_plus_one)
+        if gauges:
+            counter('db_pool', 'Connection pool statistics for this worker',
+                    {(('stat', name),): value for name, value in gauges.items()}, metric_type='gauge')
+        return '\n'.join(lines) + '\n'
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def get_metrics():
+    """ Return the metrics registry for the current app, or None when instrumentation is not installed """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('metrics')
+
+
+@contextmanager
+def timed(name):
+    """ Time a block as a named Server-Timing span of the current request """
+    if not has_request_context() or 'timings' not in g:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.timings[name] = g.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, _cursor, _statement, _parameters, _context, _executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, _cursor, statement, _parameters, _context, _executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    metrics = get_metrics()
+    if metrics is None:
+        return
+
+    in_request = has_request_context() and 'query_count' in g
+    if in_request:
+        g.query_count += 1
+        g.sql_time += elapsed
+        g.statements[statement] += 1
+
+    if elapsed >= current_app.config['SLOW_QUERY_THRESHOLD']:
+        endpoint = _endpoint() if in_request else 'none'
+        metrics.record_slow_query(endpoint)
+        logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, statement[:MAX_LOGGED_STATEMENT])
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.query_count = 0
+    g.sql_time = 0.0
+    g.statements = Counter()
+    g.timings = {}
+
+
+def _check_n_plus_one(metrics, endpoint):
+    threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+    if not threshold or not g.statements:
+        return
+    statement, repeats = g.statements.most_common(1)[0]
+    if repeats >= threshold:
+        metrics.record_n_plus_one(endpoint)
+        logger.warning('Possible N+1 in %s: statement ran %s times: %s',
+                       endpoint, repeats, statement[:MAX_LOGGED_STATEMENT])
+
+
+def _finish_request(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    metrics = current_app.extensions['metrics']
+    endpoint = _endpoint()
+    metrics.record_request(endpoint, request.method, response.status_code, (elapsed, g.query_count, g.sql_time))
+    _check_n_plus_one(metrics, endpoint)
+
+    if current_app.config['SERVER_TIMING']:
+        spans = [f'db;dur={g.sql_time * 1000:.2f};desc="{g.query_count} queries"']
+        spans.extend(f'{name};dur={duration * 1000:.2f}' for name, duration in g.timings.items())
+        spans.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers.add('Server-Timing', ', '.join(spans))
+    return response
+
+
+def init_instrumentation(app_obj):
+    """ Install the request hooks and create the metrics registry for the app """
+    app_obj.config.setdefault('SLOW_QUERY_THRESHOLD', 0.5)
+    app_obj.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+    app_obj.config.setdefault('SERVER_TIMING', True)
+    metrics = Metrics()
+    app_obj.extensions['metrics'] = metrics
+    app_obj.before_request(_start_request)
+    app_obj.after_request(_finish_request)
+    return metrics
@@ -2,28 +2,148 @@
 logger_config.py
 -----------------------------
 This module configures the logging for the API.
+Request threads only put records on an in-memory queue; a background listener
+thread formats them and writes them to the rotating file (or stdout). A process
+forked after setup, such as a gunicorn worker, writes its own api.<pid>.log so
+no two processes rotate the same file.
 """
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 import os
+import queue
 
-LOG_FILE = 'api.log'
-LOG_LEVEL = logging.DEBUG
 LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
 
+# Root level per FLASK_ENV when LOG_LEVEL is not set
+DEFAULT_LEVELS = {
+    'development': 'DEBUG',
+    'test': 'WARNING',
+    'production': 'INFO',
+}
+
+# The queue handler on the root logger and the listener draining its queue
+_state = {'queue_handler': None, 'listener': None}
+
+
+class JsonFormatter(logging.Formatter):
+    """ Format records as one JSON object per line """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Queue handler for a listener in the same process. The stock prepare() formats the record on the calling
+    thread and drops exc_info, which leaves the output formatter nothing to build its exception field from.
+    Only the message arguments are merged here, since they may change after the call; the traceback is
+    formatted by the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+def _parse_logger_levels(spec):
+    """ Parse LOG_LEVELS, e.g. 'sqlalchemy.engine=WARNING,search_index=INFO' """
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _build_output_handler(log_file=None):
+    """ Build the handler the background listener writes to """
+    log_file = log_file or os.getenv('LOG_FILE', 'api.log')
+    if log_file == '-':
+        handler = logging.StreamHandler()
+    else:
+        log_dir = os.path.dirname(log_file)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        backup_count = int(os.getenv('LOG_BACKUP_COUNT', '10'))
+        if os.getenv('LOG_ROTATION', 'size') == 'time':
+            handler = TimedRotatingFileHandler(log_file, when=os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+                                               backupCount=backup_count, encoding='utf-8')
+        else:
+            handler = RotatingFileHandler(log_file, maxBytes=int(os.getenv('LOG_MAX_BYTES', str(100 * 1024 * 1024))),
+                                          backupCount=backup_count, encoding='utf-8')
+
+    if os.getenv('LOG_FORMAT', 'text') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+
+def _start_listener(output_handler):
+    """ Point the queue handler at a fresh queue and start a listener thread draining it """
+    log_queue = queue.Queue(-1)
+    _state['queue_handler'].queue = log_queue
+    _state['listener'] = QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _state['listener'].start()
+
+
+def _per_process_path(log_file):
+    """ api.log becomes api.<pid>.log """
+    root, extension = os.path.splitext(log_file)
+    return f'{root}.{os.getpid()}{extension}'
+
+
+def _restart_listener_after_fork():
+    """ Threads do not survive fork, so each forked worker needs its own listener and, for files, its own file """
+    if _state['listener'] is None:
+        return
+    handler = _state['listener'].handlers[0]
+    if isinstance(handler, logging.FileHandler):
+        # Rotation renames the file under the other processes still writing to it, so their records are lost
+        handler.close()
+        handler = _build_output_handler(_per_process_path(os.getenv('LOG_FILE', 'api.log')))
+    _start_listener(handler)
+
+
+def stop_logger():
+    """ Flush queued records and stop the listener thread """
+    listener = _state['listener']
+    if listener is not None and listener._thread is not None:  # pylint: disable=protected-access
+        listener.stop()
+
+
 def setup_logger():
     """ Set up the logger for the API. """
     # Avoid re-adding handlers if already set up
     if len(logging.getLogger().handlers) > 0:
         return
 
-    log_dir = os.path.dirname(LOG_FILE)
-    if log_dir and not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+    environment = os.getenv('FLASK_ENV', 'production')
+    root_level = os.getenv('LOG_LEVEL', DEFAULT_LEVELS.get(environment, 'INFO')).upper()
 
-    handler = RotatingFileHandler(LOG_FILE, maxBytes=1_000_000, backupCount=3, encoding='utf-8')
-    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _state['queue_handler'] = LocalQueueHandler(queue.Queue(-1))
+    _start_listener(_build_output_handler())
 
     root_logger = logging.getLogger()
-    root_logger.setLevel(LOG_LEVEL)
-    root_logger.addHandler(handler)
+    root_logger.setLevel(root_level)
+    root_logger.addHandler(_state['queue_handler'])
+    for name, level in _parse_logger_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    atexit.register(stop_logger)
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
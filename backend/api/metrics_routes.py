@@ -0,0 +1,21 @@
+"""
+metrics_routes.py
+-----------------------------
+This module contains the Prometheus-style metrics route for this worker process.
+"""
+from flask import Blueprint, Response
+from models import db
+from db_pool import get_pool_status
+from instrumentation import get_metrics
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """ Render request, query and pool metrics in the Prometheus text format """
+    registry = get_metrics()
+    if registry is None:
+        return Response('instrumentation disabled\n', status=404, mimetype='text/plain')
+    pool = {name: value for name, value in get_pool_status(db.engine).items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    return Response(registry.render(gauges=pool), mimetype='text/plain; version=0.0.4')
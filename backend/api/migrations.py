@@ -0,0 +1,276 @@
+"""
+migrations.py
+-----------------------------
+This module applies schema changes to existing databases so they match the
+models and init.sql. Applied versions are recorded in schema_migrations.
+
+Every migration checks the live schema before changing it, so it is safe to run
+against a database created from init.sql (nothing to do) or one that is partly
+migrated. On MySQL, indexes are built with ALGORITHM=INPLACE, LOCK=NONE so the
+tables keep serving reads and writes; if MySQL cannot build one online the
+statement fails instead of locking the table.
+"""
+from logging import getLogger
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, inspect, select, text
+
+logger = getLogger(__name__)
+
+# Seconds a DDL statement waits for a metadata lock before giving up, so it never queues traffic behind it
+DDL_LOCK_WAIT_TIMEOUT = 5
+# Users per UPDATE when a migration fills a new column from existing data
+BACKFILL_BATCH_SIZE = 5000
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations',
+    _metadata,
+    Column('version', String(32), primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False, server_default=func.current_timestamp()),
+)
+
+MIGRATIONS = []
+
+
+class MigrationError(Exception):
+    """ Raised when a migration cannot be applied safely """
+
+
+def index_names(connection, table):
+    """ Names of a table's indexes and unique constraints, including expression indexes """
+    if connection.dialect.name == 'sqlite':
+        # SQLAlchemy skips expression indexes when reflecting SQLite, so read the catalog directly
+        return set(connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+            {'table': table}).scalars())
+    inspector = inspect(connection)
+    names = {index['name'] for index in inspector.get_indexes(table)}
+    names.update(constraint['name'] for constraint in inspector.get_unique_constraints(table))
+    return names
+
+
+class SchemaEditor:
+    """ Existence checks and dialect-aware DDL for one connection """
+
+    def __init__(self, connection, dry_run=False):
+        self.connection = connection
+        self.dry_run = dry_run
+        self.is_mysql = connection.dialect.name == 'mysql'
+        self.statements = []
+
+    def _inspector(self):
+        # A fresh inspector each time, since earlier statements may have changed the schema
+        return inspect(self.connection)
+
+    def has_column(self, table, column):
+        """ True if the table has the column """
+        return any(existing['name'] == column for existing in self._inspector().get_columns(table))
+
+    def index_names(self, table):
+        """ Names of the table's indexes, including unique constraints """
+        return index_names(self.connection, table)
+
+    def has_table(self, table):
+        """ True if the table exists """
+        return self._inspector().has_table(table)
+
+    def primary_key(self, table):
+        """ Primary key column names of the table """
+        return self._inspector().get_pk_constraint(table).get('constrained_columns') or []
+
+    def execute(self, statement):
+        """ Run a DDL or data statement, or only record it on a dry run """
+        self.statements.append(statement)
+        logger.info('Migration statement: %s', statement)
+        if not self.dry_run:
+            self.connection.execute(text(statement))
+
+    def alter_online(self, table, change):
+        """ ALTER TABLE that must not block concurrent reads and writes on MySQL """
+        suffix = ', ALGORITHM=INPLACE, LOCK=NONE' if self.is_mysql else ''
+        self.execute(f'ALTER TABLE {table} {change}{suffix}')
+
+    def create_index(self, table, name, columns, unique=False):
+        """ Create an index unless one with that name exists; columns is the SQL column list """
+        if name in self.index_names(table):
+            return
+        if self.is_mysql:
+            self.alter_online(table, f'ADD {"UNIQUE " if unique else ""}INDEX {name} ({columns})')
+        else:
+            self.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX {name} ON {table} ({columns})')
+
+
+def migration(version, description):
+    """ Register a function taking a SchemaEditor as the migration for version """
+    def register(apply):
+        MIGRATIONS.append((version, description, apply))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return apply
+    return register
+
+
+@migration('0001', 'Add follower counters, row version and updated_at to users')
+def _add_user_columns(editor):
+    columns = {
+        'follower_count': 'INT NOT NULL DEFAULT 0',
+        'following_count': 'INT NOT NULL DEFAULT 0',
+        'version': 'INT NOT NULL DEFAULT 1',
+        'updated_at': ('TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP' if editor.is_mysql
+                       else 'TIMESTAMP'),
+    }
+    for column, definition in columns.items():
+        if not editor.has_column('users', column):
+            if editor.is_mysql:
+                editor.alter_online('users', f'ADD COLUMN {column} {definition}')
+            else:
+                editor.execute(f'ALTER TABLE users ADD COLUMN {column} {definition}')
+    # Also when the columns exist: a rerun after a failure must finish filling them
+    _backfill_follow_counts(editor)
+
+
+def _backfill_follow_counts(editor):
+    """ Set the new counters from the followers table, one id range per short transaction """
+    max_id = editor.connection.execute(text('SELECT MAX(id) FROM users')).scalar() or 0
+    for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+        # Counts are absolute, so a follow written meanwhile by the new code is not counted twice
+        editor.execute(
+            'UPDATE users SET '
+            'follower_count = (SELECT COUNT(*) FROM followers WHERE followers.followee_id = users.id), '
+            'following_count = (SELECT COUNT(*) FROM followers WHERE followers.follower_id = users.id) '
+            f'WHERE users.id > {start} AND users.id <= {start + BACKFILL_BATCH_SIZE}')
+        if not editor.dry_run:
+            editor.connection.commit()
+
+
+@migration('0002', 'Make (follower_id, followee_id) the primary key of followers')
+def _add_followers_primary_key(editor):
+    if editor.primary_key('followers') or 'uq_followers_edge' in editor.index_names('followers'):
+        return
+    duplicates = editor.connection.execute(text(
+        'SELECT COUNT(*) FROM (SELECT follower_id, followee_id FROM followers '
+        'GROUP BY follower_id, followee_id HAVING COUNT(*) > 1) AS duplicate_edges')).scalar()
+    if duplicates:
+        raise MigrationError(f'followers has {duplicates} duplicated edges; remove them before adding the primary key')
+    if editor.is_mysql:
+        editor.alter_online('followers', 'MODIFY follower_id INT NOT NULL, MODIFY followee_id INT NOT NULL, '
+                                         'ADD PRIMARY KEY (follower_id, followee_id)')
+    else:
+        # Other databases cannot add a primary key in place; a unique index gives the same guarantee
+        editor.create_index('followers', 'uq_followers_edge', 'follower_id, followee_id', unique=True)
+
+
+@migration('0003', 'Add the (followee_id, follower_id) index covering follower lists')
+def _add_reverse_edge_index(editor):
+    editor.create_index('followers', 'ix_followers_followee_follower', 'followee_id, follower_id')
+    # MySQL created a single-column index for the followee foreign key; the new index makes it redundant
+    if editor.is_mysql and 'followee_id' in editor.index_names('followers'):
+        editor.alter_online('followers', 'DROP INDEX followee_id')
+
+
+@migration('0004', 'Add a case-insensitive index on users.username')
+def _add_username_lower_index(editor):
+    # MySQL needs the extra parentheses for a functional key part (8.0.13 or later)
+    expression = '(lower(username))' if editor.is_mysql else 'lower(username)'
+    editor.create_index('users', 'ix_users_username_lower', expression)
+
+
+@migration('0005', 'Add users.deleted_at and the deletion_jobs table')
+def _add_deletion_jobs(editor):
+    if not editor.has_column('users', 'deleted_at'):
+        if editor.is_mysql:
+            editor.alter_online('users', 'ADD COLUMN deleted_at TIMESTAMP NULL DEFAULT NULL')
+        else:
+            editor.execute('ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP NULL')
+    if editor.has_table('deletion_jobs'):
+        editor.create_index('deletion_jobs', 'ix_deletion_jobs_status_updated', 'status, updated_at')
+        return
+    editor.execute(
+        'CREATE TABLE deletion_jobs ('
+        'id VARCHAR(32) NOT NULL PRIMARY KEY, '
+        'user_id INT NOT NULL, '
+        'username VARCHAR(50) NOT NULL, '
+        "status VARCHAR(16) NOT NULL DEFAULT 'pending', "
+        'edges_total INT NOT NULL DEFAULT 0, '
+        'edges_removed INT NOT NULL DEFAULT 0, '
+        'error VARCHAR(255) NULL, '
+        'created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP, '
+        'updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP, '
+        'finished_at TIMESTAMP NULL DEFAULT NULL)')
+    # The table is new and empty, so a plain CREATE INDEX does not block anything
+    editor.execute('CREATE INDEX ix_deletion_jobs_status_updated ON deletion_jobs (status, updated_at)')
+
+
+@migration('0006', 'Add token revocation times to users and the revoked_tokens table')
+def _add_token_revocations(editor):
+    for column in ('tokens_valid_after', 'last_logout_at'):
+        if not editor.has_column('users', column):
+            if editor.is_mysql:
+                editor.alter_online('users', f'ADD COLUMN {column} DOUBLE NULL DEFAULT NULL')
+            else:
+                editor.execute(f'ALTER TABLE users ADD COLUMN {column} DOUBLE NULL')
+    if editor.has_table('revoked_tokens'):
+        editor.create_index('revoked_tokens', 'ix_revoked_tokens_user_expires', 'user_id, expires_at')
+        return
+    editor.execute(
+        'CREATE TABLE revoked_tokens ('
+        'jti VARCHAR(36) NOT NULL PRIMARY KEY, '
+        'user_id INT NOT NULL, '
+        'expires_at DOUBLE NOT NULL, '
+        'FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE)')
+    editor.execute('CREATE INDEX ix_revoked_tokens_user_expires ON revoked_tokens (user_id, expires_at)')
+
+
+def _applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending_migrations(engine):
+    """ Return the (version, description) pairs not yet applied """
+    with engine.begin() as connection:
+        applied = _applied_versions(connection)
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+
+def run_migrations(engine, dry_run=False):
+    """
+    Apply pending migrations in version order and record each one.
+    Returns [(version, description, statements)] for the migrations applied, or that would be on a dry run.
+    """
+    results = []
+    with engine.connect() as connection:
+        if connection.dialect.name == 'mysql':
+            connection.execute(text(f'SET SESSION lock_wait_timeout = {DDL_LOCK_WAIT_TIMEOUT}'))
+        applied = _applied_versions(connection)
+        connection.commit()
+        for version, description, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            editor = SchemaEditor(connection, dry_run=dry_run)
+            apply(editor)
+            if not dry_run:
+                connection.execute(schema_migrations.insert().values(version=version, description=description))
+                connection.commit()
+                logger.info('Applied migration %s: %s', version, description)
+            results.append((version, description, editor.statements))
+    return results
+
+
+def check_schema(engine, metadata):
+    """ Return a list of problems where the live schema is missing tables, columns or indexes from the models """
+    problems = [f'migration {version} ({description}) is pending'
+                for version, description in pending_migrations(engine)]
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                problems.append(f'table {table.name} is missing')
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            problems.extend(f'column {table.name}.{column.name} is missing'
+                            for column in table.columns if column.name not in columns)
+            indexes = index_names(connection, table.name)
+            problems.extend(f'index {index.name} on {table.name} is missing'
+                            for index in table.indexes if index.name not in indexes)
+    return problems
@@ -1,6 +1,6 @@
 """ Models for the app backend """
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, ForeignKey, Table
+from sqlalchemy import Column, Integer, ForeignKey, Index, Table, func
 from sqlalchemy.orm import relationship
 
 db = SQLAlchemy()
@@ -8,8 +8,10 @@ db = SQLAlchemy()
 followers = Table(
     'followers',
     db.metadata,
-    Column('follower_id', Integer, ForeignKey('users.id', ondelete='CASCADE')),
-    Column('followee_id', Integer, ForeignKey('users.id', ondelete='CASCADE'))
+    # The primary key serves "who does X follow"; the reverse index serves "who follows X"
+    Column('follower_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+    Column('followee_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_followers_followee_follower', 'followee_id', 'follower_id')
 )
 
 class User(db.Model):
@@ -21,6 +23,21 @@ class User(db.Model):
     email = db.Column(db.String(255), unique=True, nullable=False)
     bio = db.Column(db.String(255), unique=False, nullable=True)
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # Denormalized edge counts, kept in step with the followers table by relationships.py
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped by the ORM on every update; used for ETags and optimistic concurrency
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    # Set when the account is deleted; the row stays hidden until deletion.py has removed its edges
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # Unix times read by token_revocation.py: every token issued up to tokens_valid_after is revoked,
+    # and tokens issued up to last_logout_at may have been revoked one by one in revoked_tokens
+    tokens_valid_after = db.Column(db.Double, nullable=True)
+    last_logout_at = db.Column(db.Double, nullable=True)
+
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (Index('ix_users_username_lower', func.lower(username)),)
 
     # Define the followers relationship
     followers = relationship(
@@ -36,3 +53,29 @@ class User(db.Model):
         self.password = password
         self.bio = bio
         self.email = email
+
+class DeletionJob(db.Model):
+    """ Progress of removing a deleted account's edges in the background """
+    __tablename__ = 'deletion_jobs'
+    id = db.Column(db.String(32), primary_key=True)  # Random hex, so the status URL cannot be guessed
+    user_id = db.Column(db.Integer, nullable=False)
+    username = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending', server_default='pending')
+    edges_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    edges_removed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # Written by the worker after every chunk; a running job whose heartbeat stops is picked up again
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (Index('ix_deletion_jobs_status_updated', 'status', 'updated_at'),)
+
+class RevokedToken(db.Model):
+    """ An access token revoked by logout, kept until it would have expired anyway """
+    __tablename__ = 'revoked_tokens'
+    jti = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    expires_at = db.Column(db.Double, nullable=False)  # Unix time
+
+    __table_args__ = (Index('ix_revoked_tokens_user_expires', 'user_id', 'expires_at'),)
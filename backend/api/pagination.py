@@ -0,0 +1,73 @@
+"""
+pagination.py
+-----------------------------
+This module contains helpers for keyset (cursor) pagination. Cursors are opaque,
+URL-safe strings that encode the sort key of the last row on the previous page.
+"""
+import base64
+import binascii
+import json
+from logging import getLogger
+from flask import jsonify
+
+logger = getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    """ Encode a list of sort key values as an opaque cursor string """
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Decode a cursor produced by encode_cursor, raising ValueError if it is malformed """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as exception:
+        raise ValueError('Malformed cursor') from exception
+    if not isinstance(values, list):
+        raise ValueError('Malformed cursor')
+    return values
+
+
+def get_page_args(args, key_types=(int,)):
+    """
+    Read the limit and cursor query parameters.
+    key_types lists the expected type of each sort key value in the cursor.
+    Returns ((limit, cursor_values), None, None) or (None, error_response, 400).
+    cursor_values is None on the first page.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None, jsonify({'message': 'limit must be an integer'}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return None, jsonify({'message': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+    cursor = args.get('cursor')
+    if not cursor:
+        return (limit, None), None, None
+    try:
+        values = decode_cursor(cursor)
+    except ValueError:
+        logger.error('Malformed pagination cursor: %s', cursor)
+        return None, jsonify({'message': 'Invalid cursor'}), 400
+    if len(values) != len(key_types) or not all(
+            isinstance(value, key_type) for value, key_type in zip(values, key_types)):
+        return None, jsonify({'message': 'Invalid cursor'}), 400
+    return (limit, values), None, None
+
+
+def split_page(rows, limit, cursor_key):
+    """
+    Split a list fetched with limit + 1 rows into the page and the next cursor.
+    cursor_key maps the last row on the page to its sort key values.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(cursor_key(page[-1]))
@@ -0,0 +1,191 @@
+"""
+password_hashing.py
+-----------------------------
+This module runs password hashing and verification in a small process pool so
+the CPU-heavy key derivation does not hold the GIL on request threads. Each
+worker process creates its own pool on first use, and a semaphore caps how many
+hashing jobs a worker accepts at once; callers that cannot get a slot in time
+receive a 503 instead of queueing behind a burst of logins.
+
+The method (e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000') is configurable,
+and hashes made with an older method are replaced on the next successful login.
+"""
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from logging import getLogger
+import multiprocessing
+import os
+from threading import BoundedSemaphore, Lock
+from flask import current_app, jsonify
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from instrumentation import timed
+
+logger = getLogger(__name__)
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+def _hash_task(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify_task(pwhash, password, method):
+    """ Check a password and, if it matches a hash made with another method, hash it again with the current one """
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if needs_rehash(pwhash, method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+def _replace_task(pwhash, new_password, method):
+    """ Return (same_as_current, new_hash) so a password change needs a single job """
+    if check_password_hash(pwhash, new_password):
+        return True, None
+    return False, generate_password_hash(new_password, method=method)
+
+
+def _method_parameters(method):
+    """
+    The (algorithm, parameters...) a Werkzeug method string stands for, with Werkzeug's defaults filled in,
+    so 'scrypt' and 'scrypt:32768:8:1' compare equal. Methods that cannot be parsed are returned split as is.
+    """
+    name, *args = method.split(':')
+    try:
+        if name == 'scrypt' and len(args) in (0, 3):
+            n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+            return ('scrypt', n, r, p)
+        if name == 'pbkdf2' and len(args) <= 2:
+            iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+            return ('pbkdf2', args[0] if args else 'sha256', iterations)
+    except ValueError:
+        pass
+    return (name, *args)
+
+
+def needs_rehash(pwhash, method):
+    """ True if pwhash was made with another algorithm or other cost parameters than the configured method """
+    return _method_parameters(pwhash.split('$', 1)[0]) != _method_parameters(method)
+
+
+class PasswordHasher:
+    """ Runs hashing jobs in a per-process pool, at most max_concurrency at a time """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=1, max_concurrency=4, wait_timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self._slots = BoundedSemaphore(max_concurrency)
+        self._lock = Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _get_executor(self):
+        """ Create the pool on first use in this process; a forked worker never reuses its parent's pool """
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # spawn, not fork: forking a process that is already running request threads is unsafe
+                self._executor = ProcessPoolExecutor(  # pylint: disable=consider-using-with
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._executor_pid = os.getpid()
+                atexit.register(self._executor.shutdown, wait=False, cancel_futures=True)
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def run(self, task, *args):
+        """
+        Run a hashing task with the configured method appended to its arguments.
+        Returns (result, None, None) or (None, error_response, 503) when no slot frees up in time.
+        """
+        if not self._slots.acquire(timeout=self.wait_timeout):  # pylint: disable=consider-using-with
+            logger.warning('Password hashing is saturated; rejecting request')
+            response = jsonify({'message': 'Server is busy, please retry shortly'})
+            response.headers['Retry-After'] = '1'
+            return None, response, 503
+        try:
+            with timed('hash'):
+                if self.workers <= 0:
+                    return task(*args, self.method), None, None
+                executor = self._get_executor()
+                try:
+                    return executor.submit(task, *args, self.method).result(), None, None
+                except BrokenProcessPool:
+                    # A pool process died; start a fresh pool for the next request
+                    self._discard_executor(executor)
+                    raise
+        finally:
+            self._slots.release()
+
+
+class BatchHasher:
+    """
+    Hashes lists of passwords for bulk imports across workers spawned processes (0 hashes in this process).
+    Use it as a context manager so the pool is shut down when the import ends.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=0):
+        self.method = method
+        self.workers = workers
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def hash_all(self, passwords):
+        """ Return the hashes of passwords, in order """
+        if self._executor is None:
+            return [_hash_task(password, self.method) for password in passwords]
+        # A few chunks per process keeps them all busy without one task per password
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._executor.map(_hash_task, passwords, repeat(self.method), chunksize=chunksize))
+
+
+def init_password_hashing(app_obj):
+    """ Create the password hasher configured by the PASSWORD_HASH_* settings """
+    hasher = PasswordHasher(
+        method=app_obj.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        workers=app_obj.config.get('PASSWORD_HASH_WORKERS', 1),
+        max_concurrency=app_obj.config.get('PASSWORD_HASH_MAX_CONCURRENCY', 4),
+        wait_timeout=app_obj.config.get('PASSWORD_HASH_WAIT_TIMEOUT', 5.0),
+    )
+    app_obj.extensions['password_hasher'] = hasher
+    return hasher
+
+
+def _hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    """ Hash a password. Returns (hash, None, None) or (None, error_response, 503) """
+    return _hasher().run(_hash_task, password)
+
+
+def verify_password(pwhash, password):
+    """
+    Check a password against its stored hash.
+    Returns ((matches, upgraded_hash or None), None, None) or (None, error_response, 503).
+    """
+    return _hasher().run(_verify_task, pwhash, password)
+
+
+def replace_password(pwhash, new_password):
+    """
+    Hash a new password unless it matches the current one, in a single job.
+    Returns ((same_as_current, new_hash or None), None, None) or (None, error_response, 503).
+    """
+    return _hasher().run(_replace_task, pwhash, new_password)
@@ -0,0 +1,305 @@
+"""
+recommendations.py
+-----------------------------
+This module contains the "who to follow" engine. The follower graph is held in
+memory as sorted arrays of integer ids per user (about 8 bytes per edge), and
+candidates are ranked from it without touching the database:
+
+- friends of friends: users followed by the people you follow, each path
+  weighted down by how many users that person follows
+- follow-backs: users who follow you that you do not follow yet
+
+Each user's top-K list is computed on first request and kept in a bounded LRU
+cache. Edge writes from relationships.py are applied to the graph after their
+transaction commits, and drop the cached lists of both users. The graph is per
+worker process like the search index: other workers pick up a change when
+their graph is reloaded after RECOMMENDATION_INDEX_MAX_AGE seconds. Reloads run
+in a background thread and swap the new lists in; edge writes applied during
+the reload are replayed onto them.
+"""
+from array import array
+from bisect import bisect_left
+import heapq
+from logging import getLogger
+import math
+from threading import RLock
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, followers
+from user_cache import LocalUserCache
+from background_reload import BackgroundReload
+
+logger = getLogger(__name__)
+
+_PENDING_KEY = 'follow_graph_changes'
+LOAD_BATCH_SIZE = 10000
+
+# Bounds on the work for one user: at most this many friends are expanded, and this many of each one's followees
+MAX_FRIENDS_SCANNED = 500
+MAX_FRIEND_FOLLOWING_SCANNED = 1000
+FOLLOWS_YOU_WEIGHT = 1.0
+
+
+def _sample(ids, limit):
+    """ At most limit ids spread evenly over the sorted array """
+    if len(ids) <= limit:
+        return ids
+    return ids[::math.ceil(len(ids) / limit)]
+
+
+def _insert_sorted(lists, key, value):
+    ids = lists.get(key)
+    if ids is None:
+        lists[key] = array('i', [value])
+        return True
+    position = bisect_left(ids, value)
+    if position < len(ids) and ids[position] == value:
+        return False
+    ids.insert(position, value)
+    return True
+
+
+def _remove_sorted(lists, key, value):
+    ids = lists.get(key)
+    if ids is None:
+        return False
+    position = bisect_left(ids, value)
+    if position == len(ids) or ids[position] != value:
+        return False
+    del ids[position]
+    if not ids:
+        del lists[key]
+    return True
+
+
+def _build_lists(rows):
+    """ Adjacency lists in both directions and the edge count for rows ordered by follower, then followee """
+    following, followers_of = {}, {}
+    edge_count = 0
+    for follower_id, followee_id in rows:
+        ids = following.get(follower_id)
+        if ids is None:
+            ids = following[follower_id] = array('i')
+        ids.append(followee_id)
+        ids = followers_of.get(followee_id)
+        if ids is None:
+            ids = followers_of[followee_id] = array('i')
+        ids.append(follower_id)
+        edge_count += 1
+    # Rows arrive grouped by follower, so follower ids are already in order within each list
+    return following, followers_of, edge_count
+
+
+class FollowGraph:
+    """ Sorted array('i') adjacency lists of the followers table in both directions """
+
+    def __init__(self):
+        self.lock = RLock()
+        self._following = {}
+        self._followers = {}
+        self.edge_count = 0
+        # (action, user_id, other_id) changes made while load() reads rows, replayed onto the new lists
+        self._journal = None
+        self.loaded_at = None
+
+    @property
+    def is_loaded(self):
+        """ Whether the graph has been populated from the database """
+        return self.loaded_at is not None
+
+    @property
+    def tracks_writes(self):
+        """ Whether edge writes should be applied: the graph is loaded or a load is reading rows """
+        return self.loaded_at is not None or self._journal is not None
+
+    def load(self, rows):
+        """ Replace the graph with (follower_id, followee_id) rows ordered by follower_id, then followee_id """
+        with self.lock:
+            self._journal = []
+        try:
+            following, followers_of, edge_count = _build_lists(rows)
+        except Exception:
+            with self.lock:
+                self._journal = None
+            raise
+        with self.lock:
+            self._following, self._followers = following, followers_of
+            self.edge_count = edge_count
+            journal, self._journal = self._journal, None
+            # Edges written while the rows were read may be missing from them
+            for action, user_id, other_id in journal:
+                self.apply(action, user_id, other_id)
+            self.loaded_at = time.monotonic()
+
+    def apply(self, action, user_id, other_id):
+        """ Apply one change recorded by record_edge_changes or record_user_removal """
+        if action == 'add':
+            self.add_edge(user_id, other_id)
+        elif action == 'remove':
+            self.remove_edge(user_id, other_id)
+        else:
+            self.remove_user(user_id)
+
+    def _record(self, action, user_id, other_id):
+        if self._journal is not None:
+            self._journal.append((action, user_id, other_id))
+
+    def add_edge(self, follower_id, followee_id):
+        """ Record that follower_id follows followee_id """
+        with self.lock:
+            self._record('add', follower_id, followee_id)
+            if _insert_sorted(self._following, follower_id, followee_id):
+                _insert_sorted(self._followers, followee_id, follower_id)
+                self.edge_count += 1
+
+    def remove_edge(self, follower_id, followee_id):
+        """ Forget that follower_id follows followee_id """
+        with self.lock:
+            self._record('remove', follower_id, followee_id)
+            if _remove_sorted(self._following, follower_id, followee_id):
+                _remove_sorted(self._followers, followee_id, follower_id)
+                self.edge_count -= 1
+
+    def remove_user(self, user_id):
+        """ Drop every edge touching a deleted user """
+        with self.lock:
+            self._record('drop', user_id, None)
+            for followee_id in self._following.pop(user_id, ()):
+                _remove_sorted(self._followers, followee_id, user_id)
+                self.edge_count -= 1
+            for follower_id in self._followers.pop(user_id, ()):
+                _remove_sorted(self._following, follower_id, user_id)
+                self.edge_count -= 1
+
+    def following(self, user_id):
+        """ Sorted ids user_id follows """
+        return self._following.get(user_id, ())
+
+    def followers(self, user_id):
+        """ Sorted ids following user_id """
+        return self._followers.get(user_id, ())
+
+    def follows(self, follower_id, followee_id):
+        """ True if follower_id follows followee_id """
+        ids = self._following.get(follower_id, ())
+        position = bisect_left(ids, followee_id)
+        return position < len(ids) and ids[position] == followee_id
+
+    def rank(self, user_id, limit):
+        """ Return up to limit (candidate_id, score, mutual_count, follows_you) tuples, best first """
+        with self.lock:
+            candidates = {}
+            for friend_id in _sample(self.following(user_id), MAX_FRIENDS_SCANNED):
+                friend_following = self.following(friend_id)
+                # Someone following thousands of users says little about each of them
+                weight = 1.0 / math.log2(2 + len(friend_following))
+                for candidate_id in _sample(friend_following, MAX_FRIEND_FOLLOWING_SCANNED):
+                    entry = candidates.setdefault(candidate_id, [0.0, 0, False])
+                    entry[0] += weight
+                    entry[1] += 1
+            for follower_id in _sample(self.followers(user_id), MAX_FRIEND_FOLLOWING_SCANNED):
+                entry = candidates.setdefault(follower_id, [0.0, 0, False])
+                entry[0] += FOLLOWS_YOU_WEIGHT
+                entry[2] = True
+
+            ranked = heapq.nlargest(
+                limit,
+                ((candidate_id, round(score, 4), mutual_count, follows_you)
+                 for candidate_id, (score, mutual_count, follows_you) in candidates.items()
+                 if candidate_id != user_id and not self.follows(user_id, candidate_id)),
+                key=lambda candidate: (candidate[1], -candidate[0]))
+        return ranked
+
+
+class Recommender:
+    """ Serves per-user top-K lists from a FollowGraph through a bounded cache """
+
+    def __init__(self, graph, cache, top_k=50, ttl=300):
+        self.graph = graph
+        self.cache = cache
+        self.top_k = top_k
+        self.ttl = ttl
+
+    def _key(self, user_id):
+        # Lists ranked before the graph was last reloaded are never served again
+        return (self.graph.loaded_at, user_id)
+
+    def suggestions(self, user_id, limit):
+        """ Return up to limit ranked suggestions for user_id """
+        ranked = self.cache.get(self._key(user_id))
+        if ranked is None:
+            ranked = tuple(self.graph.rank(user_id, self.top_k))
+            self.cache.set(self._key(user_id), ranked, self.ttl)
+        # Cached lists can predate a follow made in another request
+        return [entry for entry in ranked if not self.graph.follows(user_id, entry[0])][:limit]
+
+    def invalidate(self, user_ids):
+        """ Drop the cached lists of the given users """
+        self.cache.delete(*(self._key(user_id) for user_id in user_ids))
+
+
+follow_graph = FollowGraph()
+
+
+def init_recommendations(app_obj):
+    """ Create the recommender with its list cache sized by RECOMMENDATION_CACHE_ENTRIES """
+    cache = LocalUserCache(max_entries=app_obj.config.get('RECOMMENDATION_CACHE_ENTRIES', 10000))
+    recommender = Recommender(follow_graph, cache,
+                              top_k=app_obj.config.get('RECOMMENDATION_TOP_K', 50),
+                              ttl=app_obj.config.get('RECOMMENDATION_CACHE_TTL', 300))
+    app_obj.extensions['recommendations'] = recommender
+    return recommender
+
+
+def _load_follow_graph():
+    rows = (db.session.query(followers.c.follower_id, followers.c.followee_id)
+            .order_by(followers.c.follower_id, followers.c.followee_id)
+            .yield_per(LOAD_BATCH_SIZE))
+    follow_graph.load(rows)
+    logger.info('Follow graph loaded with %s edges', follow_graph.edge_count)
+
+
+_reload = BackgroundReload('follow graph', _load_follow_graph, lambda: follow_graph.loaded_at)
+
+
+def get_recommender():
+    """ Return the recommender for the current app, loading the graph on first use and in the background after """
+    _reload.ensure_fresh(current_app.config.get('RECOMMENDATION_INDEX_MAX_AGE', 600))
+    return current_app.extensions['recommendations']
+
+
+def record_edge_changes(session, action, follower_id, followee_ids):
+    """ Schedule graph updates for edges written in this transaction; action is 'add' or 'remove' """
+    session.info.setdefault(_PENDING_KEY, []).extend(
+        (action, follower_id, followee_id) for followee_id in followee_ids)
+
+
+def record_user_removal(session, user_id):
+    """ Schedule removing a deleted user's edges from the graph """
+    session.info.setdefault(_PENDING_KEY, []).append(('drop', user_id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_edge_changes(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes or not has_app_context():
+        return
+    recommender = current_app.extensions.get('recommendations')
+    if recommender is None:
+        return
+    graph = recommender.graph
+    affected = set()
+    for action, user_id, other_id in changes:
+        if graph.tracks_writes:
+            graph.apply(action, user_id, other_id)
+        affected.add(user_id)
+        if other_id is not None:
+            affected.add(other_id)
+    recommender.invalidate(affected)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_edge_changes(session):
+    session.info.pop(_PENDING_KEY, None)
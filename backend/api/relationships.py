@@ -0,0 +1,314 @@
+"""
+relationships.py
+-----------------------------
+This module contains set-based queries over the followers table, so routes can
+summarise relationships for many users without loading ORM collections. Every
+edge write also updates the denormalized follower/following counters on users
+in the same transaction.
+
+Edge writes lock the users rows of everyone involved, in id order, before they
+touch followers or the counters, so writes sharing users (a mutual follow, an
+unfollow racing a deletion) queue up instead of deadlocking. Gap locks taken by
+the edge reads can still deadlock unrelated writes on MySQL; the routes run
+their edge writes through commit_with_deadlock_retry for that.
+"""
+from collections import Counter
+from logging import getLogger
+from sqlalchemy import func, insert, select, tuple_, update, or_, and_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, followers, User
+from user_cache import mark_users_stale
+from recommendations import record_edge_changes
+
+logger = getLogger(__name__)
+
+# MySQL's error for a transaction rolled back as a deadlock victim
+DEADLOCK_ERROR_CODE = 1213
+DEADLOCK_ATTEMPTS = 3
+
+
+def get_follow_counts(user_ids):
+    """ Return {user_id: (follower_count, following_count)} for the given users from the denormalized counters """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    rows = db.session.execute(
+        select(User.id, User.follower_count, User.following_count).where(User.id.in_(user_ids)))
+    return {user_id: (follower_count, following_count) for user_id, follower_count, following_count in rows}
+
+
+def _adjust_counts(column, user_ids, delta):
+    """ Shift a counter column for the given users inside the caller's transaction """
+    if not user_ids or not delta:
+        return
+    mark_users_stale(db.session, user_ids)
+    db.session.execute(
+        update(User.__table__)
+        .where(User.__table__.c.id.in_(list(user_ids)))
+        .values({column: getattr(User.__table__.c, column) + delta}))
+
+
+def get_viewer_flags(viewer_id, user_ids):
+    """
+    Return (viewer_follows, follows_viewer) id sets for the given users in one query.
+    viewer_follows holds the ids the viewer follows; follows_viewer holds the ids following the viewer.
+    """
+    user_ids = list(user_ids)
+    if viewer_id is None or not user_ids:
+        return set(), set()
+
+    rows = db.session.execute(
+        select(followers.c.follower_id, followers.c.followee_id).where(or_(
+            and_(followers.c.follower_id == viewer_id, followers.c.followee_id.in_(user_ids)),
+            and_(followers.c.followee_id == viewer_id, followers.c.follower_id.in_(user_ids)),
+        ))
+    )
+    viewer_follows, follows_viewer = set(), set()
+    for follower_id, followee_id in rows:
+        if follower_id == viewer_id:
+            viewer_follows.add(followee_id)
+        else:
+            follows_viewer.add(follower_id)
+    return viewer_follows, follows_viewer
+
+
+def resolve_user_ids(usernames):
+    """
+    Return {username: id} for the given usernames in one query, keyed by the names as requested.
+    Unknown and deleted usernames are omitted.
+    Matching follows the column collation, which is case-insensitive on MySQL.
+    """
+    usernames = list(usernames)
+    if not usernames:
+        return {}
+    rows = db.session.execute(
+        select(User.username, User.id).where(User.username.in_(usernames), User.deleted_at.is_(None))).all()
+    exact = dict(rows)
+    folded = {username.lower(): user_id for username, user_id in rows}
+    resolved = {}
+    for username in usernames:
+        user_id = exact.get(username, folded.get(username.lower()))
+        if user_id is not None:
+            resolved[username] = user_id
+    return resolved
+
+
+def _insert_edges_statement():
+    """
+    INSERT into followers that skips edges already present. Unlike INSERT IGNORE it still fails on
+    a missing user, since only the primary key conflict is handled.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        return mysql_insert(followers).on_duplicate_key_update(follower_id=followers.c.follower_id)
+    if dialect == 'sqlite':
+        return sqlite_insert(followers).on_conflict_do_nothing(index_elements=['follower_id', 'followee_id'])
+    return insert(followers)
+
+
+def lock_users(user_ids):
+    """ Lock the users rows of the given ids with one statement, in id order, until the transaction ends """
+    users = User.__table__
+    db.session.execute(
+        select(users.c.id).where(users.c.id.in_(sorted(set(user_ids)))).order_by(users.c.id).with_for_update())
+
+
+def _is_deadlock(error):
+    return bool(getattr(error.orig, 'args', None)) and error.orig.args[0] == DEADLOCK_ERROR_CODE
+
+
+def commit_with_deadlock_retry(work):
+    """
+    Run work() and commit, starting the transaction again when MySQL rolls it back as a deadlock victim.
+    Returns what work() returned; other errors, and a deadlock on the last attempt, are raised.
+    """
+    for attempt in range(1, DEADLOCK_ATTEMPTS + 1):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError as error:
+            db.session.rollback()
+            if attempt == DEADLOCK_ATTEMPTS or not _is_deadlock(error):
+                raise
+            logger.warning('Deadlock writing follow edges, retrying (attempt %s of %s)', attempt, DEADLOCK_ATTEMPTS)
+    return None
+
+
+def add_follow_edge(follower_id, followee_id):
+    """ Insert one edge unless it exists. Returns True if a row was written """
+    # MySQL reports a duplicate key as an affected row, so what is new comes from the locked read
+    return followee_id in add_follow_edges(follower_id, [followee_id])
+
+
+def remove_follow_edge(follower_id, followee_id):
+    """ Delete one edge. Returns True if a row was removed """
+    lock_users([follower_id, followee_id])
+    statement = followers.delete().where(
+        followers.c.follower_id == follower_id,
+        followers.c.followee_id == followee_id)
+    if db.session.execute(statement).rowcount == 0:
+        return False
+    _adjust_counts('following_count', [follower_id], -1)
+    _adjust_counts('follower_count', [followee_id], -1)
+    record_edge_changes(db.session, 'remove', follower_id, [followee_id])
+    return True
+
+
+def _lock_existing_followee_ids(follower_id, followee_ids):
+    """
+    Return which of followee_ids follower_id already follows, locked until the transaction ends.
+    Every involved user row is locked first, so concurrent writes by the same follower run one after another
+    and each sees the edges the previous one committed.
+    """
+    lock_users([follower_id, *followee_ids])
+    rows = db.session.execute(
+        select(followers.c.followee_id)
+        .where(followers.c.follower_id == follower_id, followers.c.followee_id.in_(followee_ids))
+        .with_for_update())
+    return set(rows.scalars())
+
+
+def add_follow_edges(follower_id, followee_ids):
+    """
+    Insert edges from follower_id to every id in followee_ids with one multi-row statement.
+    Returns the set of followee ids that were newly followed.
+    """
+    followee_ids = set(followee_ids)
+    if not followee_ids:
+        return set()
+    # The locked read decides what is new; no other transaction can add these edges before this one ends
+    new_ids = followee_ids - _lock_existing_followee_ids(follower_id, followee_ids)
+    if new_ids:
+        db.session.execute(
+            _insert_edges_statement(),
+            [{'follower_id': follower_id, 'followee_id': followee_id} for followee_id in sorted(new_ids)])
+        _adjust_counts('following_count', [follower_id], len(new_ids))
+        _adjust_counts('follower_count', new_ids, 1)
+        record_edge_changes(db.session, 'add', follower_id, new_ids)
+    return new_ids
+
+
+def remove_follow_edges(follower_id, followee_ids):
+    """
+    Delete edges from follower_id to every id in followee_ids with one statement.
+    Returns the set of followee ids that were unfollowed.
+    """
+    followee_ids = set(followee_ids)
+    if not followee_ids:
+        return set()
+    # The rows read here stay locked, so the delete removes exactly these edges
+    removed_ids = _lock_existing_followee_ids(follower_id, followee_ids)
+    if removed_ids:
+        db.session.execute(followers.delete().where(
+            followers.c.follower_id == follower_id,
+            followers.c.followee_id.in_(removed_ids)))
+        _adjust_counts('following_count', [follower_id], -len(removed_ids))
+        _adjust_counts('follower_count', removed_ids, -1)
+        record_edge_changes(db.session, 'remove', follower_id, removed_ids)
+    return removed_ids
+
+
+def _adjust_counts_by(column, deltas):
+    """ Apply {user_id: delta} to a counter column with one UPDATE per distinct delta """
+    user_ids_by_delta = {}
+    for user_id, delta in deltas.items():
+        user_ids_by_delta.setdefault(delta, []).append(user_id)
+    for delta, user_ids in user_ids_by_delta.items():
+        _adjust_counts(column, user_ids, delta)
+
+
+def insert_edges(edges):
+    """
+    Insert (follower_id, followee_id) edges between any users with one multi-row statement, for bulk imports.
+    Self-follows and edges that already exist are skipped. Returns the number of edges written.
+    """
+    edges = {(follower_id, followee_id) for follower_id, followee_id in edges if follower_id != followee_id}
+    if not edges:
+        return 0
+    lock_users({user_id for edge in edges for user_id in edge})
+    # Row-value IN on the primary key: one point lookup per edge
+    existing = db.session.execute(
+        select(followers.c.follower_id, followers.c.followee_id)
+        .where(tuple_(followers.c.follower_id, followers.c.followee_id).in_(edges))).all()
+    new_edges = sorted(edges - set(existing))
+    if not new_edges:
+        return 0
+    # Sent as an executemany, which SQLAlchemy batches into multi-row INSERTs compiled once
+    db.session.execute(
+        _insert_edges_statement(),
+        [{'follower_id': follower_id, 'followee_id': followee_id} for follower_id, followee_id in new_edges])
+    _adjust_counts_by('following_count', Counter(follower_id for follower_id, _ in new_edges))
+    _adjust_counts_by('follower_count', Counter(followee_id for _, followee_id in new_edges))
+    for follower_id, followee_id in new_edges:
+        record_edge_changes(db.session, 'add', follower_id, [followee_id])
+    return len(new_edges)
+
+
+def release_edges_chunk(user_id, chunk_size):
+    """
+    Delete up to chunk_size of user_id's edges, the users they follow first and then their followers,
+    decrementing the counters on both sides in the caller's transaction.
+    Returns the number of edges removed, 0 once the user has none left.
+    """
+    followee_ids = db.session.execute(
+        select(followers.c.followee_id).where(followers.c.follower_id == user_id).limit(chunk_size)).scalars().all()
+    if followee_ids:
+        return len(remove_follow_edges(user_id, followee_ids))
+
+    # The edges are locked by the read, as the user is hidden and the followers' rows are not known yet.
+    # Only another deletion job unfollowing this user can wait on them, and the worker retries a deadlock.
+    follower_ids = db.session.execute(
+        select(followers.c.follower_id).where(followers.c.followee_id == user_id).limit(chunk_size)
+        .with_for_update()).scalars().all()
+    if not follower_ids:
+        return 0
+    lock_users([user_id, *follower_ids])
+    db.session.execute(followers.delete().where(
+        followers.c.followee_id == user_id,
+        followers.c.follower_id.in_(follower_ids)))
+    _adjust_counts('following_count', follower_ids, -1)
+    _adjust_counts('follower_count', [user_id], -len(follower_ids))
+    for follower_id in follower_ids:
+        record_edge_changes(db.session, 'remove', follower_id, [user_id])
+    return len(follower_ids)
+
+
+def _drifted(counts):
+    users = User.__table__
+    return or_(users.c.follower_count != counts['follower_count'], users.c.following_count != counts['following_count'])
+
+
+def _reconcile_range(in_range, counts):
+    """ Set the counters of drifted users in one id range with a single UPDATE; returns how many changed """
+    users = User.__table__
+    changed = db.session.execute(update(users).where(in_range, _drifted(counts)).values(counts)).rowcount
+    if changed:
+        mark_users_stale(db.session, db.session.execute(select(users.c.id).where(in_range)).scalars().all())
+    return changed
+
+
+def reconcile_follow_counts(batch_size=1000, dry_run=False):
+    """
+    Recompute the denormalized counters from the followers table, one id range per transaction.
+    Each range is repaired by one UPDATE that counts the edges itself, as migration 0001's backfill does,
+    so a follow committed while it runs is never overwritten with a count read before it.
+    Returns the number of users whose counters had drifted.
+    """
+    users = User.__table__
+    counts = {
+        'follower_count': select(func.count()).where(followers.c.followee_id == users.c.id).scalar_subquery(),
+        'following_count': select(func.count()).where(followers.c.follower_id == users.c.id).scalar_subquery(),
+    }
+    max_id = db.session.execute(select(func.max(users.c.id))).scalar() or 0
+    repaired = 0
+    for start in range(0, max_id, batch_size):
+        in_range = and_(users.c.id > start, users.c.id <= start + batch_size)
+        if dry_run:
+            repaired += db.session.execute(select(func.count()).where(in_range, _drifted(counts))).scalar()
+        else:
+            # The UPDATE locks the range's rows in id order, like lock_users, but can still meet a follow's gap lock
+            repaired += commit_with_deadlock_retry(lambda in_range=in_range: _reconcile_range(in_range, counts))
+    return repaired
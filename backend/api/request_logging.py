@@ -0,0 +1,111 @@
+"""
+request_logging.py
+-----------------------------
+This module logs every request from app hooks instead of from each handler.
+Nothing is built unless the level is enabled: the summary line is logged at INFO,
+headers at DEBUG, and bodies at DEBUG for a sampled fraction of requests
+(LOG_BODY_SAMPLE_RATE). Sensitive headers and body fields are redacted while the
+message is rendered, so the payload itself is never copied.
+"""
+from logging import DEBUG, INFO, getLogger
+import random
+import time
+from flask import current_app, g, request
+
+logger = getLogger(__name__)
+
+SENSITIVE_HEADERS = frozenset(('authorization', 'cookie', 'set-cookie', 'x-api-key'))
+SENSITIVE_FIELDS = ('password', 'token', 'secret')
+MAX_LOGGED_BODY = 2000
+REDACTED = '***'
+
+
+def _is_sensitive_field(key):
+    key = str(key).lower()
+    return any(word in key for word in SENSITIVE_FIELDS)
+
+
+class _RedactedHeaders:
+    """ Renders request headers with credentials masked, only when the record is emitted """
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def __str__(self):
+        return ', '.join(f'{name}: {REDACTED if name.lower() in SENSITIVE_HEADERS else value}'
+                         for name, value in self.headers.items())
+
+
+class _RedactedBody:
+    """ Renders a parsed JSON body with sensitive fields masked, only when the record is emitted """
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def _render(cls, value, parts):
+        if isinstance(value, dict):
+            parts.append('{')
+            for index, (key, item) in enumerate(value.items()):
+                parts.append(f'{", " if index else ""}{key!r}: ')
+                if _is_sensitive_field(key):
+                    parts.append(repr(REDACTED))
+                else:
+                    cls._render(item, parts)
+            parts.append('}')
+        elif isinstance(value, list):
+            parts.append('[')
+            for index, item in enumerate(value):
+                if index:
+                    parts.append(', ')
+                cls._render(item, parts)
+            parts.append(']')
+        else:
+            parts.append(repr(value))
+
+    def __str__(self):
+        parts = []
+        self._render(self.data, parts)
+        rendered = ''.join(parts)
+        if len(rendered) > MAX_LOGGED_BODY:
+            return f'{rendered[:MAX_LOGGED_BODY]}... ({len(rendered)} chars)'
+        return rendered
+
+
+def _start_timer():
+    if logger.isEnabledFor(INFO):
+        g.request_started = time.perf_counter()
+
+
+def _log_request(response):
+    """ Log the finished request; skipped entirely when INFO is disabled for this logger """
+    if not logger.isEnabledFor(INFO):
+        return response
+
+    started = g.get('request_started')
+    elapsed_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+    logger.info('%s %s -> %s (%.1f ms)', request.method, request.full_path.rstrip('?'),
+                response.status_code, elapsed_ms)
+
+    if logger.isEnabledFor(DEBUG):
+        logger.debug('Headers: %s', _RedactedHeaders(request.headers))
+        sample_rate = current_app.config.get('LOG_BODY_SAMPLE_RATE', 0.0)
+        if sample_rate and random.random() < sample_rate:
+            _log_body()
+    return response
+
+
+def _log_body():
+    if request.is_json:
+        # get_json caches the parsed body, so a handler that already read it is not re-parsed
+        data = request.get_json(silent=True)
+        if data is not None:
+            logger.debug('Body (JSON): %s', _RedactedBody(data))
+            return
+    logger.debug('Body: %s, %s bytes', request.content_type or 'no content type', request.content_length or 0)
+
+
+def register_request_logging(app_obj):
+    """ Install the request logging hooks on the app """
+    app_obj.before_request(_start_timer)
+    app_obj.after_request(_log_request)
@@ -0,0 +1,378 @@
+"""
+search_index.py
+-----------------------------
+This module contains the in-process search index used by the user search route.
+Usernames and the start of bios are broken into trigrams so substring and fuzzy
+lookups only touch the posting lists for the query instead of scanning users.
+Posting lists are sorted arrays of user ids, and a sorted username list serves
+prefix matches. Queries shorter than a trigram only match username prefixes,
+in username order, so they stop as soon as the page is full.
+
+The postings form an immutable snapshot that searches read without a lock.
+Each worker rebuilds the snapshot from the database every SEARCH_INDEX_MAX_AGE
+seconds in a background thread. Writes made in between go to a small overlay
+that is replaced, never changed, on every write; a rebuild keeps the overlay
+entries written while its rows were read and drops the rest. Until the first
+snapshot is built, searches are served as username prefix matches from the
+database.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+import heapq
+from logging import getLogger
+from threading import Lock
+import time
+from flask import current_app
+from sqlalchemy import func, select
+from models import db, User
+from background_reload import BackgroundReload
+
+logger = getLogger(__name__)
+
+GRAM_SIZE = 3
+FUZZY_THRESHOLD = 0.3
+LOAD_BATCH_SIZE = 1000
+# Only the start of a bio is indexed and matched, which bounds the postings per user
+BIO_INDEX_CHARS = 64
+
+# Score tiers, highest first
+EXACT_MATCH = 4
+PREFIX_MATCH = 3
+SUBSTRING_MATCH = 2
+FUZZY_MATCH = 1
+BIO_MATCH = 0
+
+# docs: {user_id: (username, bio)}; username_grams and bio_grams: {gram: array of sorted user ids};
+# usernames and username_ids: the (username, user_id) pairs in sorted order, as two parallel sequences
+Snapshot = namedtuple('Snapshot', ['docs', 'username_grams', 'bio_grams', 'usernames', 'username_ids'])
+EMPTY_SNAPSHOT = Snapshot({}, {}, {}, [], array('i'))
+
+
+def _normalize(text):
+    """ Lower-case and trim text for indexing """
+    return (text or '').strip().lower()
+
+
+def _normalize_bio(bio):
+    """ The indexed part of a bio """
+    return _normalize(bio)[:BIO_INDEX_CHARS]
+
+
+def _grams(text):
+    """ Return the set of padded trigrams for a normalized string """
+    if not text:
+        return set()
+    padded = f'  {text} '
+    return {padded[i:i + GRAM_SIZE] for i in range(len(padded) - GRAM_SIZE + 1)}
+
+
+def _inner_grams(text):
+    """ Return the unpadded trigrams of a normalized string, used for substring lookups """
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def is_short_query(query):
+    """ True for queries too short for a trigram, which only match username prefixes """
+    return len(_normalize(query)) < GRAM_SIZE
+
+
+def _fuzzy_similarity(query_grams, username, overlap):
+    """ Trigram similarity of a username sharing overlap grams with the query; a username has len + 1 grams """
+    return overlap / (len(query_grams) + len(username) + 1 - overlap)
+
+
+def _best_score(query, username, bio):
+    """ The best (tier, similarity) of one user for a query of a trigram or more, or None """
+    if username.startswith(query):
+        return (EXACT_MATCH if username == query else PREFIX_MATCH), len(query) / len(username)
+    if query in username:
+        return SUBSTRING_MATCH, len(query) / len(username)
+    query_grams = _grams(query)
+    similarity = _fuzzy_similarity(query_grams, username, len(query_grams & _grams(username)))
+    if similarity >= FUZZY_THRESHOLD:
+        return FUZZY_MATCH, similarity
+    if query in bio:
+        return BIO_MATCH, 0.0
+    return None
+
+
+def _score_overlay(overlay, query):
+    """ {user_id: best score} of the overlay entries matching a query of a trigram or more """
+    scores = {}
+    for user_id, (_, username, bio) in overlay.items():
+        score = _best_score(query, username, bio) if username else None
+        if score:
+            scores[user_id] = score
+    return scores
+
+
+def _contains(ids, user_id):
+    """ Binary search in a sorted posting array """
+    position = bisect_left(ids, user_id)
+    return position < len(ids) and ids[position] == user_id
+
+
+def _build_snapshot(rows):
+    """ Build a snapshot from normalized (id, username, bio) rows in ascending id order """
+    docs, username_grams, bio_grams = {}, {}, {}
+    for user_id, username, bio in rows:
+        docs[user_id] = (username, bio)
+        # Ids arrive in ascending order, so appending keeps every posting array sorted
+        for gram in _grams(username):
+            username_grams.setdefault(gram, array('i')).append(user_id)
+        for gram in _inner_grams(bio):
+            bio_grams.setdefault(gram, array('i')).append(user_id)
+    ordered = sorted((username, user_id) for user_id, (username, _) in docs.items())
+    return Snapshot(docs, username_grams, bio_grams,
+                    [username for username, _ in ordered], array('i', (user_id for _, user_id in ordered)))
+
+
+class SearchIndex:
+    """ Trigram and prefix index over usernames and bios """
+
+    def __init__(self):
+        # (snapshot, overlay), swapped as one reference so a search always sees a matching pair. The overlay maps
+        # user_id -> (sequence, username, bio) for writes since the snapshot; username None is a removal
+        self._state = (EMPTY_SNAPSHOT, {})
+        self._write_lock = Lock()
+        self._sequence = 0
+        self._loading = False
+        self.loaded_at = None
+
+    def __len__(self):
+        snapshot, overlay = self._state
+        return len(snapshot.docs) + sum(
+            (entry[1] is not None) - (user_id in snapshot.docs) for user_id, entry in overlay.items())
+
+    @property
+    def is_loaded(self):
+        """ Whether a snapshot has been built from the database """
+        return self.loaded_at is not None
+
+    @property
+    def tracks_writes(self):
+        """ Whether writes should be indexed: a snapshot is loaded or being built """
+        return self.loaded_at is not None or self._loading
+
+    def add(self, user_id, username, bio=None):
+        """ Add or replace the entry for a user """
+        self._write(user_id, _normalize(username), _normalize_bio(bio))
+
+    def remove(self, user_id):
+        """ Remove a user from the index if present """
+        self._write(user_id, None, None)
+
+    def _write(self, user_id, username, bio):
+        with self._write_lock:
+            self._sequence += 1
+            snapshot, overlay = self._state
+            self._state = (snapshot, {**overlay, user_id: (self._sequence, username, bio)})
+
+    def search(self, query, limit=None, after=None):
+        """
+        Search the index and return a ranked list of (user_id, score) tuples, higher scores first.
+        Scores are (tier, similarity) pairs, or (tier, username) for queries shorter than a trigram, which are
+        ranked by username. Only hits ranked after the cursor key in after (score followed by user_id) are returned.
+        Raises ValueError for a cursor from the other kind of query.
+        """
+        query = _normalize(query)
+        if not query:
+            return []
+        short = len(query) < GRAM_SIZE
+        if after and isinstance(after[1], str) != short:
+            raise ValueError('The cursor belongs to a different query')
+        snapshot, overlay = self._state
+        if short:
+            return self._search_prefix(snapshot, overlay, query, limit, after)
+        return self._search_ranked(snapshot, overlay, query, limit, after)
+
+    @staticmethod
+    def _search_prefix(snapshot, overlay, query, limit, after):
+        """ Username prefix matches in (username, id) order, reading no further than the page """
+        after_key = (after[1], after[2]) if after else None
+        hits = []
+        position = bisect_left(snapshot.usernames, after_key[0] if after_key else query)
+        while position < len(snapshot.usernames) and (limit is None or len(hits) < limit):
+            username, user_id = snapshot.usernames[position], snapshot.username_ids[position]
+            position += 1
+            if not username.startswith(query):
+                break
+            if user_id not in overlay and (after_key is None or (username, user_id) > after_key):
+                hits.append((username, user_id))
+        hits.extend((username, user_id) for user_id, (_, username, _) in overlay.items()
+                    if username and username.startswith(query)
+                    and (after_key is None or (username, user_id) > after_key))
+        hits.sort()
+        return [(user_id, (EXACT_MATCH if username == query else PREFIX_MATCH, username))
+                for username, user_id in hits[:limit]]
+
+    def _search_ranked(self, snapshot, overlay, query, limit, after):
+        after_key = (-after[0], -after[1], after[2]) if after else None
+        overlay_scores = _score_overlay(overlay, query)
+        ranked, seen = [], set()
+        # Collectors run from the highest tier down, so a hit keeps the tier of the first one that finds it
+        # and lower tiers are never scored once the page is full
+        for collect, tiers in ((self._collect_prefix, (PREFIX_MATCH, EXACT_MATCH)),
+                               (self._collect_substring, (SUBSTRING_MATCH, SUBSTRING_MATCH)),
+                               (self._collect_fuzzy, (FUZZY_MATCH, FUZZY_MATCH)),
+                               (self._collect_bio, (BIO_MATCH, BIO_MATCH))):
+            scores = {}
+            collect(snapshot, query, scores)
+            # Overlay entries replace the snapshot's copy of the same user
+            for user_id in overlay:
+                scores.pop(user_id, None)
+            scores.update((user_id, score) for user_id, score in overlay_scores.items()
+                          if tiers[0] <= score[0] <= tiers[1])
+            # Tiers above the cursor are still collected, so their hits are not found again by a lower tier
+            hits = [] if after and tiers[0] > after[0] else [
+                ((-score[0], -score[1], user_id), user_id, score)
+                for user_id, score in scores.items() if user_id not in seen]
+            seen.update(scores)
+            if after_key:
+                hits = [hit for hit in hits if hit[0] > after_key]
+            # Only the hits that can still make the page are ordered
+            hits = heapq.nsmallest(limit - len(ranked), hits) if limit else sorted(hits)
+            ranked.extend((user_id, score) for _, user_id, score in hits)
+            if limit and len(ranked) >= limit:
+                break
+        return ranked
+
+    @staticmethod
+    def _collect_prefix(snapshot, query, scores):
+        start = bisect_left(snapshot.usernames, query)
+        # Every username with the prefix sorts below the prefix followed by the highest character
+        end = bisect_right(snapshot.usernames, query + '\U0010ffff', start)
+        for position in range(start, end):
+            username = snapshot.usernames[position]
+            tier = EXACT_MATCH if username == query else PREFIX_MATCH
+            _keep_best(scores, snapshot.username_ids[position], (tier, len(query) / len(username)))
+
+    @classmethod
+    def _collect_substring(cls, snapshot, query, scores):
+        for user_id in cls._intersect(snapshot.username_grams, _inner_grams(query)):
+            username = snapshot.docs[user_id][0]
+            if query in username:
+                _keep_best(scores, user_id, (SUBSTRING_MATCH, len(query) / len(username)))
+
+    @staticmethod
+    def _collect_fuzzy(snapshot, query, scores):
+        query_grams = _grams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(snapshot.username_grams.get(gram, ()))
+        for user_id, overlap in shared.items():
+            similarity = _fuzzy_similarity(query_grams, snapshot.docs[user_id][0], overlap)
+            if similarity >= FUZZY_THRESHOLD:
+                _keep_best(scores, user_id, (FUZZY_MATCH, similarity))
+
+    @classmethod
+    def _collect_bio(cls, snapshot, query, scores):
+        for user_id in cls._intersect(snapshot.bio_grams, _inner_grams(query)):
+            if query in snapshot.docs[user_id][1]:
+                _keep_best(scores, user_id, (BIO_MATCH, 0.0))
+
+    @staticmethod
+    def _intersect(postings, grams):
+        """ Ids in every posting list: the rarest list is walked and looked up in the others by binary search """
+        lists = sorted((postings.get(gram, ()) for gram in grams), key=len)
+        if not lists or not lists[0]:
+            return []
+        return [user_id for user_id in lists[0] if all(_contains(ids, user_id) for ids in lists[1:])]
+
+    @staticmethod
+    def matches(query, username, bio=None):
+        """ Re-check a row against a query, used to drop hits that changed since indexing """
+        query = _normalize(query)
+        username = _normalize(username)
+        if len(query) < GRAM_SIZE:
+            return username.startswith(query)
+        return _best_score(query, username, _normalize_bio(bio)) is not None
+
+    def load(self, rows):
+        """
+        Replace the snapshot with one built from (id, username, bio) rows in ascending id order.
+        Searches keep using the old snapshot until the swap. Overlay entries written while the rows
+        were read are kept, since the rows may predate them; older ones are already in the rows.
+        """
+        with self._write_lock:
+            self._loading = True
+            started_at = self._sequence
+        try:
+            snapshot = _build_snapshot((user_id, _normalize(username), _normalize_bio(bio))
+                                       for user_id, username, bio in rows)
+        finally:
+            self._loading = False
+        with self._write_lock:
+            _, overlay = self._state
+            self._state = (snapshot, {user_id: entry for user_id, entry in overlay.items() if entry[0] > started_at})
+            self.loaded_at = time.monotonic()
+
+
+def _keep_best(scores, user_id, score):
+    if score > scores.get(user_id, (-1, 0.0)):
+        scores[user_id] = score
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_database(query, limit, after=None):
+    """
+    Username prefix matches read from the database, in the form and order of SearchIndex.search for a short
+    query. Used while a worker builds its first snapshot.
+    """
+    query = _normalize(query)
+    if not query:
+        return []
+    if after and not isinstance(after[1], str):
+        raise ValueError('The cursor belongs to a different query')
+    # A range on lower(username), which ix_users_username_lower serves in order; MySQL does not use a
+    # functional index for LIKE, so the LIKE only rechecks the rows the range reads
+    username = func.lower(User.username)
+    start = max(query, after[1]) if after else query
+    statement = (select(User.id, username)
+                 .where(username >= start, username < query[:-1] + chr(ord(query[-1]) + 1),
+                        username.like(f'{_escape_like(query)}%', escape='\\'), User.deleted_at.is_(None))
+                 .order_by(username, User.id).limit(limit))
+    if after:
+        statement = statement.where((username > after[1]) | ((username == after[1]) & (User.id > after[2])))
+    return [(user_id, (EXACT_MATCH if name == query else PREFIX_MATCH, name))
+            for user_id, name in db.session.execute(statement)]
+
+
+search_index = SearchIndex()
+
+
+def _load_search_index():
+    rows = (db.session.query(User.id, User.username, User.bio)
+            .filter(User.deleted_at.is_(None))
+            .order_by(User.id)
+            .yield_per(LOAD_BATCH_SIZE))
+    search_index.load(rows)
+    logger.info('Search index loaded with %s users', len(search_index))
+
+
+_reload = BackgroundReload('search index', _load_search_index, lambda: search_index.loaded_at)
+
+
+def ensure_search_index(wait=False):
+    """
+    Start building the index in the background on first use, and rebuild it once older than SEARCH_INDEX_MAX_AGE.
+    Unless wait is set, callers check is_loaded and fall back to search_database until the first build is done.
+    """
+    _reload.ensure_fresh(current_app.config.get('SEARCH_INDEX_MAX_AGE', 300), wait=wait)
+    return search_index
+
+
+def index_user(user):
+    """ Keep the index in step after a user is created or edited """
+    if search_index.tracks_writes:
+        search_index.add(user.id, user.username, user.bio)
+
+
+def unindex_user(user_id):
+    """ Keep the index in step after a user is deleted """
+    if search_index.tracks_writes:
+        search_index.remove(user_id)
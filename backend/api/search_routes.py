@@ -8,53 +8,98 @@ from logging import getLogger
 from flask import Blueprint, jsonify, request
 from models import User, db
 import sqlalchemy.exc
-from utils import log_request
+from sqlalchemy import select
+from utils import get_optional_identity
+from search_index import ensure_search_index, is_short_query, search_database
+from relationships import get_viewer_flags
+from pagination import get_page_args, split_page
+from serializers import USER_CARD
 
 search_bp = Blueprint('search_bp', __name__)
 logger = getLogger(__name__)
 
+# Search results have always carried the follower counters
+SEARCH_FIELDS = USER_CARD.default_fields + ('followerCount', 'followingCount')
+
+def _ranked_hits(query, limit, cursor):
+    """ The index and the hits after the cursor, from the database until this worker's index is built """
+    # A page continues from the source of its cursor: username cursors come from prefix matches, which the
+    # database can serve, while ranked cursors need the index
+    ranked_cursor = cursor is not None and not isinstance(cursor[1], str)
+    index = ensure_search_index(wait=ranked_cursor)
+    if index.is_loaded and (cursor is None or ranked_cursor or is_short_query(query)):
+        return index, index.search(query, limit, after=cursor)
+    return index, search_database(query, limit, after=cursor)
+
+def _search_page(query, page_args, fields):
+    """ Return the user rows on one page of ranked search hits and the cursor for the next page """
+    limit, cursor = page_args
+    # Only the hits after the cursor are ranked, one more than the page to know whether another follows
+    index, hits = _ranked_hits(query, limit + 1, cursor)
+    ranked = [(user_id, tier, similarity) for user_id, (tier, similarity) in hits]
+    hits, next_cursor = split_page(ranked, limit, lambda hit: [hit[1], hit[2], hit[0]])
+
+    hit_ids = [hit[0] for hit in hits]
+    if not hit_ids:
+        return [], next_cursor
+    # The username and bio are always loaded to recheck the hits against the live rows
+    columns = USER_CARD.columns(fields, User.id, User.username, User.bio)
+    rows = db.session.execute(select(*columns).where(User.id.in_(hit_ids), User.deleted_at.is_(None)))
+    users_by_id = {row.id: row for row in rows}
+    # Rows may have changed in another worker since they were indexed
+    users = [
+        users_by_id[user_id] for user_id in hit_ids
+        if user_id in users_by_id and index.matches(query, users_by_id[user_id].username, users_by_id[user_id].bio)
+    ]
+    return users, next_cursor
+
+def _summarize_users(users, fields):
+    """ Serialize search hits and, for signed-in viewers, add relationship flags """
+    user_ids = [user.id for user in users]
+
+    # The viewer is optional; anonymous searches only get the user fields
+    viewer = get_optional_identity()
+    viewer_follows, follows_viewer = get_viewer_flags(viewer.id if viewer else None, user_ids)
+
+    results = []
+    for u in users:
+        result = USER_CARD.serialize(u, fields)
+        if viewer is not None:
+            result['youFollow'] = u.id in viewer_follows
+            result['followsYou'] = u.id in follows_viewer
+        results.append(result)
+    return results
+
 @search_bp.route('/search', methods=['GET'])
 def search_users():
-    """Search users by username (partial match)"""
+    """Search users by username and bio (prefix, substring and fuzzy match)"""
     try:
-        log_request(request)
         logger.debug('Searching for users with query: %s', request.args.get('q', ''))
         query = request.args.get('q', '')
         if not query:
             # Consider if this should be an error or just an empty list
             return jsonify({'message': 'Search query cannot be empty', 'users': []}), 400
 
-        users = User.query.filter(User.username.ilike(f"%{query}%")).all() # Using ilike for case-insensitive search
+        # Search cursors carry the rank key of the last hit: (tier, similarity, id), or (tier, username, id)
+        # for queries shorter than a trigram
+        page_args, error_response, status = get_page_args(request.args, key_types=(int, (int, float, str), int))
+        if error_response:
+            return error_response, status
+
+        fields, error_response, status = USER_CARD.parse_fields(request.args, SEARCH_FIELDS)
+        if error_response:
+            return error_response, status
 
+        try:
+            users, next_cursor = _search_page(query, page_args, fields)
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
         if not users:
             return jsonify({
-                'message': 'No users found matching your query', 'users': []
+                'message': 'No users found matching your query', 'users': [], 'nextCursor': next_cursor
                 }), 200 # 200 is appropriate for no results
 
-        followers = [{
-            'username': user.username,
-            'userId': user.id,
-            'email': user.email,
-            'bio': user.bio,
-            'dateJoined': str(user.created_at)} for user in users if user in user.followers]
-
-        following = [{
-            'username': user.username,
-            'userId': user.id,
-            'email': user.email,
-            'bio': user.bio,
-            'dateJoined': str(user.created_at)} for user in users if user in user.following]
-
-        results = [{
-            'username': u.username,
-            'userId': u.id, # Changed from id to userId for consistency with frontend User interface
-            'email': u.email,
-            'bio': u.bio,
-            'dateJoined': str(u.created_at), # Changed from date_joined to dateJoined,
-            'followers': followers,
-            'following': following
-        } for u in users]
-        return jsonify({'users': results}), 200
+        return jsonify({'users': _summarize_users(users, fields), 'nextCursor': next_cursor}), 200
     except sqlalchemy.exc.SQLAlchemyError:
         logger.error("Database error during user search")
         db.session.rollback() # Rollback in case of database error
@@ -0,0 +1,160 @@
+"""
+serializers.py
+-----------------------------
+This module builds the user payloads returned by the API from one field table
+per response shape, so every route names and formats user fields the same way.
+Clients pick the fields they need with ?fields=, and routes load only the
+matching columns as plain row tuples instead of full User objects.
+
+It also provides an orjson-backed JSON provider, used for every response and
+stream when orjson is installed (JSON_BACKEND=auto) or requested (orjson).
+"""
+from functools import lru_cache
+from logging import getLogger
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+from models import User
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library encoder is used instead
+    orjson = None
+
+logger = getLogger(__name__)
+
+JSON_BACKENDS = ('auto', 'orjson', 'stdlib')
+
+
+def _date_text(value):
+    """ The 'YYYY-MM-DD HH:MM:SS' form list payloads have always used """
+    return None if value is None else str(value)
+
+
+class UserSerializer:
+    """
+    One user response shape: public field name -> (User attribute, formatter or None).
+    Serializes anything with those attributes: User objects or rows selected from columns().
+    """
+
+    def __init__(self, fields, default_fields=None):
+        self.fields = fields
+        self.default_fields = tuple(default_fields or fields)
+
+    def parse_fields(self, args, default_fields=None):
+        """
+        Read the fields query parameter, a comma-separated list of field names.
+        Returns (field tuple, None, None) or (None, error_response, 400); default_fields when absent.
+        """
+        requested = args.get('fields')
+        if not requested:
+            return tuple(default_fields or self.default_fields), None, None
+        fields = tuple(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+        unknown = [name for name in fields if name not in self.fields]
+        if not fields or unknown:
+            allowed = ', '.join(self.fields)
+            return None, jsonify({'message': f'fields must be a comma-separated list of: {allowed}'}), 400
+        return fields, None, None
+
+    def columns(self, fields, *extra):
+        """ The User columns needed to serialize fields, plus any extra columns the caller needs, without repeats """
+        columns = {getattr(User, self.fields[name][0]): None for name in fields}
+        columns.update((column, None) for column in extra)
+        return list(columns)
+
+    @lru_cache(maxsize=64)
+    def _compile(self, fields):
+        # Resolved once per field selection instead of once per serialized user
+        return tuple((name, *self.fields[name]) for name in fields)
+
+    def serialize(self, source, fields=None):
+        """ Build the payload for a User or row with the given fields (the defaults when None) """
+        payload = {}
+        for name, attribute, formatter in self._compile(fields or self.default_fields):
+            value = getattr(source, attribute)
+            payload[name] = formatter(value) if formatter else value
+        return payload
+
+    def serialize_mapping(self, values, fields=None):
+        """ Build the payload from a dict of column values, such as a user cache snapshot """
+        payload = {}
+        for name, attribute, formatter in self._compile(fields or self.default_fields):
+            value = values[attribute]
+            payload[name] = formatter(value) if formatter else value
+        return payload
+
+
+# Users in lists: followers, following and search results
+USER_CARD = UserSerializer({
+    'username': ('username', None),
+    'dateJoined': ('created_at', _date_text),
+    'userId': ('id', None),
+    'email': ('email', None),
+    'bio': ('bio', None),
+    'followerCount': ('follower_count', None),
+    'followingCount': ('following_count', None),
+}, default_fields=('username', 'dateJoined', 'userId', 'email', 'bio'))
+
+# A single user: GET /api/users/<username> and POST /api/users/lookup
+USER_PROFILE = UserSerializer({
+    'id': ('id', None),
+    'username': ('username', None),
+    'email': ('email', None),
+    'bio': ('bio', None),
+    'created_at': ('created_at', None),
+    'follower_count': ('follower_count', None),
+    'following_count': ('following_count', None),
+})
+
+# The signed-in user returned by login and register
+AUTH_USER = UserSerializer({
+    'user_id': ('id', None),
+    'username': ('username', None),
+    'email': ('email', None),
+    'bio': ('bio', None),
+    'date_joined': ('created_at', _date_text),
+    'follower_count': ('follower_count', None),
+    'following_count': ('following_count', None),
+})
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """ JSON provider encoding with orjson; output matches the default provider's, only faster """
+
+    def _options(self):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        return options | orjson.OPT_SORT_KEYS if self.sort_keys else options
+
+    def dumps(self, obj, **kwargs):
+        """ Serialize obj to a JSON string """
+        if kwargs:  # Formatting options orjson does not support
+            return super().dumps(obj, **kwargs)
+        # Dates still go through the default provider so they keep their HTTP date format
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """ Deserialize a JSON string or bytes """
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """ Serialize the arguments as JSON and return a Response, indented in debug mode like the default """
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json_provider(app_obj):
+    """ Install the JSON provider selected by JSON_BACKEND ('auto', 'orjson' or 'stdlib') """
+    backend = app_obj.config.get('JSON_BACKEND', 'auto')
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f'JSON_BACKEND must be one of: {", ".join(JSON_BACKENDS)}')
+    if backend == 'stdlib':
+        return
+    if orjson is None:
+        if backend == 'orjson':
+            logger.warning('JSON_BACKEND is orjson but orjson is not installed; using the standard library encoder')
+        return
+    app_obj.json = OrjsonProvider(app_obj)
@@ -5,9 +5,10 @@ This module contains the routes for user profile management, including
 getting, editing, and deleting a user's bio.
 """
 from logging import getLogger
-from utils import get_user_or_404, check_for_token, log_request, validate_required_fields
+from utils import get_authorized_user, create_user_token, validate_required_fields
 from flask import Blueprint, jsonify, request
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_hashing import replace_password
+from token_revocation import get_revocation_store
 from flask_jwt_extended import jwt_required
 import sqlalchemy.exc
 from models import db
@@ -20,17 +21,12 @@ logger = getLogger(__name__)
 def change_password(username):
     """Change a user's password"""
     try:
-        log_request(request)
         logger.debug('Changing password for user: %s', username)
 
-        current_user_identity, error_response, status = check_for_token()
+        user, error_response, status = get_authorized_user(username, 'change this user\'s password')
         if error_response:
             return error_response, status
 
-        # Authorization: Check if the JWT identity matches the path username
-        if current_user_identity != username:
-            return jsonify({'message': 'You are not authorized to change this user\'s password'}), 403
-
         data = request.get_json()
 
         valid_data, missing_fields = validate_required_fields(data, ['newPassword'], "login")
@@ -40,22 +36,23 @@ def change_password(username):
             return jsonify({'error': 'Missing fields in request: ' + (', '.join(missing_fields))}), 400
 
         new_password = data.get('newPassword')
-        if not new_password:
-            return jsonify({'message': 'New password is required'}), 400
 
-        user, error_response, status = get_user_or_404(username)
+        replaced, error_response, status = replace_password(user.password, new_password)
         if error_response:
             return error_response, status
-
-        if check_password_hash(user.password, new_password):
+        same_as_current, new_hash = replaced
+        if same_as_current:
             return jsonify({'message': 'New password cannot be the same as the old one'}), 400
 
-        user.password = generate_password_hash(new_password)
+        user.password = new_hash
+        # Sign out every other session; the caller continues with the new token
+        get_revocation_store().revoke_user_tokens(user)
         db.session.commit()
 
         return jsonify({
             'message': 'Password updated successfully',
-            'username': user.username
+            'username': user.username,
+            'access_token': create_user_token(user)
         }), 200
 
     except sqlalchemy.exc.SQLAlchemyError as sql_error:
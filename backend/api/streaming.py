@@ -0,0 +1,66 @@
+"""
+streaming.py
+-----------------------------
+This module contains helpers for streaming large collections to the client as
+NDJSON or as an incrementally encoded JSON array, reading rows from the database
+with a server-side cursor so memory stays flat regardless of collection size.
+"""
+from flask import Response, current_app, stream_with_context, jsonify
+
+STREAM_FORMATS = ('ndjson', 'json')
+STREAM_BATCH_SIZE = 1000
+ROWS_PER_CHUNK = 100
+
+
+def get_stream_format(args):
+    """
+    Read the opt-in stream query parameter.
+    Returns (format or None, None, None) or (None, error_response, 400).
+    """
+    stream_format = args.get('stream')
+    if not stream_format:
+        return None, None, None
+    if stream_format not in STREAM_FORMATS:
+        return None, jsonify({'message': f'stream must be one of: {", ".join(STREAM_FORMATS)}'}), 400
+    return stream_format, None, None
+
+
+def iterate_rows(query):
+    """ Iterate a query through a server-side cursor in batches of STREAM_BATCH_SIZE rows """
+    return query.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+
+
+def _chunked(encoded_rows, separator):
+    """ Group encoded rows into larger writes so each socket write carries many rows """
+    chunk = []
+    for encoded in encoded_rows:
+        chunk.append(encoded)
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield separator.join(chunk)
+            chunk = []
+    if chunk:
+        yield separator.join(chunk)
+
+
+def stream_response(stream_format, key, rows, serialize):
+    """
+    Build a streamed response for rows, encoding each one with serialize.
+    ndjson writes one JSON object per line; json writes {"<key>": [...]} incrementally.
+    """
+    dumps = current_app.json.dumps
+
+    def generate_ndjson():
+        for chunk in _chunked((dumps(serialize(row)) for row in rows), '\n'):
+            yield chunk + '\n'
+
+    def generate_json_array():
+        yield '{' + dumps(key) + ':['
+        first = True
+        for chunk in _chunked((dumps(serialize(row)) for row in rows), ','):
+            yield chunk if first else ',' + chunk
+            first = False
+        yield ']}'
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json_array()), mimetype='application/json')
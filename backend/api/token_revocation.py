@@ -0,0 +1,103 @@
+"""
+token_revocation.py
+-----------------------------
+This module decides whether an access token has been revoked. Revocations are
+kept in the database, so they apply in every worker and survive restarts:
+users.tokens_valid_after revokes every token a user was issued up to that time
+(username or password change), a deleted account has all of its tokens revoked,
+and a single token (logout) is recorded by its jti in revoked_tokens, with
+users.last_logout_at noting when that last happened.
+
+The users columns are read through the user cache, whose invalidations reach
+every worker, so checking a token issued after both times costs a cache lookup.
+Only tokens older than their user's last logout look up their jti. Tokens carry
+their issue time with sub-second precision (the issued_at claim), so a token
+issued in the same second as a revocation is told apart from one issued just
+after it, such as the replacement token returned by a password change.
+"""
+from logging import getLogger
+import time
+from flask import current_app
+from sqlalchemy import delete, update
+from models import db, RevokedToken, User
+from user_cache import get_user_cache, mark_users_stale
+
+logger = getLogger(__name__)
+
+# Used as the row lifetime when access tokens never expire
+NO_EXPIRY_TTL = 30 * 24 * 3600
+
+
+def _revocation_times(user_id):
+    """ (tokens_valid_after, last_logout_at) for a user, or None if the user is deleted or gone """
+    cache = get_user_cache()
+    snapshot = cache.get_by_id(user_id) if cache is not None else None
+    if snapshot is None:
+        read_at = time.time_ns()
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        if cache is not None:
+            cache.store(user, read_at)
+        snapshot = {'deleted_at': user.deleted_at, 'tokens_valid_after': user.tokens_valid_after,
+                    'last_logout_at': user.last_logout_at}
+    if snapshot['deleted_at'] is not None:
+        return None
+    return snapshot['tokens_valid_after'], snapshot['last_logout_at']
+
+
+class TokenRevocationStore:
+    """ Records and checks revocations in the users and revoked_tokens tables """
+
+    @staticmethod
+    def revoke_token(jwt_payload):
+        """ Revoke one token (logout); commits """
+        now = time.time()
+        user_id = int(jwt_payload['sub'])
+        db.session.add(RevokedToken(jti=jwt_payload['jti'], user_id=user_id,
+                                    expires_at=jwt_payload.get('exp') or now + NO_EXPIRY_TTL))
+        # Rows of tokens that have expired since are no longer needed
+        db.session.execute(delete(RevokedToken).where(RevokedToken.user_id == user_id, RevokedToken.expires_at < now))
+        mark_users_stale(db.session, [user_id])
+        db.session.execute(update(User.__table__).where(User.__table__.c.id == user_id).values(last_logout_at=now))
+        db.session.commit()
+
+    @staticmethod
+    def revoke_user_tokens(user):
+        """ Revoke every token issued to a user before now; takes effect when the caller commits """
+        user.tokens_valid_after = time.time()
+
+    @staticmethod
+    def is_revoked(jwt_payload):
+        """ True if the token's user is gone, the token predates tokens_valid_after, or its jti was revoked """
+        identity = str(jwt_payload['sub'])
+        if not identity.isdigit():
+            return False  # Identities from before user ids are rejected by check_for_token
+        times = _revocation_times(int(identity))
+        if times is None:
+            return True
+        tokens_valid_after, last_logout_at = times
+        # Older tokens only have the whole-second iat; one issued in the revocation's second counts as revoked
+        issued_at = jwt_payload.get('issued_at', jwt_payload.get('iat', 0))
+        if tokens_valid_after is not None and issued_at <= tokens_valid_after:
+            return True
+        if last_logout_at is None or issued_at > last_logout_at:
+            return False
+        return db.session.get(RevokedToken, jwt_payload['jti']) is not None
+
+
+def init_token_revocation(app_obj, jwt_manager):
+    """ Create the revocation store and have flask-jwt-extended consult it for every protected request """
+    store = TokenRevocationStore()
+    app_obj.extensions['token_revocation'] = store
+
+    @jwt_manager.token_in_blocklist_loader
+    def _check_if_token_revoked(_jwt_header, jwt_payload):
+        return store.is_revoked(jwt_payload)
+
+    return store
+
+
+def get_revocation_store():
+    """ Return the revocation store for the current app """
+    return current_app.extensions['token_revocation']
@@ -0,0 +1,331 @@
+"""
+user_cache.py
+-----------------------------
+This module contains the read-through user cache used by get_user_or_404.
+Users are cached as plain column snapshots keyed by id, with a username -> id
+pointer, so a cache hit can be re-attached to the session without a SELECT.
+Snapshots leave out the password hash, and are only used for reads: login and
+every write load the row from the database (get_user_or_404(fresh=True)).
+
+Entries are invalidated after every commit that changes a user row: ORM changes
+are picked up from the flush automatically, and Core UPDATEs (the follower
+counters) are scheduled with mark_users_stale. Each invalidation is also stamped
+in an InvalidationTable in memory shared by the gunicorn workers, so a `local`
+entry cached by one worker stops being served as soon as another worker changes
+the row, and a row read before a concurrent invalidation is never cached.
+"""
+from collections import OrderedDict
+from logging import getLogger
+import mmap
+import os
+import pickle
+import struct
+from threading import Lock
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import db, User
+
+try:
+    import redis
+except ImportError:  # In requirements.txt, but only needed for a redis USER_CACHE_URL
+    redis = None
+
+logger = getLogger(__name__)
+
+_PENDING_KEY = 'user_cache_stale'
+# Every column but the password hash, which must never be served from a possibly stale copy
+SNAPSHOT_COLUMNS = tuple(attr.key for attr in inspect(User).column_attrs if attr.key != 'password')
+
+
+class UserCacheBackend:
+    """ Interface for cache backends; values are opaque to the backend """
+
+    # Whether every worker reads the same entries, so deleting a key invalidates it everywhere
+    shared = False
+
+    def get(self, key):
+        """ Return the value for key, or None if missing or expired """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """ Store value under key for ttl seconds """
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        """ Remove keys if present """
+        raise NotImplementedError
+
+
+class LocalUserCache(UserCacheBackend):
+    """ Process-local backend with per-entry TTL and LRU eviction """
+
+    def __init__(self, max_entries=10000):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.max_entries = max_entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class SharedUserCache(UserCacheBackend):
+    """
+    Backend for a cache shared between workers.
+    The client needs get(name), set(name, value, ex=seconds) and delete(*names), as redis-py provides.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix='user-cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+
+class InMemorySharedClient:
+    """ In-process stand-in for a shared store client (get/set/delete as in redis-py), for development and tests """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = Lock()
+
+    def get(self, name):
+        """ Return the stored bytes for name, or None """
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+                self._values.pop(name, None)
+                return None
+            return entry[0]
+
+    def set(self, name, value, ex=None):
+        """ Store bytes under name, expiring after ex seconds """
+        with self._lock:
+            self._values[name] = (value, time.monotonic() + ex if ex else None)
+
+    def delete(self, *names):
+        """ Remove names if present """
+        with self._lock:
+            for name in names:
+                self._values.pop(name, None)
+
+
+class InvalidationTable:
+    """
+    The last invalidation time of each user, in a fixed table of slots (user id modulo the size) mapped into
+    memory shared by every process forked after it is created, or by every process mapping the same file.
+    Users sharing a slot only cost each other extra cache misses.
+    """
+
+    SLOT = struct.Struct('q')
+
+    def __init__(self, slots=65536, path=None):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        if path is None:
+            self._memory = mmap.mmap(-1, size)
+        else:
+            with open(path, 'a+b') as file:
+                if os.fstat(file.fileno()).st_size < size:
+                    file.truncate(size)
+                self._memory = mmap.mmap(file.fileno(), size)
+
+    def touch(self, user_id):
+        """ Record that the user changed now """
+        self.SLOT.pack_into(self._memory, (user_id % self.slots) * self.SLOT.size, time.time_ns())
+
+    def last(self, user_id):
+        """ Time of the user's last invalidation in nanoseconds, or 0 """
+        return self.SLOT.unpack_from(self._memory, (user_id % self.slots) * self.SLOT.size)[0]
+
+
+class UserCache:
+    """ Caches user column snapshots by id and username on top of a backend """
+
+    def __init__(self, backend, ttl=60, invalidations=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.invalidations = invalidations or InvalidationTable()
+
+    @staticmethod
+    def _id_key(user_id):
+        return f'id:{user_id}'
+
+    @staticmethod
+    def _name_key(username):
+        # MySQL compares usernames case-insensitively, so the pointer does too
+        return f'name:{username.lower()}'
+
+    def get_by_id(self, user_id):
+        """ Return the cached snapshot for a user id, or None """
+        entry = self.backend.get(self._id_key(user_id))
+        if entry is None:
+            return None
+        stamp, snapshot = entry
+        # Entries of a per-process backend are only dropped in the worker that changed the row
+        if not self.backend.shared and stamp != self.invalidations.last(user_id):
+            return None
+        return snapshot
+
+    def get_by_username(self, username):
+        """ Return the cached snapshot for a username, or None """
+        user_id = self.backend.get(self._name_key(username))
+        if user_id is None:
+            return None
+        snapshot = self.get_by_id(user_id)
+        if snapshot is None or snapshot['username'].lower() != username.lower():
+            return None
+        return snapshot
+
+    def store(self, user, read_at):
+        """
+        Cache a snapshot of a persistent user read from the database at read_at (time.time_ns()).
+        Nothing is stored if the user was invalidated since, as the row may predate that commit.
+        """
+        stamp = self.invalidations.last(user.id)
+        if stamp >= read_at:
+            return
+        snapshot = {key: getattr(user, key) for key in SNAPSHOT_COLUMNS}
+        self.backend.set(self._id_key(user.id), (stamp, snapshot), self.ttl)
+        self.backend.set(self._name_key(user.username), user.id, self.ttl)
+
+    def invalidate(self, user_id=None, usernames=()):
+        """ Drop cached entries for a user id and any usernames it was known by """
+        keys = [self._name_key(username) for username in usernames if username]
+        if user_id is not None:
+            self.invalidations.touch(user_id)
+            keys.append(self._id_key(user_id))
+        self.backend.delete(*keys)
+
+    @staticmethod
+    def attach(snapshot):
+        """
+        Turn a snapshot back into a persistent User in the current session without a SELECT.
+        The result may be stale, so it must not be modified; writes load the row with get_user_or_404(fresh=True).
+        """
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in snapshot.items():
+            setattr(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+
+def shared_cache_client(app_obj):
+    """
+    The client for the store shared by all workers: app.config['USER_CACHE_CLIENT'], or a client for
+    USER_CACHE_URL (redis://..., or memory:// for an InMemorySharedClient). Returns None when neither is configured.
+    """
+    client = app_obj.config.get('USER_CACHE_CLIENT')
+    url = app_obj.config.get('USER_CACHE_URL')
+    if client is None and url == 'memory://':
+        # Only shared by the apps in this process; for development and tests
+        client = InMemorySharedClient()
+    elif client is None and url:
+        if redis is None:
+            raise ValueError('USER_CACHE_URL needs the redis package: pip install redis')
+        client = redis.Redis.from_url(url)
+    return client
+
+
+def init_user_cache(app_obj):
+    """
+    Create the user cache configured by USER_CACHE_BACKEND ('local', 'shared' or 'none').
+    Runs in the gunicorn master when the app is preloaded, so the workers inherit one InvalidationTable;
+    otherwise they map USER_CACHE_INVALIDATION_FILE.
+    """
+    backend_name = app_obj.config.get('USER_CACHE_BACKEND', 'local')
+    if backend_name == 'none':
+        app_obj.extensions['user_cache'] = None
+        return None
+
+    if backend_name == 'shared':
+        client = shared_cache_client(app_obj)
+        if client is None:
+            raise ValueError('USER_CACHE_BACKEND=shared needs USER_CACHE_URL or a USER_CACHE_CLIENT')
+        backend = SharedUserCache(client)
+    elif backend_name == 'local':
+        backend = LocalUserCache(max_entries=app_obj.config.get('USER_CACHE_MAX_ENTRIES', 10000))
+    else:
+        raise ValueError(f'Unknown USER_CACHE_BACKEND: {backend_name}')
+
+    invalidations = InvalidationTable(path=app_obj.config.get('USER_CACHE_INVALIDATION_FILE'))
+    cache = UserCache(backend, ttl=app_obj.config.get('USER_CACHE_TTL', 60), invalidations=invalidations)
+    app_obj.extensions['user_cache'] = cache
+    logger.info('User cache enabled with %s backend', backend_name)
+    return cache
+
+
+def get_user_cache():
+    """ Return the cache for the current app, or None when caching is disabled """
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('user_cache')
+
+
+def mark_users_stale(session, user_ids):
+    """ Schedule cache invalidation for users changed outside the ORM, applied when the session commits """
+    session.info.setdefault(_PENDING_KEY, {})
+    for user_id in user_ids:
+        session.info[_PENDING_KEY].setdefault(user_id, set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stale_users(session, _flush_context):
+    """ Record every user row changed by the flush, including the username it had before """
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User):
+            continue
+        usernames = pending.setdefault(obj.id, set())
+        history = inspect(obj).attrs.username.history
+        usernames.update(name for name in (history.deleted or ()) if name)
+        usernames.update(name for name in (history.unchanged or ()) if name)
+        usernames.update(name for name in (history.added or ()) if name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_users(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    cache = get_user_cache()
+    if not pending or cache is None:
+        return
+    for user_id, usernames in pending.items():
+        cache.invalidate(user_id, usernames)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stale_users(session):
+    session.info.pop(_PENDING_KEY, None)
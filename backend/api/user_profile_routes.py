@@ -9,7 +9,9 @@ import sqlalchemy.exc
 from flask import Blueprint, jsonify, request
 from models import db
 from flask_jwt_extended import jwt_required
-from utils import get_user_or_404, check_for_token, return_500_response, log_request, validate_required_fields
+from utils import get_user_or_404, get_authorized_user, return_500_response, validate_required_fields
+from search_index import index_user
+from http_cache import make_etag, not_modified, with_cache_headers
 
 user_profile_bp = Blueprint('user_profile_routes', __name__)
 logger = getLogger(__name__)
@@ -18,16 +20,21 @@ logger = getLogger(__name__)
 def get_bio(username):
     """ Get a user's bio """
     try:
-        log_request(request)
         logger.debug('Fetching bio for user: %s', username)
 
         user, error_response, status = get_user_or_404(username)
         if error_response:
             return error_response, status
 
-        return jsonify({
+        etag = make_etag('bio', user.id, user.version)
+        cached_response = not_modified(etag, user.updated_at)
+        if cached_response:
+            return cached_response
+
+        response = jsonify({
             'bio': user.bio
-        }), 200
+        })
+        return with_cache_headers(response, etag, user.updated_at), 200
 
     except sqlalchemy.exc.SQLAlchemyError as exception:
         logger.error("SQLAlchemyError in get_bio: %s", exception)
@@ -39,7 +46,6 @@ def get_bio(username):
 def edit_bio(username):
     """ Edit a user's bio """
     try:
-        log_request(request)
         logger.debug('Editing bio for user: %s', username)
 
         data = request.get_json()
@@ -50,22 +56,15 @@ def edit_bio(username):
         if len(missing_fields) > 0:
             return jsonify({'error': 'Missing fields in request: ' + (', '.join(missing_fields))}), 400
 
-        current_user_identity, error_response_token, status = check_for_token()
-        if error_response_token:
-            return error_response_token, status
-
-        if current_user_identity != username:
-            # Or, if you store user_id in JWT, fetch user by username from URL, then compare IDs.
-            return jsonify({'message': 'You are not authorized to edit this bio'}), 403
-
         new_bio = data.get('bio')
 
-        user, error_response_user, status = get_user_or_404(username)
-        if error_response_user:
-            return error_response_user, status
+        user, error_response, status = get_authorized_user(username, 'edit this bio')
+        if error_response:
+            return error_response, status
 
         user.bio = new_bio
         db.session.commit()
+        index_user(user)
         return jsonify({
             'message': 'Bio updated successfully',
             'bio': user.bio
@@ -81,22 +80,15 @@ def edit_bio(username):
 def delete_bio(username):
     """ Delete a user's bio """
     try:
-        log_request(request)
         logger.debug('Deleting bio for user: %s', username)
 
-        current_user_identity, error_response_token, status = check_for_token()
-        if error_response_token:
-            return error_response_token, status
-
-        if current_user_identity != username:
-            return jsonify({'message': 'You are not authorized to delete this bio'}), 403
-
-        user, error_response_user, status = get_user_or_404(username)
-        if error_response_user:
-            return error_response_user, status
+        user, error_response, status = get_authorized_user(username, 'delete this bio')
+        if error_response:
+            return error_response, status
 
         user.bio = None
         db.session.commit()
+        index_user(user)
         return jsonify({
             'message': 'Bio deleted successfully',
             'bio': user.bio  # Will be None
@@ -6,32 +6,45 @@ getting, editing, and deleting a user's bio.
 """
 from logging import getLogger
 import sqlalchemy.exc
-from utils import get_user_or_404, return_500_response, check_for_token, log_request, validate_required_fields
+from sqlalchemy import or_, select
+from utils import get_user_or_404, get_authorized_user, create_user_token, return_500_response, validate_required_fields
 from flask import Blueprint, jsonify, request
-from models import db, User
-from flask_jwt_extended import jwt_required, create_access_token
+from models import db, DeletionJob, User
+from flask_jwt_extended import jwt_required
+from token_revocation import get_revocation_store
+from search_index import index_user, unindex_user
+from deletion import job_status, start_user_deletion, wake_deletion_worker
+from http_cache import make_etag, not_modified, with_cache_headers
+from user_cache import get_user_cache
+from serializers import USER_PROFILE
 
 user_bp = Blueprint('user_bp', __name__)
 logger = getLogger(__name__)
 
+MAX_LOOKUP_SIZE = 100
+
 @user_bp.route('/users/<string:username>', methods=['GET'])
 def get_user(username):
     """ Get a user by ID """
     try:
-        log_request(request)
         logger.debug('Fetching user with username: %s', username)
 
         user, error_response, status = get_user_or_404(username)
         if error_response:
             return error_response, status
 
-        return jsonify({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'bio': user.bio,
-            'created_at': user.created_at
-        }), 200
+        fields, error_response, status = USER_PROFILE.parse_fields(request.args)
+        if error_response:
+            return error_response, status
+
+        # Counters change without bumping the row version, so they are part of the ETag
+        etag = make_etag('user', user.id, user.version, user.follower_count, user.following_count, fields)
+        cached_response = not_modified(etag, user.updated_at)
+        if cached_response:
+            return cached_response
+
+        response = jsonify(USER_PROFILE.serialize(user, fields))
+        return with_cache_headers(response, etag, user.updated_at), 200
 
     except sqlalchemy.exc.SQLAlchemyError as exception:
         logger.error("SQLAlchemyError in get_user: %s", exception)
@@ -43,29 +56,36 @@ def get_user(username):
 def delete_user(username):
     """ Delete a user by username """
     try:
-        log_request(request)
         logger.debug('Attempting to delete user with username: %s', username)
 
-        current_user_identity, error_response_token, token_status = check_for_token()
-        if error_response_token:
-            return error_response_token, token_status
+        user, error_response, status = get_authorized_user(username, 'delete this user')
+        if error_response:
+            return error_response, status
 
-        if current_user_identity != username:
-            return jsonify({'message': 'You are not authorized to delete this user'}), 403
+        # Hide the user now; their edges and row are removed by the deletion worker in small chunks
+        get_revocation_store().revoke_user_tokens(user)
+        job = start_user_deletion(user)
+        unindex_user(job.user_id)
+        wake_deletion_worker()
 
-        user, error_response_user, user_status = get_user_or_404(username)
-        if error_response_user:
-            return error_response_user, user_status
+        return jsonify({'message': 'User deletion started', 'jobId': job.id, 'status': job.status}), 202
 
-        # Delete the user and commit the changes
-        db.session.delete(user)
-        db.session.commit()
+    except sqlalchemy.exc.SQLAlchemyError as exception:
+        logger.error("SQLAlchemyError in delete_user for username: %s, exception: %s", username, exception)
+        db.session.rollback()
+        return return_500_response(exception=exception)
 
-        # Return a success message
-        return jsonify({'message': 'User deleted successfully'}), 200
+@user_bp.route('/deletion-jobs/<string:job_id>', methods=['GET'])
+def get_deletion_job(job_id):
+    """ Get the progress of an account deletion """
+    try:
+        job = db.session.get(DeletionJob, job_id)
+        if job is None:
+            return jsonify({'message': 'Deletion job not found'}), 404
+        return jsonify(job_status(job)), 200
 
     except sqlalchemy.exc.SQLAlchemyError as exception:
-        logger.error("SQLAlchemyError in delete_user for username: %s, exception: %s", username, exception)
+        logger.error("SQLAlchemyError in get_deletion_job: %s", exception)
         db.session.rollback()
         return return_500_response(exception=exception)
 
@@ -74,15 +94,11 @@ def delete_user(username):
 def edit_username(username):
     """ Edit a user's username """
     try:
-        log_request(request)
         logger.debug('Editing username for user: %s', username)
 
-        current_user_identity, error_response_token, token_status = check_for_token()
-        if error_response_token:
-            return error_response_token, token_status
-
-        if current_user_identity != username:
-            return jsonify({'message': 'You are not authorized to edit this user'}), 403
+        user, error_response, status = get_authorized_user(username, 'edit this user')
+        if error_response:
+            return error_response, status
 
         data = request.get_json()
 
@@ -96,10 +112,6 @@ def edit_username(username):
         if not new_username:
             return jsonify({'message': 'New username is required'}), 400
 
-        user, error_response, status = get_user_or_404(username)
-        if error_response:
-            return error_response, status
-
         # Check if the new username is already taken
         existing_user = User.query.filter_by(username=new_username).first()
         if existing_user and existing_user.id != user.id: # Check if it's a different user
@@ -107,10 +119,11 @@ def edit_username(username):
 
         # Update the username and commit the changes
         user.username = new_username
+        # Tokens carrying the old username claim are revoked; the new one carries the new name
+        get_revocation_store().revoke_user_tokens(user)
         db.session.commit()
-
-        # Create a new access token with the new username
-        new_access_token = create_access_token(identity=new_username)
+        index_user(user)
+        new_access_token = create_user_token(user)
 
         return jsonify({
             'message': 'Username updated successfully',
@@ -121,3 +134,82 @@ def edit_username(username):
         logger.error("SQLAlchemyError in edit_username: %s", exception)
         db.session.rollback()
         return return_500_response(exception=exception)
+
+def _read_lookup_request(data):
+    """
+    Validate a batch lookup body.
+    Returns ((usernames, ids), None, None) or (None, error_response, 400).
+    """
+    if not isinstance(data, dict):
+        return None, jsonify({'error': 'Missing data from request'}), 400
+    usernames = data.get('usernames') or []
+    ids = data.get('ids') or []
+    if not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+        return None, jsonify({'message': 'usernames must be a list of strings'}), 400
+    # bool is an int subclass, but true is not a user id
+    if not isinstance(ids, list) or not all(isinstance(user_id, int) and not isinstance(user_id, bool)
+                                            for user_id in ids):
+        return None, jsonify({'message': 'ids must be a list of integers'}), 400
+    usernames = list(dict.fromkeys(usernames))  # Drop duplicates, keep request order
+    ids = list(dict.fromkeys(ids))
+    if not usernames and not ids:
+        return None, jsonify({'message': 'Send at least one username or id'}), 400
+    if len(usernames) + len(ids) > MAX_LOOKUP_SIZE:
+        return None, jsonify({'message': f'At most {MAX_LOOKUP_SIZE} users can be looked up per request'}), 400
+    return (usernames, ids), None, None
+
+def _lookup_user_cards(usernames, ids, fields):
+    """
+    Return ({lowercased username: card}, {id: card}) for the users that exist.
+    Cached users are served from the user cache; the rest are read with one IN query.
+    """
+    by_name, by_id = {}, {}
+    cache = get_user_cache()
+    if cache is not None:
+        for snapshot in filter(None, [cache.get_by_username(name) for name in usernames]
+                               + [cache.get_by_id(user_id) for user_id in ids]):
+            if snapshot.get('deleted_at') is not None:
+                continue
+            card = USER_PROFILE.serialize_mapping(snapshot, fields)
+            by_name[snapshot['username'].lower()] = by_id[snapshot['id']] = card
+
+    # MySQL compares usernames case-insensitively, so matches are keyed by the lowercased name
+    missing_names = [name for name in usernames if name.lower() not in by_name]
+    missing_ids = [user_id for user_id in ids if user_id not in by_id]
+    if missing_names or missing_ids:
+        conditions = []
+        if missing_names:
+            conditions.append(User.username.in_(missing_names))
+        if missing_ids:
+            conditions.append(User.id.in_(missing_ids))
+        # The id and username are always loaded to match rows to the requested items
+        columns = USER_PROFILE.columns(fields, User.id, User.username)
+        for row in db.session.execute(select(*columns).where(or_(*conditions), User.deleted_at.is_(None))):
+            by_name[row.username.lower()] = by_id[row.id] = USER_PROFILE.serialize(row, fields)
+    return by_name, by_id
+
+@user_bp.route('/users/lookup', methods=['POST'])
+def lookup_users():
+    """ Get many users by username or id in one request """
+    try:
+        lookup, error_response, status = _read_lookup_request(request.get_json(silent=True))
+        if error_response:
+            return error_response, status
+        usernames, ids = lookup
+        logger.debug('Looking up %s usernames and %s ids', len(usernames), len(ids))
+
+        fields, error_response, status = USER_PROFILE.parse_fields(request.args)
+        if error_response:
+            return error_response, status
+
+        by_name, by_id = _lookup_user_cards(usernames, ids, fields)
+        results = [{'username': name, 'status': 'found' if name.lower() in by_name else 'not_found',
+                    'user': by_name.get(name.lower())} for name in usernames]
+        results.extend({'id': user_id, 'status': 'found' if user_id in by_id else 'not_found',
+                        'user': by_id.get(user_id)} for user_id in ids)
+        return jsonify({'results': results}), 200
+
+    except sqlalchemy.exc.SQLAlchemyError as exception:
+        logger.error("SQLAlchemyError in lookup_users: %s", exception)
+        db.session.rollback()
+        return return_500_response(exception=exception)
@@ -0,0 +1,290 @@
+"""
+user_transfer.py
+-----------------------------
+This module imports and exports users and follower edges in bulk, for seeding
+environments and migrating accounts without calling /api/register once per
+user. Files are CSV with a header row or NDJSON (one JSON object per line):
+
+- users: username, email, bio, and either password (hashed with the configured
+  method) or password_hash (stored as is); created_at is optional
+- follows: follower, followee (usernames)
+
+Imports read batch_size records at a time. Each batch costs one query for names
+and emails already taken, multi-row INSERTs and one commit, so memory stays
+flat and a rerun after a failure skips what was already imported. Exports read
+through a server-side cursor and write each row as it arrives.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+import csv
+from datetime import datetime
+from itertools import islice
+import json
+from logging import getLogger
+import sys
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import aliased
+from models import db, followers, User
+from password_hashing import BatchHasher
+from relationships import insert_edges, resolve_user_ids
+
+logger = getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+USER_FIELDS = ('username', 'email', 'bio', 'password_hash', 'created_at')
+FOLLOW_FIELDS = ('follower', 'followee')
+MAX_LENGTHS = {'username': 50, 'email': 255, 'bio': 255, 'password_hash': 255}
+
+# read: records in the file; written: rows inserted; skipped: already present or repeated; invalid: rejected records
+ImportSummary = namedtuple('ImportSummary', ['read', 'written', 'skipped', 'invalid'])
+
+
+class TransferError(Exception):
+    """ Raised when an import file cannot be read """
+
+
+def file_format(path, requested='auto'):
+    """ The format to use for path: requested, or guessed from the extension when 'auto' """
+    if requested != 'auto':
+        return requested
+    return 'ndjson' if str(path).endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+@contextmanager
+def open_transfer_file(path, mode):
+    """ Open path for reading ('r') or writing ('w') as UTF-8 text; '-' is stdin or stdout """
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+        return
+    # newline='' lets csv handle line breaks inside quoted bios
+    with open(path, mode, encoding='utf-8', newline='') as stream:
+        yield stream
+
+
+def read_records(stream, fmt):
+    """ Yield (line number, record dict) from a CSV or NDJSON stream """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise TransferError(f'line {line_number}: invalid JSON: {error}') from error
+        if not isinstance(record, dict):
+            raise TransferError(f'line {line_number}: expected a JSON object')
+        yield line_number, record
+
+
+def _batches(records, batch_size):
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
+
+
+def _text(record, field):
+    """ A field as stripped text, None when absent or empty (CSV cannot tell the two apart) """
+    value = record.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _parse_user(record):
+    """ Return (row dict, plain-text password or None, None) or (None, None, reason) for one user record """
+    row = {field: _text(record, field) for field in ('username', 'email', 'bio', 'password_hash')}
+    password = record.get('password') or None
+    if not row['username'] or not row['email']:
+        return None, None, 'username and email are required'
+    if (password is None) == (row['password_hash'] is None):
+        return None, None, 'exactly one of password and password_hash is required'
+    too_long = [field for field, limit in MAX_LENGTHS.items() if row[field] and len(row[field]) > limit]
+    if too_long:
+        return None, None, f'too long: {", ".join(too_long)}'
+    created_at = _text(record, 'created_at')
+    try:
+        row['created_at'] = datetime.fromisoformat(created_at) if created_at else None
+    except ValueError:
+        return None, None, f'created_at is not an ISO date: {created_at}'
+    return row, password, None
+
+
+def _taken(rows):
+    """ Lowercased usernames and emails among rows that already exist, including users being deleted """
+    names = {row['username'] for row in rows}
+    emails = {row['email'] for row in rows}
+    taken = db.session.execute(
+        select(User.username, User.email).where(or_(User.username.in_(names), User.email.in_(emails))))
+    taken_names, taken_emails = set(), set()
+    for username, email in taken:
+        taken_names.add(username.lower())
+        taken_emails.add(email.lower())
+    return taken_names, taken_emails
+
+
+def _new_user_rows(rows, passwords, hasher):
+    """ Drop rows that clash with existing users or earlier rows, then hash the remaining passwords """
+    taken_names, taken_emails = _taken(rows)
+    fresh = []
+    for row, password in zip(rows, passwords):
+        # MySQL compares usernames and emails case-insensitively, so duplicates are found the same way
+        name, email = row['username'].lower(), row['email'].lower()
+        if name in taken_names or email in taken_emails:
+            continue
+        taken_names.add(name)
+        taken_emails.add(email)
+        fresh.append((row, password))
+
+    # Hashing is the slow part, so it only runs for rows that will be inserted
+    to_hash = [(row, password) for row, password in fresh if password is not None]
+    for (row, _), password_hash in zip(to_hash, hasher.hash_all([password for _, password in to_hash])):
+        row['password_hash'] = password_hash
+    new_rows = []
+    for row, _ in fresh:
+        new_row = {'username': row['username'], 'email': row['email'], 'bio': row['bio'],
+                   'password': row['password_hash']}
+        # Left out, created_at gets the column default like a registration would
+        if row['created_at']:
+            new_row['created_at'] = row['created_at']
+        new_rows.append(new_row)
+    return new_rows
+
+
+def _insert_users(rows):
+    """ Insert user rows, returning how many were written; IGNORE skips rows registered since the check """
+    statement = (insert(User.__table__)
+                 .prefix_with('IGNORE', dialect='mysql')
+                 .prefix_with('OR IGNORE', dialect='sqlite'))
+    written = 0
+    # An executemany needs the same keys in every row; SQLAlchemy sends each group as multi-row INSERTs
+    for has_created_at in (False, True):
+        group = [row for row in rows if ('created_at' in row) == has_created_at]
+        if group:
+            written += db.session.execute(statement, group).rowcount
+    return written
+
+
+def _log_rejected(message):
+    logger.warning('Rejected import record: %s', message)
+
+
+def _parse_users(batch, report):
+    """ Return (rows, plain-text passwords) for the valid records of a batch, reporting the others """
+    rows, passwords = [], []
+    for line_number, record in batch:
+        row, password, reason = _parse_user(record)
+        if reason:
+            report(f'line {line_number}: {reason}')
+            continue
+        rows.append(row)
+        passwords.append(password)
+    return rows, passwords
+
+
+def import_users(stream, fmt, batch_size=1000, hasher=None, report=None):
+    """ Insert the users in a CSV or NDJSON stream; report(message) is called for each rejected record """
+    hasher = hasher or BatchHasher()
+    report = report or _log_rejected
+    read = written = invalid = 0
+    for batch in _batches(read_records(stream, fmt), batch_size):
+        read += len(batch)
+        rows, passwords = _parse_users(batch, report)
+        invalid += len(batch) - len(rows)
+        if not rows:
+            continue
+
+        written += _insert_users(_new_user_rows(rows, passwords, hasher))
+        db.session.commit()
+        logger.info('Imported %s of %s user records', written, read)
+    return ImportSummary(read, written, read - written - invalid, invalid)
+
+
+def import_follows(stream, fmt, batch_size=1000, report=None):
+    """ Insert the follower edges in a CSV or NDJSON stream of username pairs, updating the counters """
+    report = report or _log_rejected
+    read = written = invalid = 0
+    for batch in _batches(read_records(stream, fmt), batch_size):
+        read += len(batch)
+        pairs = []
+        for line_number, record in batch:
+            follower, followee = _text(record, 'follower'), _text(record, 'followee')
+            if not follower or not followee:
+                invalid += 1
+                report(f'line {line_number}: follower and followee are required')
+                continue
+            pairs.append((line_number, follower, followee))
+
+        user_ids = resolve_user_ids({name for _, follower, followee in pairs for name in (follower, followee)})
+        edges = []
+        for line_number, follower, followee in pairs:
+            if follower not in user_ids or followee not in user_ids:
+                invalid += 1
+                report(f'line {line_number}: unknown user {follower if follower not in user_ids else followee}')
+                continue
+            edges.append((user_ids[follower], user_ids[followee]))
+        written += insert_edges(edges)
+        db.session.commit()
+        logger.info('Imported %s of %s follow records', written, read)
+    return ImportSummary(read, written, read - written - invalid, invalid)
+
+
+class _RecordWriter:
+    """ Writes dict records as CSV with a header row or as NDJSON """
+
+    def __init__(self, stream, fmt, fields):
+        self.stream = stream
+        self.csv_writer = csv.DictWriter(stream, fields) if fmt == 'csv' else None
+        if self.csv_writer is not None:
+            self.csv_writer.writeheader()
+
+    def write(self, record):
+        """ Write one record """
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(record)
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def _stream_rows(statement, batch_size):
+    # A server-side cursor on MySQL: rows are fetched batch_size at a time instead of all at once
+    return db.session.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+
+
+def export_users(stream, fmt, batch_size=1000):
+    """ Write every user not being deleted to stream, in the format import_users reads. Returns the count """
+    writer = _RecordWriter(stream, fmt, USER_FIELDS)
+    statement = (select(User.username, User.email, User.bio, User.password, User.created_at)
+                 .where(User.deleted_at.is_(None)).order_by(User.id))
+    count = 0
+    for username, email, bio, password_hash, created_at in _stream_rows(statement, batch_size):
+        writer.write({
+            'username': username,
+            'email': email,
+            'bio': bio,
+            'password_hash': password_hash,
+            'created_at': created_at.isoformat(sep=' ') if created_at else None,
+        })
+        count += 1
+    return count
+
+
+def export_follows(stream, fmt, batch_size=1000):
+    """ Write every edge between users not being deleted to stream as (follower, followee). Returns the count """
+    writer = _RecordWriter(stream, fmt, FOLLOW_FIELDS)
+    follower, followee = aliased(User), aliased(User)
+    statement = (select(follower.username, followee.username)
+                 .select_from(followers)
+                 .join(follower, follower.id == followers.c.follower_id)
+                 .join(followee, followee.id == followers.c.followee_id)
+                 .where(follower.deleted_at.is_(None), followee.deleted_at.is_(None))
+                 .order_by(followers.c.follower_id, followers.c.followee_id))
+    count = 0
+    for follower_name, followee_name in _stream_rows(statement, batch_size):
+        writer.write({'follower': follower_name, 'followee': followee_name})
+        count += 1
+    return count
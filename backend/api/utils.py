@@ -1,30 +1,100 @@
 """
 utils.py
 -----------------------------
-This module contains utility functions for the API, such as error handling and logging.
+This module contains utility functions for the API, such as error handling and lookups.
 """
+from collections import namedtuple
 from logging import getLogger
+import time
 from flask import jsonify
 from models import User
-from flask_jwt_extended import get_jwt_identity
+from user_cache import get_user_cache
+from instrumentation import timed
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 
 logger = getLogger(__name__)
 
-def get_user_or_404(username):
-    """ Get a user or return a 404 error """
-    user = User.query.filter_by(username=username).first()
+# The caller of an authenticated request, read from the token alone
+TokenUser = namedtuple('TokenUser', ['id', 'username'])
+
+def get_user_or_404(username, fresh=False):
+    """
+    Get a user, through the user cache when enabled, or return a 404 error.
+    fresh reads the row from the database instead; use it before changing the user or checking the password.
+    """
+    with timed('user'):
+        return _load_user(username, fresh)
+
+def _load_user(username, fresh):
+    cache = get_user_cache()
+    if cache is not None and not fresh:
+        snapshot = cache.get_by_username(username)
+        # Deleting a user invalidates its snapshot; the check covers a snapshot stored by a racing request
+        if snapshot is not None and snapshot.get('deleted_at') is None:
+            return cache.attach(snapshot), None, None
+
+    # Users being deleted are hidden while the deletion job removes their edges
+    query = User.query.filter_by(username=username, deleted_at=None)
+    if fresh:
+        # Replaces a cached copy this request may already have attached to the session
+        query = query.populate_existing()
+    read_at = time.time_ns()
+    user = query.first()
     if user is None:
         logger.error('User not found: %s', username)
         return None, jsonify({'message': 'User not found'}), 404
+    if cache is not None:
+        cache.store(user, read_at)
     return user, None, None
 
+def create_user_token(user):
+    """ Create an access token whose identity is the user id, with the username and precise issue time as claims """
+    return create_access_token(identity=str(user.id),
+                               additional_claims={'username': user.username, 'issued_at': time.time()})
+
+def _token_user(identity, claims):
+    # Tokens issued before identities were user ids carry the username instead
+    if not identity or not str(identity).isdigit():
+        return None
+    return TokenUser(int(identity), claims.get('username'))
+
 def check_for_token():
-    """ Check if the request has a valid JWT token """
-    current_user_identity = get_jwt_identity()
-    if not current_user_identity:
+    """ Check if the request has a valid JWT token and return its TokenUser """
+    token_user = _token_user(get_jwt_identity(), get_jwt())
+    if token_user is None:
         logger.error('Unauthorized access attempt')
         return None, jsonify({'message': 'Unauthorized'}), 401
-    return current_user_identity, None, None
+    return token_user, None, None
+
+def get_authorized_user(username, action):
+    """
+    Load the user named in the path if the token belongs to them, or return a 403 error.
+    Other users are rejected from the token claims alone, without a lookup.
+    The user is read from the database, not the cache, because callers go on to change it.
+    """
+    token_user, error_response, status = check_for_token()
+    if error_response:
+        return None, error_response, status
+    if token_user.username != username:
+        return None, jsonify({'message': f'You are not authorized to {action}'}), 403
+
+    user, error_response, status = get_user_or_404(username, fresh=True)
+    if error_response:
+        return None, error_response, status
+    if user.id != token_user.id:  # A stale username claim; the name now belongs to another account
+        return None, jsonify({'message': f'You are not authorized to {action}'}), 403
+    return user, None, None
+
+def get_optional_identity():
+    """ Return the TokenUser if the request carries a valid token, otherwise None """
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        logger.debug('Ignoring invalid token on optionally authenticated request')
+        return None
+    return _token_user(get_jwt_identity(), get_jwt())
 
 def return_500_response(exception):
     """ Return a 500 error response with the exception message """
@@ -46,28 +116,3 @@ def validate_required_fields(data: dict | None, required_fields: list, function_
         if field not in data or not data[field]: # Checks for presence and if value is falsy (e.g., empty string)
             missing_or_empty_fields.append(field)
     return True, missing_or_empty_fields
-
-def log_request(request):
-    """ Log request method, URL, headers, and sanitized body """
-    logger.info('Request: %s %s', request.method, request.url)
-    logger.debug('Headers: %s', dict(request.headers))
-
-    # Check if the content type is application/json
-    if request.content_type == 'application/json':
-        data = request.get_json(silent=True)  # Use silent=True to avoid raising an exception
-        if data is not None:
-            sanitized_data = {
-                k: ('***' if 'password' in k.lower() or 'token' in k.lower() else v)
-                for k, v in data.items()
-            }
-            logger.debug('Body (JSON): %s', sanitized_data)
-        else:
-            # Log that Content-Type was application/json but body was empty or malformed
-            logger.debug('Body: Content-Type was application/json, but request body was empty or not valid JSON.')
-    else:
-        # Log non-JSON body or if body is not expected to be JSON
-        # For GET requests, request.data might be empty.
-        # For other methods like POST with form data, request.form would be used.
-        # This basic logging indicates it wasn't processed as JSON.
-        logger.debug('Body: Not JSON or Content-Type not application/json. ' +
-                     'Raw data length: %s', len(request.get_data(as_text=True)))
@@ -0,0 +1,97 @@
+"""
+compare.py
+-----------------------------
+Compares two saved benchmark runs endpoint by endpoint and flags regressions:
+a p99 latency increase above --threshold percent, more queries per request, or
+new server errors.
+
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json --fail
+
+Only compare runs made with the same driver, graph and concurrency; the run
+settings of both files are printed when they differ.
+"""
+import argparse
+import json
+import sys
+
+COMPARED_RUN_SETTINGS = ('driver', 'graph', 'concurrency', 'database')
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as source:
+        return json.load(source)
+
+
+def _change(old, new):
+    """ Percentage change from old to new, or None when it is undefined """
+    if old is None or new is None or not old:
+        return None
+    return (new - old) / old * 100
+
+
+def compare_endpoints(old, new, threshold):
+    """ Return [(endpoint, old stats, new stats, regression reasons)] for endpoints in either run """
+    rows = []
+    for name in sorted(set(old) | set(new)):
+        before, after = old.get(name), new.get(name)
+        reasons = []
+        if before and after:
+            p99_change = _change(before['p99_ms'], after['p99_ms'])
+            if p99_change is not None and p99_change > threshold:
+                reasons.append(f'p99 +{p99_change:.0f}%')
+            if (before['queries_mean'] is not None and after['queries_mean'] is not None
+                    and after['queries_mean'] > before['queries_mean']):
+                reasons.append(f'queries {before["queries_mean"]} -> {after["queries_mean"]}')
+            if after['errors'] > before['errors']:
+                reasons.append(f'errors {before["errors"]} -> {after["errors"]}')
+        rows.append((name, before, after, reasons))
+    return rows
+
+
+def _format_stat(before, after, key):
+    """ "old/new (+change%)" for one statistic, right-aligned in a 24 character column """
+    if before[key] is None or after[key] is None:
+        return f'{"-":>24}'
+    change = _change(before[key], after[key])
+    change_text = '' if change is None else f' ({change:+.0f}%)'
+    return f'{before[key]:.2f}/{after[key]:.2f}{change_text}'.rjust(24)
+
+
+def format_comparison(rows):
+    """ Render compare_endpoints rows as a fixed-width table """
+    lines = [f'{"endpoint":<26}{"p50 ms old/new":>24}{"p99 ms old/new":>24}{"queries old/new":>24}  regressions']
+    for name, before, after, reasons in rows:
+        if not before or not after:
+            lines.append(f'{name:<26}{"only in " + ("new" if after else "old") + " run":>24}')
+            continue
+        lines.append(f'{name:<26}{_format_stat(before, after, "p50_ms")}{_format_stat(before, after, "p99_ms")}'
+                     f'{_format_stat(before, after, "queries_mean")}  {", ".join(reasons)}')
+    return '\n'.join(lines)
+
+
+def main():
+    """ Print the comparison and optionally exit 1 on regressions """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old', help='Baseline results file.')
+    parser.add_argument('new', help='Results file to check.')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Allowed p99 increase in percent.')
+    parser.add_argument('--fail', action='store_true', help='Exit with status 1 if any endpoint regressed.')
+    args = parser.parse_args()
+
+    old, new = _load(args.old), _load(args.new)
+    print(f'old: {old["commit"]}{" (dirty)" if old["dirty"] else ""}  new: {new["commit"]}'
+          f'{" (dirty)" if new["dirty"] else ""}')
+    for setting in COMPARED_RUN_SETTINGS:
+        if old['run'].get(setting) != new['run'].get(setting):
+            print(f'warning: runs differ in {setting}: {old["run"].get(setting)} vs {new["run"].get(setting)}')
+
+    rows = compare_endpoints(old['endpoints'], new['endpoints'], args.threshold)
+    print(format_comparison(rows))
+    regressed = [name for name, _, _, reasons in rows if reasons]
+    print(f'\n{len(regressed)} endpoint(s) regressed' + (f': {", ".join(regressed)}' if regressed else ''))
+    if args.fail and regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
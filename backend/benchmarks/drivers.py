@@ -0,0 +1,96 @@
+"""
+drivers.py
+-----------------------------
+This module sends benchmark Requests either in-process through the Flask test
+client or over HTTP to a running server (for example gunicorn), and turns the
+responses into Results. The query count of each request is read from the
+Server-Timing header the API adds, so it is available in both modes.
+"""
+import http.client
+import json
+import re
+from threading import local
+import time
+from urllib.parse import urlsplit
+from scenarios import Result
+
+_QUERY_COUNT = re.compile(r'desc="(\d+) queries"')
+
+
+def _query_count(server_timing):
+    match = _QUERY_COUNT.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+def _parse_body(content_type, data):
+    if data and 'json' in (content_type or '') and 'ndjson' not in content_type:
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+    return None
+
+
+class ClientDriver:
+    """ Sends requests through a Flask test client, one client per thread """
+
+    def __init__(self, app):
+        self.app = app
+        self._local = local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def send(self, request):
+        """ Send a Request and return its Result; the latency includes reading a streamed body """
+        headers = {'Authorization': f'Bearer {request.token}'} if request.token else {}
+        start = time.perf_counter()
+        response = self._client().open(request.path, method=request.method, json=request.body, headers=headers)
+        data = response.get_data()
+        latency = time.perf_counter() - start
+        return Result(response.status_code, _parse_body(response.content_type, data), latency,
+                      _query_count(response.headers.get('Server-Timing')))
+
+
+class HttpDriver:
+    """ Sends requests to a running server over keep-alive connections, one connection per thread """
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = local()
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def send(self, request):
+        """ Send a Request and return its Result; a dropped connection is reopened and the request retried once """
+        headers = {'Content-Type': 'application/json'} if request.body is not None else {}
+        if request.token:
+            headers['Authorization'] = f'Bearer {request.token}'
+        body = json.dumps(request.body) if request.body is not None else None
+        for attempt in range(2):
+            connection = self._connection()
+            start = time.perf_counter()
+            try:
+                connection.request(request.method, self.prefix + request.path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+                continue
+            latency = time.perf_counter() - start
+            return Result(response.status, _parse_body(response.getheader('Content-Type'), data), latency,
+                          _query_count(response.getheader('Server-Timing')))
+        raise RuntimeError('unreachable')
@@ -0,0 +1,98 @@
+"""
+report.py
+-----------------------------
+This module summarizes recorded Results per endpoint and saves the summary as
+JSON named after the git commit, so runs can be compared between commits.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import subprocess
+from threading import Lock
+
+
+def percentile(sorted_values, fraction):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """ Thread-safe collection of Results by endpoint name """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.results = {}
+
+    def record(self, name, result):
+        """ Store one Result under an endpoint name """
+        with self._lock:
+            self.results.setdefault(name, []).append(result)
+
+    def summarize(self, wall_seconds):
+        """ Return {endpoint: stats} with latencies in milliseconds """
+        summary = {}
+        for name, results in sorted(self.results.items()):
+            latencies = sorted(result.latency * 1000 for result in results)
+            queries = [result.queries for result in results if result.queries is not None]
+            summary[name] = {
+                'count': len(results),
+                'statuses': dict(Counter(str(result.status) for result in results)),
+                'errors': sum(1 for result in results if result.status >= 500),
+                'p50_ms': round(percentile(latencies, 0.50), 3),
+                'p90_ms': round(percentile(latencies, 0.90), 3),
+                'p99_ms': round(percentile(latencies, 0.99), 3),
+                'mean_ms': round(sum(latencies) / len(latencies), 3),
+                'max_ms': round(latencies[-1], 3),
+                'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'queries_max': max(queries) if queries else None,
+                'throughput_rps': round(len(results) / wall_seconds, 2) if wall_seconds else None,
+            }
+        return summary
+
+
+def git_revision(path):
+    """ Return (short sha, dirty) for the checkout containing path, or ('unknown', False) outside git """
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path, check=True,
+                             capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path, check=True,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return sha, dirty
+
+
+def save_results(output_dir, run_info, summary):
+    """ Write the run to <output_dir>/<sha>[-dirty]-<driver>[-<label>].json and return the path """
+    sha, dirty = git_revision(os.path.dirname(os.path.abspath(__file__)))
+    name = '-'.join(part for part in (sha, 'dirty' if dirty else '', run_info['driver'], run_info.get('label'))
+                    if part)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f'{name}.json')
+    document = {
+        'commit': sha,
+        'dirty': dirty,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'run': run_info,
+        'endpoints': summary,
+    }
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(document, output, indent=2, sort_keys=True)
+    return path
+
+
+def format_table(summary):
+    """ Render the per-endpoint summary as a fixed-width table """
+    lines = [f'{"endpoint":<26}{"count":>7}{"err":>5}{"p50 ms":>10}{"p99 ms":>10}{"mean ms":>10}'
+             f'{"queries":>9}{"req/s":>9}']
+    for name, stats in summary.items():
+        queries = '-' if stats['queries_mean'] is None else f'{stats["queries_mean"]:.1f}'
+        lines.append(f'{name:<26}{stats["count"]:>7}{stats["errors"]:>5}{stats["p50_ms"]:>10.2f}'
+                     f'{stats["p99_ms"]:>10.2f}{stats["mean_ms"]:>10.2f}{queries:>9}{stats["throughput_rps"]:>9.1f}')
+    return '\n'.join(lines)
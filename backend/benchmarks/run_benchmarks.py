@@ -0,0 +1,136 @@
+"""
+run_benchmarks.py
+-----------------------------
+Runs the benchmark scenarios and reports p50/p90/p99 latency, throughput and
+query counts per endpoint. Results are saved under benchmarks/results named
+after the current commit; compare two runs with compare.py.
+
+In-process, against a fresh SQLite database (or --database-uri) seeded first:
+
+    python benchmarks/run_benchmarks.py --users 5000 --iterations 100
+
+Over HTTP, against a running server whose database was seeded with seed.py using
+the same graph options:
+
+    python benchmarks/run_benchmarks.py --driver http --base-url http://localhost:5000 --concurrency 16
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import tempfile
+import time
+from drivers import ClientDriver, HttpDriver
+from report import Recorder, format_table, save_results
+from scenarios import SCENARIOS, BenchContext, login_actors, run_scenario
+from seed import add_seed_arguments, graph_from_args, seed_database
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _create_app(database_uri):
+    """ Build the API in-process against database_uri with its tables created """
+    os.environ.setdefault('LOG_FILE', os.path.join(RESULTS_DIR, 'benchmark.log'))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    # Importing seed has already put the api folder on sys.path
+    # pylint: disable=import-error,import-outside-toplevel
+    from api import create_app
+    from models import db
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'JWT_SECRET_KEY': os.getenv('JWT_SECRET_KEY') or 'benchmark-secret-key-of-sufficient-length',
+    })
+    with app.app_context():
+        db.create_all()
+    return app, db
+
+
+def _build_driver(args, graph):
+    """ Return (driver, seed summary or None) for the selected mode """
+    if args.driver == 'http':
+        return HttpDriver(args.base_url), None
+
+    database_uri = args.database_uri or f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench.db")}'
+    app, db = _create_app(database_uri)
+    with app.app_context():
+        summary = seed_database(db.engine, graph, app.config['PASSWORD_HASH_METHOD'])
+    return ClientDriver(app), summary
+
+
+def _tasks(scenario_names, iterations, seed):
+    """ Every (scenario, rng) run, shuffled deterministically so endpoints interleave as in real traffic """
+    tasks = [(name, random.Random(f'{seed}:{name}:{index}'))
+             for name in scenario_names for index in range(iterations)]
+    random.Random(seed).shuffle(tasks)
+    return tasks
+
+
+def _measure(args, ctx, driver):
+    """ Run the recorded iterations with args.concurrency in flight; return (summary, wall seconds) """
+    recorder = Recorder()
+    tasks = _tasks(args.scenarios, args.iterations, args.seed)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(run_scenario, SCENARIOS[name], ctx, rng, driver, recorder.record)
+                       for name, rng in tasks]:
+            future.result()
+    wall_seconds = time.perf_counter() - start
+    return recorder.summarize(wall_seconds), wall_seconds
+
+
+def run(args):
+    """ Seed if needed, warm up, run every scenario and save the summary """
+    graph = graph_from_args(args)
+    driver, seed_summary = _build_driver(args, graph)
+    ctx = BenchContext(graph, actor_count=args.actors)
+    login_actors(ctx, driver)
+
+    # Warm-up fills caches, the search index and the hashing pool without being recorded
+    for name, rng in _tasks(args.scenarios, args.warmup, args.seed + 1):
+        run_scenario(SCENARIOS[name], ctx, rng, driver, lambda _name, _result: None)
+
+    summary, wall_seconds = _measure(args, ctx, driver)
+    total = sum(stats['count'] for stats in summary.values())
+    run_info = {
+        'driver': args.driver,
+        'label': args.label,
+        'base_url': args.base_url if args.driver == 'http' else None,
+        'database': (args.database_uri or 'sqlite (temporary)').split('@')[-1],
+        'graph': graph._asdict(),
+        'seeded': seed_summary,
+        'scenarios': args.scenarios,
+        'iterations': args.iterations,
+        'concurrency': args.concurrency,
+        'wall_seconds': round(wall_seconds, 3),
+        'total_requests': total,
+        'throughput_rps': round(total / wall_seconds, 2) if wall_seconds else None,
+    }
+    print(format_table(summary))
+    print(f'\n{total} requests in {wall_seconds:.2f}s ({run_info["throughput_rps"]} req/s, '
+          f'concurrency {args.concurrency})')
+    print(f'Saved {save_results(args.output_dir, run_info, summary)}')
+
+
+def main():
+    """ Parse the command line and run the benchmarks """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--driver', choices=('client', 'http'), default='client',
+                        help='Flask test client in-process, or HTTP against --base-url.')
+    parser.add_argument('--base-url', default='http://localhost:5000', help='Server for the http driver.')
+    parser.add_argument('--database-uri', help='Database for the client driver; a temporary SQLite file by default. '
+                                               'Its users and followers are replaced by the seeded graph.')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS),
+                        help='Scenarios to run.')
+    parser.add_argument('--iterations', type=int, default=50, help='Runs of each scenario.')
+    parser.add_argument('--warmup', type=int, default=2, help='Unrecorded runs of each scenario first.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Scenario runs in flight at once.')
+    parser.add_argument('--actors', type=int, default=20, help='Seeded users logged in to make authenticated calls.')
+    parser.add_argument('--label', help='Suffix for the results file, e.g. mysql or gunicorn-8w.')
+    parser.add_argument('--output-dir', default=RESULTS_DIR, help='Where results are saved.')
+    add_seed_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
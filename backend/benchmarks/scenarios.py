@@ -0,0 +1,195 @@
+"""
+scenarios.py
+-----------------------------
+This module defines the benchmark workload. Each scenario is a generator that
+yields Requests and receives each Result back, so later requests can use earlier
+responses (cursors, fresh tokens). Every route of every blueprint is covered.
+Results are grouped by the Request name.
+
+Scenarios only touch seeded users by their deterministic usernames, plus the
+accounts they register themselves, so they run the same against a database
+seeded in-process or by seed.py for an HTTP server.
+"""
+from collections import namedtuple
+import itertools
+import os
+from threading import Lock
+from urllib.parse import quote
+from seed import BENCH_PASSWORD, username_for
+
+Request = namedtuple('Request', ['name', 'method', 'path', 'token', 'body'], defaults=(None, None))
+Result = namedtuple('Result', ['status', 'body', 'latency', 'queries'])
+
+BATCH_SIZE = 20
+
+
+class BenchContext:
+    """ Seeded graph settings, actor tokens and unique names shared by all scenario runs """
+
+    def __init__(self, graph, actor_count=20):
+        self.graph = graph
+        # Actors come from the middle of the id range, away from the celebrities
+        step = max(1, graph.users // (actor_count + 1))
+        self.actors = [username_for(min(graph.users - 1, step * (index + 1))) for index in range(actor_count)]
+        self.tokens = {}
+        self._names = itertools.count()
+        self._lock = Lock()
+
+    def random_user(self, rng):
+        """ Any seeded username """
+        return username_for(rng.randrange(self.graph.users))
+
+    def celebrity(self, rng):
+        """ One of the users with the largest follower lists """
+        return username_for(rng.randrange(max(1, min(self.graph.celebrities, self.graph.users))))
+
+    def actor(self, rng):
+        """ A (username, token) pair for an actor logged in during setup """
+        username = rng.choice(self.actors)
+        return username, self.tokens[username]
+
+    def new_username(self):
+        """ A username no other scenario run will use """
+        with self._lock:
+            return f'bench{os.getpid()}x{next(self._names)}'
+
+
+def profile(ctx, rng):
+    """ Read a profile and a bio """
+    username = ctx.random_user(rng)
+    yield Request('get_user', 'GET', f'/api/users/{username}')
+    yield Request('get_bio', 'GET', f'/api/users/{username}/bio')
+
+
+def lookup(ctx, rng):
+    """ Resolve a page of user cards in one batch request """
+    usernames = sorted({ctx.random_user(rng) for _ in range(BATCH_SIZE)})
+    yield Request('lookup_users', 'POST', '/api/users/lookup', body={'usernames': usernames})
+
+
+def lists(ctx, rng):
+    """ Page through follower and following lists, including a celebrity's """
+    username = ctx.random_user(rng)
+    yield Request('followers', 'GET', f'/api/users/{username}/followers')
+    yield Request('following', 'GET', f'/api/users/{username}/following')
+    celebrity = ctx.celebrity(rng)
+    first = yield Request('followers_celebrity', 'GET', f'/api/users/{celebrity}/followers?limit=50')
+    cursor = first.body.get('nextCursor') if isinstance(first.body, dict) else None
+    if cursor:
+        yield Request('followers_celebrity_next', 'GET',
+                      f'/api/users/{celebrity}/followers?limit=50&cursor={quote(cursor)}')
+
+
+def stream(ctx, rng):
+    """ Stream a celebrity's full follower list """
+    yield Request('followers_stream', 'GET', f'/api/users/{ctx.celebrity(rng)}/followers?stream=ndjson')
+
+
+def search(ctx, rng):
+    """ Username prefix, fuzzy and bio searches as a signed-in viewer """
+    _, token = ctx.actor(rng)
+    username = ctx.random_user(rng)
+    query = rng.choice([username[:7], username[:4] + username[5:], f'topic{rng.randrange(97)}'])
+    yield Request('search', 'GET', f'/api/users/search?q={quote(query)}', token)
+
+
+def suggestions(ctx, rng):
+    """ Who-to-follow suggestions for a signed-in actor """
+    username, token = ctx.actor(rng)
+    yield Request('suggestions', 'GET', f'/api/users/{username}/suggestions', token)
+
+
+def follow_cycle(ctx, rng):
+    """ Follow a user and unfollow them again """
+    _, token = ctx.actor(rng)
+    target = ctx.random_user(rng)
+    yield Request('follow', 'POST', f'/api/users/{target}/follow', token)
+    yield Request('unfollow', 'POST', f'/api/users/{target}/unfollow', token)
+
+
+def batch_cycle(ctx, rng):
+    """ Batch follow a group of users and batch unfollow them again """
+    _, token = ctx.actor(rng)
+    usernames = sorted({ctx.random_user(rng) for _ in range(BATCH_SIZE)})
+    yield Request('batch_follow', 'POST', '/api/users/follows/batch', token,
+                  {'action': 'follow', 'usernames': usernames})
+    yield Request('batch_unfollow', 'POST', '/api/users/follows/batch', token,
+                  {'action': 'unfollow', 'usernames': usernames})
+
+
+def login_logout(ctx, rng):
+    """ Log an actor in and revoke the new token """
+    username, _ = ctx.actor(rng)
+    result = yield Request('login', 'POST', '/api/login', body={'username': username, 'password': BENCH_PASSWORD})
+    if result.status == 200:
+        yield Request('logout', 'POST', '/api/logout', result.body['access_token'])
+
+
+def account_lifecycle(ctx, _rng):
+    """ Register an account, edit it through every settings route, then delete it """
+    username = ctx.new_username()
+    result = yield Request('register', 'POST', '/api/register',
+                           body={'username': username, 'password': BENCH_PASSWORD,
+                                 'email': f'{username}@bench.example', 'bio': 'new benchmark account'})
+    if result.status != 200:
+        return
+    token = result.body['access_token']
+    yield Request('edit_bio', 'PUT', f'/api/users/{username}/bio', token, {'bio': 'edited benchmark bio'})
+    yield Request('delete_bio', 'DELETE', f'/api/users/{username}/bio', token)
+
+    renamed = f'{username}r'
+    result = yield Request('edit_username', 'PUT', f'/api/users/{username}/username', token,
+                           {'newUsername': renamed})
+    if result.status != 200:
+        return
+    token = result.body['access_token']
+    result = yield Request('change_password', 'PUT', f'/api/users/{renamed}/changePassword', token,
+                           {'newPassword': BENCH_PASSWORD + '2'})
+    if result.status == 200:
+        token = result.body['access_token']
+    yield Request('delete_user', 'DELETE', f'/api/users/{renamed}', token)
+
+
+def health(_ctx, _rng):
+    """ Health checks and the metrics page """
+    yield Request('health', 'GET', '/api/health')
+    yield Request('health_db', 'GET', '/api/health/db')
+    yield Request('metrics', 'GET', '/metrics')
+
+
+SCENARIOS = {
+    'profile': profile,
+    'lookup': lookup,
+    'lists': lists,
+    'stream': stream,
+    'search': search,
+    'suggestions': suggestions,
+    'follow_cycle': follow_cycle,
+    'batch_cycle': batch_cycle,
+    'login_logout': login_logout,
+    'account_lifecycle': account_lifecycle,
+    'health': health,
+}
+
+
+def login_actors(ctx, driver):
+    """ Log every actor in once before measuring """
+    for username in ctx.actors:
+        result = driver.send(Request('setup_login', 'POST', '/api/login',
+                                     body={'username': username, 'password': BENCH_PASSWORD}))
+        if result.status != 200:
+            raise RuntimeError(f'Could not log in {username} (status {result.status}); is the database seeded?')
+        ctx.tokens[username] = result.body['access_token']
+
+
+def run_scenario(scenario, ctx, rng, driver, record):
+    """ Drive one scenario run to completion, passing every Result to record """
+    steps = scenario(ctx, rng)
+    result = None
+    try:
+        while True:
+            request = steps.send(result)
+            result = driver.send(request)
+            record(request.name, result)
+    except StopIteration:
+        pass
@@ -0,0 +1,167 @@
+"""
+seed.py
+-----------------------------
+This module fills a database with benchmark users and a follower graph.
+
+Usernames are deterministic (user000000, user000001, ...) and every user shares
+one password, so load generators can derive their actors from the seed settings
+alone. Graph shapes:
+
+- uniform: each user follows targets picked uniformly at random
+- powerlaw: targets are picked with Zipf weights, so low-numbered users collect
+  most followers, as on real social graphs
+
+--celebrities additionally has a --celebrity-reach share of all users follow the
+first N users, producing the very large follower lists that stress pagination.
+
+Run from the backend folder, against a schema created by init.sql or create_all:
+
+    python benchmarks/seed.py --database-uri sqlite:///bench.db --users 10000 --shape powerlaw
+"""
+import argparse
+from collections import Counter, namedtuple
+import os
+import random
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+# pylint: disable=import-error,wrong-import-position
+from sqlalchemy import create_engine, delete, insert
+from werkzeug.security import generate_password_hash
+from models import followers, User
+from password_hashing import DEFAULT_METHOD
+# pylint: enable=import-error,wrong-import-position
+
+BENCH_PASSWORD = 'benchmark-password'
+INSERT_BATCH_SIZE = 5000
+SHAPES = ('uniform', 'powerlaw')
+
+# The settings that fully determine a seeded graph
+Graph = namedtuple('Graph', ['users', 'average_following', 'shape', 'celebrities', 'celebrity_reach', 'seed'],
+                   defaults=(1000, 20, 'powerlaw', 0, 0.5, 1))
+
+
+def username_for(index):
+    """ Username of the seeded user at index """
+    return f'user{index:06d}'
+
+
+def _following_size(rng, average, user_count):
+    """ Number of users one user follows: heavy-tailed around the average, never more than everyone else """
+    size = int(rng.paretovariate(2.0) * average / 2)
+    return min(size, user_count - 1)
+
+
+def build_edges(graph):
+    """ Return the set of (follower_index, followee_index) edges for a Graph """
+    if graph.shape not in SHAPES:
+        raise ValueError(f'shape must be one of: {", ".join(SHAPES)}')
+    rng = random.Random(graph.seed)
+    user_count = graph.users
+    population = range(user_count)
+    cum_weights = None
+    if graph.shape == 'powerlaw':
+        running = 0.0
+        cum_weights = []
+        for rank in population:
+            running += 1.0 / (rank + 1) ** 1.1
+            cum_weights.append(running)
+
+    edges = set()
+    for follower in population:
+        size = _following_size(rng, graph.average_following, user_count)
+        targets = (rng.choices(population, cum_weights=cum_weights, k=size * 2) if cum_weights
+                   else rng.sample(population, min(size * 2, user_count)))
+        picked = 0
+        for followee in targets:
+            if picked >= size:
+                break
+            if followee != follower and (follower, followee) not in edges:
+                edges.add((follower, followee))
+                picked += 1
+
+    for celebrity in range(min(graph.celebrities, user_count)):
+        for follower in rng.sample(population, int(user_count * graph.celebrity_reach)):
+            if follower != celebrity:
+                edges.add((follower, celebrity))
+    return edges
+
+
+def _batched(rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        yield rows[start:start + INSERT_BATCH_SIZE]
+
+
+def seed_database(engine, graph, password_method=DEFAULT_METHOD):
+    """
+    Replace the users and followers tables' contents with the graph described by a Graph.
+    Returns a summary dict with the settings, the edge count and the largest follower list.
+    """
+    edges = build_edges(graph)
+    follower_counts = Counter(followee for _, followee in edges)
+    following_counts = Counter(follower for follower, _ in edges)
+    # Hashing is deliberately slow, so every seeded user shares one hash
+    password_hash = generate_password_hash(BENCH_PASSWORD, method=password_method)
+
+    # Ids are assigned explicitly so edges can reference them before the users are read back
+    user_rows = [{
+        'id': index + 1,
+        'username': username_for(index),
+        'password': password_hash,
+        'email': f'{username_for(index)}@bench.example',
+        'bio': f'Benchmark user {index} who likes topic{index % 97}',
+        'follower_count': follower_counts[index],
+        'following_count': following_counts[index],
+        'version': 1,
+    } for index in range(graph.users)]
+    edge_rows = [{'follower_id': follower + 1, 'followee_id': followee + 1} for follower, followee in sorted(edges)]
+
+    with engine.begin() as connection:
+        connection.execute(delete(followers))
+        connection.execute(delete(User.__table__))
+        for batch in _batched(user_rows):
+            connection.execute(insert(User.__table__), batch)
+        for batch in _batched(edge_rows):
+            connection.execute(insert(followers), batch)
+
+    return dict(graph._asdict(), edges=len(edges), max_followers=max(follower_counts.values(), default=0))
+
+
+def graph_from_args(args):
+    """ Build a Graph from parsed add_seed_arguments options """
+    return Graph(args.users, args.average_following, args.shape, args.celebrities, args.celebrity_reach, args.seed)
+
+
+def add_seed_arguments(parser):
+    """ Add the graph options shared by seed.py and run_benchmarks.py """
+    parser.add_argument('--users', type=int, default=2000, help='Number of users to create.')
+    parser.add_argument('--average-following', type=int, default=20, help='Typical number of users each user follows.')
+    parser.add_argument('--shape', choices=SHAPES, default='powerlaw', help='How followees are picked.')
+    parser.add_argument('--celebrities', type=int, default=3, help='Users followed by a large share of everyone.')
+    parser.add_argument('--celebrity-reach', type=float, default=0.5, help='Share of users following each celebrity.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed builds the same graph.')
+
+
+def main():
+    """ Seed the database named by --database-uri (or DATABASE_URI) """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI'), help='SQLAlchemy database URL.')
+    parser.add_argument('--create-tables', action='store_true', help='Create missing tables from the models first.')
+    add_seed_arguments(parser)
+    args = parser.parse_args()
+    if not args.database_uri:
+        parser.error('--database-uri or DATABASE_URI is required')
+
+    engine = create_engine(args.database_uri)
+    if args.create_tables:
+        User.metadata.create_all(engine)
+    summary = seed_database(engine, graph_from_args(args))
+    print(f'Seeded {summary["users"]} users and {summary["edges"]} edges '
+          f'(largest follower list: {summary["max_followers"]})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+gunicorn.conf.py
+-----------------------------
+Production serving configuration for the API. Run from the backend folder with:
+
+    gunicorn --config gunicorn.conf.py
+
+Every setting can be tuned through the environment. Send SIGHUP to the master
+process to gracefully replace the workers (new settings and, with PRELOAD_APP=false,
+new code) without dropping in-flight requests.
+"""
+# pylint: disable=invalid-name
+import multiprocessing
+import os
+import tempfile
+
+# The API modules use flat imports, so serve from the api folder
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+wsgi_app = 'api:create_app()'
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+# Token revocations live in the database and user cache invalidations in memory shared by the workers, so
+# every worker sees every write; only the search index and follow graph are per worker and may lag behind
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# Load the app once in the master so workers fork with it already imported
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() == 'true'
+if not preload_app:
+    # Workers then create their own user cache, so they share its invalidations through a file instead
+    os.environ.setdefault('USER_CACHE_INVALIDATION_FILE',
+                          os.path.join(tempfile.gettempdir(), f'user-cache-invalidations-{os.getpid()}'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers periodically to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+# Application logs go to stdout with gunicorn's unless LOG_FILE is set; a file is then written per worker
+os.environ.setdefault('LOG_FILE', '-')
@@ -0,0 +1,41 @@
+"""
+conftest.py
+-----------------------------
+Shared fixtures for the backend tests. The API modules use flat imports, so the
+api folder is put on the path the way gunicorn.conf.py serves it.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+os.environ.setdefault('LOG_FILE', '-')
+
+# pylint: disable=wrong-import-position
+from api import create_app
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """ An app on a fresh SQLite database, without background workers or hashing processes """
+    app_obj = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "app.db"}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'JWT_SECRET_KEY': 'test-secret-key-that-is-long-enough-for-hs256',
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0,
+        'DELETION_WORKER': False,
+    })
+    with app_obj.app_context():
+        db.create_all()
+    yield app_obj
+    with app_obj.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """ A test client for the app fixture """
+    return app.test_client()
@@ -0,0 +1,62 @@
+"""
+test_logger_config.py
+-----------------------------
+Tests that records logged through the queue reach the output formatter with
+their exception, and with their message as it was when logged.
+"""
+import json
+import logging
+from logging.handlers import QueueListener
+import queue
+from logger_config import JsonFormatter, LocalQueueHandler
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def _log_through_queue(log):
+    """ Log with log(logger) through a LocalQueueHandler and return the JSON lines the listener wrote """
+    log_queue = queue.Queue(-1)
+    output = _Collect()
+    output.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, output)
+    logger = logging.getLogger('test_logger_config')
+    logger.propagate = False
+    handler = LocalQueueHandler(log_queue)
+    logger.addHandler(handler)
+    listener.start()
+    try:
+        log(logger)
+    finally:
+        listener.stop()
+        logger.removeHandler(handler)
+    return [json.loads(line) for line in output.lines]
+
+
+def test_exception_is_formatted_by_the_listener():
+    def log(logger):
+        try:
+            raise RuntimeError('boom')
+        except RuntimeError:
+            logger.exception('Failed for %s', 'alice')
+
+    (entry,) = _log_through_queue(log)
+    assert entry['message'] == 'Failed for alice'
+    assert 'Traceback' in entry['exception'] and 'RuntimeError: boom' in entry['exception']
+
+
+def test_message_arguments_are_merged_when_logged():
+    def log(logger):
+        items = ['a']
+        logger.warning('Items: %s', items)
+        items.append('b')
+
+    (entry,) = _log_through_queue(log)
+    assert entry['message'] == "Items: ['a']"
+    assert 'exception' not in entry
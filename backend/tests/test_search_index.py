@@ -0,0 +1,172 @@
+"""
+test_search_index.py
+-----------------------------
+Tests for the in-process search index and the search route: ranking, paging
+with cursors across writes, and replaying writes made during a rebuild.
+"""
+import pytest
+from models import db, User
+import search_index as search_module
+from search_index import (SearchIndex, BIO_INDEX_CHARS, EXACT_MATCH, PREFIX_MATCH, SUBSTRING_MATCH,
+                          FUZZY_MATCH, BIO_MATCH)
+
+ROWS = [
+    (1, 'alice', None),
+    (2, 'Alicia', 'hello'),
+    (3, 'malice', None),
+    (4, 'bob', 'likes Alice Cooper'),
+    (5, 'alise', None),
+    (6, 'ali', None),
+    (7, 'carol', 'nothing to see'),
+]
+
+
+def _index(rows=ROWS):
+    index = SearchIndex()
+    index.load(iter(rows))
+    return index
+
+
+def _pages(index, query, page_size):
+    """ Page through a query the way the route does, following the last hit's key """
+    hits, after = [], None
+    while True:
+        page = index.search(query, page_size + 1, after=after)
+        hits.extend(page[:page_size])
+        if len(page) <= page_size:
+            return hits
+        user_id, score = page[page_size - 1]
+        after = [score[0], score[1], user_id]
+
+
+def test_ranks_by_tier_then_similarity():
+    hits = _index().search('alice')
+    assert [user_id for user_id, _ in hits] == [1, 3, 2, 6, 5, 4]
+    assert [score[0] for _, score in hits] == [EXACT_MATCH, SUBSTRING_MATCH] + [FUZZY_MATCH] * 3 + [BIO_MATCH]
+
+
+def test_short_query_matches_username_prefixes_in_username_order():
+    hits = _index().search('AL')
+    assert hits == [(6, (PREFIX_MATCH, 'ali')), (1, (PREFIX_MATCH, 'alice')),
+                    (2, (PREFIX_MATCH, 'alicia')), (5, (PREFIX_MATCH, 'alise'))]
+    assert _index().search('al', 2) == hits[:2]
+
+
+@pytest.mark.parametrize('query', ['alice', 'ali', 'al', 'a'])
+def test_cursor_pages_add_up_to_the_full_result(query):
+    index = _index()
+    assert _pages(index, query, 2) == index.search(query)
+
+
+def test_cursor_continues_after_a_write_between_pages():
+    index = _index()
+    first = index.search('alice', 3)
+    user_id, score = first[1]
+    index.add(8, 'alicex')  # Ranks above the cursor, so it belongs to a page already served
+    index.add(9, 'zalice')  # Ranks below the cursor
+    index.remove(5)
+    rest = index.search('alice', after=[score[0], score[1], user_id])
+    assert [hit[0] for hit in rest] == [9, 2, 6, 4]
+
+
+def test_short_query_cursor_sees_overlay_writes():
+    index = _index()
+    first = index.search('al', 2)
+    index.add(10, 'alz')
+    index.add(11, 'aaa')
+    user_id, score = first[-1]
+    rest = index.search('al', after=[score[0], score[1], user_id])
+    assert [hit[0] for hit in rest] == [2, 5, 10]
+
+
+def test_cursor_from_the_other_kind_of_query_is_rejected():
+    index = _index()
+    with pytest.raises(ValueError):
+        index.search('al', 5, after=[PREFIX_MATCH, 0.5, 1])
+    with pytest.raises(ValueError):
+        index.search('alice', 5, after=[PREFIX_MATCH, 'alice', 1])
+
+
+def test_writes_during_a_rebuild_are_replayed():
+    index = _index()
+    index.add(20, 'before')  # Written before the rebuild read its rows, so the rows are authoritative
+
+    def rows():
+        yield from ROWS[:3]
+        index.add(21, 'journaled')
+        index.remove(1)
+        index.add(3, 'renamed')
+        yield from ROWS[3:]
+
+    index.load(rows())
+    assert index.search('journaled')[0][0] == 21
+    assert index.search('before') == []
+    assert [hit[0] for hit in index.search('alice')] == [2, 6, 5, 4]
+    assert index.search('renamed')[0][0] == 3
+    assert len(index) == len(ROWS)
+
+
+def test_only_the_start_of_a_bio_is_indexed():
+    index = _index([(1, 'pat', 'x' * BIO_INDEX_CHARS + ' needle')])
+    assert index.search('needle') == []
+    assert not SearchIndex.matches('needle', 'pat', 'x' * BIO_INDEX_CHARS + ' needle')
+    assert SearchIndex.matches('needle', 'pat', 'a needle')
+
+
+def test_short_query_matches_only_username_prefixes():
+    assert SearchIndex.matches('al', 'Alice')
+    assert not SearchIndex.matches('al', 'malice', 'alpha')
+
+
+@pytest.fixture
+def users(app):
+    """ Seed the ROWS users and start from an index this worker has not built yet """
+    search_module.search_index = SearchIndex()
+    with app.app_context():
+        for user_id, username, bio in ROWS:
+            user = User(username=username, password='x', email=f'{username}@example.com', bio=bio)
+            user.id = user_id
+            db.session.add(user)
+        db.session.commit()
+    yield
+    search_module.search_index = SearchIndex()
+
+
+def _route_pages(client, query, limit):
+    usernames, cursor = [], None
+    while True:
+        params = {'q': query, 'limit': limit, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/api/users/search', query_string=params).get_json()
+        usernames.extend(user['username'] for user in body['users'])
+        cursor = body['nextCursor']
+        if cursor is None:
+            return usernames
+
+
+def test_route_continues_a_database_page_from_the_index(app, client, users, monkeypatch):
+    # The first page is served from the database while the index is still building
+    monkeypatch.setattr(search_module._reload, 'ensure_fresh', lambda *args, **kwargs: None)  # pylint: disable=protected-access
+    body = client.get('/api/users/search', query_string={'q': 'al', 'limit': 2}).get_json()
+    assert [user['username'] for user in body['users']] == ['ali', 'alice']
+    monkeypatch.undo()
+    _build_index(app)
+    rest = client.get('/api/users/search', query_string={'q': 'al', 'limit': 2, 'cursor': body['nextCursor']})
+    assert [user['username'] for user in rest.get_json()['users']] == ['Alicia', 'alise']
+
+
+def _build_index(app):
+    with app.app_context():
+        search_module.ensure_search_index(wait=True)
+
+
+def test_route_pages_ranked_results(app, client, users):
+    _build_index(app)
+    assert _route_pages(client, 'alice', 2) == ['alice', 'malice', 'Alicia', 'ali', 'alise', 'bob']
+    assert _route_pages(client, 'al', 3) == ['ali', 'alice', 'Alicia', 'alise']
+
+
+def test_route_rejects_a_cursor_from_the_other_kind_of_query(app, client, users):
+    _build_index(app)
+    body = client.get('/api/users/search', query_string={'q': 'alice', 'limit': 1}).get_json()
+    response = client.get('/api/users/search', query_string={'q': 'al', 'cursor': body['nextCursor']})
+    assert response.status_code == 400
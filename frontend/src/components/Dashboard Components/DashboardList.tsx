@@ -4,6 +4,8 @@ import { useContext } from "react";
 import { AuthContext } from "../../contexts/AuthContext";
 import { UserContext } from "../../contexts/UserContext";
 import { ToastContext } from "../../contexts/ToastContext";
+import type { User } from "../../interfaces/Interfaces";
+import Lib from "../../helpers/Lib";
 import { Navigate } from "react-router-dom";
 import Follower from "./Follower";
 
@@ -14,55 +16,74 @@ export default function DashboardList(): React.JSX.Element {
 	const { showToast } = useContext( ToastContext );
 	
 	const [ isLoading, setIsLoading ] = React.useState<boolean>( true );
-	
-	useEffect( () => {
-		const fetchFollowers = async () => {
-			const response = await fetch( `${ process.env.REACT_APP_API_URL }/users/${ user.username }/followers` );
-			const data = await response.json();
+	const [ followersCursor, setFollowersCursor ] = React.useState<string | null>( null );
+	const [ followingCursor, setFollowingCursor ] = React.useState<string | null>( null );
 
-			switch ( response.status ) {
-				case 200 :
-					setUser( { ...user, followers: data.followers } );
-					break;
-				case 404 :
-					showToast( "Not Found: The requested resource could not be found.", "error" );
-					break;
-				case 500 :
-					showToast( "Internal Server Error: Please try again later.", "error" );
-					break;
-				default :
-					showToast( "An unexpected error occurred.", "error" );
-					break;
-			}
+	const showStatusToast = ( status: number ) => {
+		switch ( status ) {
+			case 404 :
+				showToast( "Not Found: The requested resource could not be found.", "error" );
+				break;
+			case 500 :
+				showToast( "Internal Server Error: Please try again later.", "error" );
+				break;
+			default :
+				showToast( "An unexpected error occurred.", "error" );
+				break;
+		}
+	};
 
-			setIsLoading( false );
-			return;
-		};
-		const fetchFollowing = async () => {
-			const response = await fetch( `${ process.env.REACT_APP_API_URL }/users/${ user.username }/following` );
+	// The lists load one page at a time: the first page replaces the list and later pages are appended
+	const fetchFollowers = async ( cursor: string | null ) => {
+		const { status, items: followers, nextCursor } = await Lib.Api.fetchPage<User>(
+			`${ process.env.REACT_APP_API_URL }/users/${ user.username }/followers`, "followers", cursor
+		);
+
+		if ( status === 200 ) {
+			setUser( ( current: User ) => ( {
+				...current, followers: cursor ? [ ...( current.followers || [] ), ...followers ] : followers
+			} ) );
+			setFollowersCursor( nextCursor );
+		} else {
+			showStatusToast( status );
+		}
+
+		setIsLoading( false );
+	};
+
+	const fetchFollowing = async ( cursor: string | null ) => {
+		const { status, items: following, nextCursor } = await Lib.Api.fetchPage<User>(
+			`${ process.env.REACT_APP_API_URL }/users/${ user.username }/following`, "following", cursor
+		);
+
+		if ( status === 200 ) {
+			setUser( ( current: User ) => ( {
+				...current, following: cursor ? [ ...( current.following || [] ), ...following ] : following
+			} ) );
+			setFollowingCursor( nextCursor );
+		} else {
+			showStatusToast( status );
+		}
+
+		setIsLoading( false );
+	};
+
+	useEffect( () => {
+		// The counts come from the profile, since the lists only hold the pages loaded so far
+		const fetchCounts = async () => {
+			const response = await fetch( `${ process.env.REACT_APP_API_URL }/users/${ user.username }` );
 			const data = await response.json();
 
-			switch ( response.status ) {
-				case 200 :
-					setUser( { ...user, following: data.following } );
-					break;
-				case 404 :
-					showToast( "Not Found: The requested resource could not be found.", "error" );
-					break;
-				case 500 :
-					showToast( "Internal Server Error: Please try again later.", "error" );
-					break;
-				default :
-					showToast( "An unexpected error occurred.", "error" );
-					break;
+			if ( response.ok ) {
+				setUser( ( current: User ) => ( {
+					...current, followerCount: data.follower_count, followingCount: data.following_count
+				} ) );
 			}
-	
-			setIsLoading( false );
-			return;
 		};
 
-		fetchFollowers();
-		fetchFollowing();
+		fetchCounts();
+		fetchFollowers( null );
+		fetchFollowing( null );
 	}, [ user.username ] );
 
 	if ( !isLoggedIn ) {
@@ -84,19 +105,29 @@ export default function DashboardList(): React.JSX.Element {
 						<h3 className="mb-8 font-bold text-2xl text-indigo-600">Main functions</h3>
 						<div>
 							<ul className="text-gray-600">
-								<li className="text-2xl">Followers: {user?.followers?.length}</li>
+								<li className="text-2xl">Followers: {user?.followerCount ?? user?.followers?.length}</li>
 								{user?.followers?.map( ( follower, index ) => (
 									<li key={index} className="text-xl">
 										<Follower username={follower.username} />
 									</li>
 								) )}
 							</ul>
+							{followersCursor && (
+								<button onClick={() => fetchFollowers( followersCursor )} className="text-indigo-600 hover:underline mb-4">
+									Load more
+								</button>
+							)}
 							<ul className="text-gray-600">
-								<li className="text-2xl">Following: {user?.following?.length}</li>
+								<li className="text-2xl">Following: {user?.followingCount ?? user?.following?.length}</li>
 								{user?.following?.map( ( followed, index ) => (
 									<li key={index} className="text-xl">{followed.username}</li>
 								) )}
 							</ul>
+							{followingCursor && (
+								<button onClick={() => fetchFollowing( followingCursor )} className="text-indigo-600 hover:underline">
+									Load more
+								</button>
+							)}
 						</div>
 					</div>
 				</div>
@@ -4,6 +4,7 @@ import { Navigate, Link } from "react-router-dom";
 
 import { AuthContext } from "../contexts/AuthContext";
 import { UserContext } from "../contexts/UserContext";
+import Lib from "../helpers/Lib";
 
 export default function UserInfo(): React.JSX.Element {
 
@@ -16,34 +17,60 @@ export default function UserInfo(): React.JSX.Element {
 
 	const [ followers, setFollowers ] = useState<string[]>( [] );
 	const [ following, setFollowing ] = useState<string[]>( [] );
+	const [ followersCursor, setFollowersCursor ] = useState<string | null>( null );
+	const [ followingCursor, setFollowingCursor ] = useState<string | null>( null );
+	const [ followerCount, setFollowerCount ] = useState<number | undefined>( user.followerCount );
+	const [ followingCount, setFollowingCount ] = useState<number | undefined>( user.followingCount );
 
-	useEffect( () => {
-		const fetchFollowers = async () => {
-			const response = await fetch( `${ process.env.REACT_APP_API_URL }/users/${ user.username }/followers` );
-			const data = await response.json();
+	// The lists load one page at a time: the first page replaces the list and later pages are appended
+	const fetchFollowers = async ( cursor: string | null ) => {
+		const { status, items, nextCursor, data } = await Lib.Api.fetchPage<{ username: string }>(
+			`${ process.env.REACT_APP_API_URL }/users/${ user.username }/followers`, "followers", cursor
+		);
 
-			if ( !response.ok ) {
-				console.error( "Error fetching following data:", data );
-				return;
-			}
+		if ( status !== 200 ) {
+			console.error( "Error fetching followers data:", data );
+			return;
+		}
 
-			setFollowers( data.followers.map( ( follower: { username: string } ) => follower.username ) );
-		};
+		const usernames = items.map( ( follower ) => follower.username );
+		setFollowers( previous => cursor ? [ ...previous, ...usernames ] : usernames );
+		setFollowersCursor( nextCursor );
+	};
+
+	const fetchFollowing = async ( cursor: string | null ) => {
+		const { status, items, nextCursor, data } = await Lib.Api.fetchPage<{ username: string }>(
+			`${ process.env.REACT_APP_API_URL }/users/${ user.username }/following`, "following", cursor
+		);
+
+		if ( status !== 200 ) {
+			console.error( "Error fetching following data:", data );
+			return;
+		}
 
-		const fetchFollowing = async () => {
-			const response = await fetch( `${ process.env.REACT_APP_API_URL }/users/${ user.username }/following` );
+		const usernames = items.map( ( followed ) => followed.username );
+		setFollowing( previous => cursor ? [ ...previous, ...usernames ] : usernames );
+		setFollowingCursor( nextCursor );
+	};
+
+	useEffect( () => {
+		// The counts come from the profile, since the lists only hold the pages loaded so far
+		const fetchCounts = async () => {
+			const response = await fetch( `${ process.env.REACT_APP_API_URL }/users/${ user.username }` );
 			const data = await response.json();
 
 			if ( !response.ok ) {
-				console.error( "Error fetching following data:", data );
+				console.error( "Error fetching profile data:", data );
 				return;
 			}
 
-			setFollowing( data.following.map( ( followed: { username: string } ) => followed.username ) );
+			setFollowerCount( data.follower_count );
+			setFollowingCount( data.following_count );
 		};
 
-		fetchFollowers();
-		fetchFollowing();
+		fetchCounts();
+		fetchFollowers( null );
+		fetchFollowing( null );
 	}, [ user.username ] );
 
 	if ( !isLoggedIn ) {
@@ -57,18 +84,28 @@ export default function UserInfo(): React.JSX.Element {
 			<div className="text-2xl text-white">Email: {user.email}</div>
 			<div className="text-2xl text-white">Date Joined: {user.dateJoined}</div>
 			{user.bio && <div className="text-2xl text-white">Bio: {user.bio}</div>}
-			<div className="text-2xl text-white">Followers: {followers.length}</div>
+			<div className="text-2xl text-white">Followers: {followerCount ?? followers.length}</div>
 			<ul className="text-white">
 				{followers.length !== 0 && followers.map( ( follower ) => (
 					<li key={follower}>{follower}</li>
 				) )}
 			</ul>
-			<div className="text-2xl text-white">Following: {following.length}</div>
+			{followersCursor && (
+				<button onClick={() => fetchFollowers( followersCursor )} className="text-white underline mb-2">
+					Load more
+				</button>
+			)}
+			<div className="text-2xl text-white">Following: {followingCount ?? following.length}</div>
 			<ul className="text-white">
 				{following.length !== 0 && following.map( ( followed ) => (
 					<li key={followed}>{followed}</li>
 				) )}
 			</ul>
+			{followingCursor && (
+				<button onClick={() => fetchFollowing( followingCursor )} className="text-white underline mb-2">
+					Load more
+				</button>
+			)}
 			<button className="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded mb-4 mt-4">
 				<Link to="/editprofile"> Edit Profile</Link>
 			</button>
@@ -5,6 +5,9 @@ import type { User } from "../interfaces/Interfaces";
 import { UserContext } from "../contexts/UserContext";
 import { ToastContext } from "../contexts/ToastContext";
 import { AuthContext } from "../contexts/AuthContext";
+import Lib from "../helpers/Lib";
+
+const SEARCH_PAGE_SIZE = 20;
 
 function useQuery() {
 	return new URLSearchParams( useLocation().search );
@@ -14,6 +17,7 @@ export default function UserSearchResults() {
 	const query = useQuery().get( "q" ) || "";
 	const [ results, setResults ] = useState<User[]>( [] );
 	const [ loading, setLoading ] = useState( false );
+	const [ nextCursor, setNextCursor ] = useState<string | null>( null );
 
 	const { isLoggedIn } = useContext( AuthContext );
 	const { user, setUser } = useContext( UserContext );
@@ -23,12 +27,8 @@ export default function UserSearchResults() {
 		return <Navigate to="/" />;
 	}
 
-	useEffect( () => {
-		if ( !query ) {
-			setResults( [] );
-			return;
-		}
-		setLoading( true );
+	// youFollow is only included when the search carries the viewer's token
+	const fetchPage = ( cursor: string | null ) => {
 		const apiUrl = process.env.REACT_APP_API_URL;
 		if ( !apiUrl ) {
 			showToast( "API URL is not configured.", "error" );
@@ -36,20 +36,37 @@ export default function UserSearchResults() {
 			return;
 		}
 
-		fetch( `${ apiUrl }/users/search?q=${ encodeURIComponent( query ) }` )
+		setLoading( true );
+		const headers: HeadersInit = user?.accessToken ? { "Authorization": `Bearer ${ user.accessToken }` } : {};
+		fetch( Lib.Api.pageUrl( `${ apiUrl }/users/search?q=${ encodeURIComponent( query ) }`, SEARCH_PAGE_SIZE, cursor ), { headers } )
 			.then( res => {
 				if ( !res.ok ) {
 					throw new Error( `HTTP error! status: ${ res.status }` );
 				}
 				return res.json();
 			} )
-			.then( data => setResults( data.users || [] ) )
+			.then( data => {
+				setResults( previous => cursor ? [ ...previous, ...( data.users || [] ) ] : data.users || [] );
+				setNextCursor( data.nextCursor || null );
+			} )
 			.catch( error => {
 				console.error( "Search fetch error:", error );
 				showToast( "Failed to fetch search results.", "error" );
-				setResults( [] );
+				if ( !cursor ) {
+					setResults( [] );
+				}
+				setNextCursor( null );
 			} )
 			.finally( () => setLoading( false ) );
+	};
+
+	useEffect( () => {
+		if ( !query ) {
+			setResults( [] );
+			setNextCursor( null );
+			return;
+		}
+		fetchPage( null );
 	}, [ query, showToast ] );
 
 	const handleFollowToggle = async ( targetUsername: string, action: "follow" | "unfollow" ) => {
@@ -75,7 +92,11 @@ export default function UserSearchResults() {
 			const data = await response.json();
 			if ( response.ok ) {
 				showToast( data.message, "success" );
-				setUser( { ...user, following: data.following } );
+				// The API only returns the changed edge, so flip youFollow on the result it belongs to
+				setResults( previous => previous.map( ( result ) => result.username === targetUsername
+					? { ...result, youFollow: action === "follow", followerCount: data.followerCount }
+					: result ) );
+				setUser( { ...user, followingCount: data.followingCount } );
 			} else {
 				showToast( data.message, "error" );
 			}
@@ -97,9 +118,7 @@ export default function UserSearchResults() {
 			)}
 			<ul className="space-y-4">
 				{results.map( ( userResult: User ) => {
-					const isFollowing = user?.following?.some(
-						( followedUser ) => followedUser.username === userResult.username
-					);
+					const isFollowing = Boolean( userResult.youFollow );
 					const isCurrentUser = user?.username === userResult.username;
 
 					console.log( JSON.stringify( userResult.username ) );
@@ -127,6 +146,16 @@ export default function UserSearchResults() {
 					);
 				} )}
 			</ul>
+			{!loading && nextCursor && (
+				<div className="text-center mt-6">
+					<button
+						onClick={() => fetchPage( nextCursor )}
+						className="px-4 py-2 text-white font-semibold rounded-lg shadow-md bg-indigo-500 hover:bg-indigo-600"
+					>
+						Load more
+					</button>
+				</div>
+			)}
 		</div>
 	);
 }
\ No newline at end of file
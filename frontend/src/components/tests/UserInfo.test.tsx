@@ -1,5 +1,5 @@
 import React from "react";
-import { render, screen } from "@testing-library/react";
+import { render, screen, fireEvent } from "@testing-library/react";
 import { BrowserRouter as Router } from "react-router-dom";
 
 import { AuthContext } from "../../contexts/AuthContext";
@@ -99,6 +99,36 @@ describe( "UserInfo", () => {
 		expect( await screen.findByText( /Bio: This is a test bio./i ) ).toBeInTheDocument();
 	} );
 
+	test( "loads the next page of followers on Load more", async () => {
+		global.fetch = jest.fn( ( url ) => {
+			const urlString = url.toString();
+			const body = urlString.includes( "/followers" )
+				? urlString.includes( "cursor=page2" )
+					? { followers: [ { username: "follower3" } ], nextCursor: null }
+					: { followers: [ { username: "follower1" } ], nextCursor: "page2" }
+				: { following: [], nextCursor: null };
+			return Promise.resolve(
+				new Response( JSON.stringify( body ), { status: 200, headers: { "Content-Type": "application/json" } } )
+			);
+		} ) as jest.Mock;
+
+		render(
+			<Router>
+				<AuthContext.Provider value={{ isLoggedIn: true, setIsLoggedIn: jest.fn() }}>
+					<UserContext.Provider value={{ user: mockUser, setUser: jest.fn() }}>
+						<UserInfo />
+					</UserContext.Provider>
+				</AuthContext.Provider>
+			</Router>
+		);
+
+		expect( await screen.findByText( "follower1" ) ).toBeInTheDocument();
+		fireEvent.click( await screen.findByText( "Load more" ) );
+		expect( await screen.findByText( "follower3" ) ).toBeInTheDocument();
+		expect( screen.getByText( "follower1" ) ).toBeInTheDocument();
+		expect( screen.queryByText( "Load more" ) ).not.toBeInTheDocument();
+	} );
+
 	test( "renders not logged in redirect to /", () => {
 		const setIsLoggedIn = jest.fn();
 		const setUser = jest.fn();
@@ -1,5 +1,6 @@
 import LocalStorage from "./Lib_LocalStorage";
 import UserLib from "./Lib_User";
+import ApiLib from "./Lib_Api";
 
 const Lib = {
 
@@ -46,6 +47,11 @@ const Lib = {
 	 */
 	User: UserLib,
 
+	/**
+	 * API utilities for walking cursor-paginated endpoints.
+	 */
+	Api: ApiLib,
+
 	/**
 	 * String utilities for common string operations.
 	 */
@@ -0,0 +1,45 @@
+export type PagedResult<T> = {
+	status: number;
+	items: T[];
+	nextCursor: string | null;
+	data: { message?: string };
+};
+
+const ApiLib = {
+	/**
+	 * Page size of lists that load more on demand (the API allows 1-200).
+	 */
+	PAGE_SIZE: 20,
+
+	/**
+	 * Builds the URL of one page of a cursor-paginated endpoint.
+	 * @param url - The endpoint URL, with or without a query string.
+	 * @param limit - The page size.
+	 * @param cursor - The nextCursor of the previous page, or null for the first page.
+	 * @returns The URL with limit and cursor parameters.
+	 */
+	pageUrl: ( url: string, limit: number, cursor: string | null ): string => {
+		const separator = url.includes( "?" ) ? "&" : "?";
+		const cursorParam = cursor ? `&cursor=${ encodeURIComponent( cursor ) }` : "";
+		return `${ url }${ separator }limit=${ limit }${ cursorParam }`;
+	},
+
+	/**
+	 * Fetches one page of a list endpoint.
+	 * @param url - The endpoint URL, e.g. `/users/jane/followers`.
+	 * @param key - The response field holding the page, e.g. "followers".
+	 * @param cursor - The nextCursor of the previous page, or null for the first page.
+	 * @param init - Options passed to fetch, e.g. an Authorization header.
+	 * @returns The response status, the page's items, the cursor of the next page (null after the last one) and the response body.
+	 */
+	fetchPage: async <T>( url: string, key: string, cursor: string | null, init?: RequestInit ): Promise<PagedResult<T>> => {
+		const response: Response = await fetch( ApiLib.pageUrl( url, ApiLib.PAGE_SIZE, cursor ), init );
+		const data = await response.json();
+		if ( !response.ok ) {
+			return { status: response.status, items: [], nextCursor: null, data };
+		}
+		return { status: response.status, items: data[ key ] || [], nextCursor: data.nextCursor || null, data };
+	}
+};
+
+export default ApiLib;
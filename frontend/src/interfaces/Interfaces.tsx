@@ -7,4 +7,8 @@ export type User = {
   bio?: string;
   following?: User[];
   followers?: User[];
+  followerCount?: number;
+  followingCount?: number;
+  youFollow?: boolean;
+  followsYou?: boolean;
 };
\ No newline at end of file
@@ -8,13 +8,59 @@ CREATE TABLE IF NOT EXISTS users (
     password VARCHAR(255) NOT NULL,
     email VARCHAR(255) NOT NULL UNIQUE,
     bio VARCHAR(255),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    follower_count INT NOT NULL DEFAULT 0,
+    following_count INT NOT NULL DEFAULT 0,
+    version INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP NULL DEFAULT NULL,
+    tokens_valid_after DOUBLE NULL DEFAULT NULL,
+    last_logout_at DOUBLE NULL DEFAULT NULL,
+    INDEX ix_users_username_lower ((lower(username)))
 );
 
 CREATE TABLE IF NOT EXISTS followers (
     follower_id INT NOT NULL,
     followee_id INT NOT NULL,
     PRIMARY KEY (follower_id, followee_id),
+    INDEX ix_followers_followee_follower (followee_id, follower_id),
     FOREIGN KEY (follower_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (followee_id) REFERENCES users(id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS deletion_jobs (
+    id VARCHAR(32) NOT NULL PRIMARY KEY,
+    user_id INT NOT NULL,
+    username VARCHAR(50) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    edges_total INT NOT NULL DEFAULT 0,
+    edges_removed INT NOT NULL DEFAULT 0,
+    error VARCHAR(255) NULL,
+    created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL DEFAULT NULL,
+    INDEX ix_deletion_jobs_status_updated (status, updated_at)
+);
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti VARCHAR(36) NOT NULL PRIMARY KEY,
+    user_id INT NOT NULL,
+    expires_at DOUBLE NOT NULL,
+    INDEX ix_revoked_tokens_user_expires (user_id, expires_at),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Migrations already reflected in the tables above (see backend/api/migrations.py)
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(32) PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO schema_migrations (version, description) VALUES
+    ('0001', 'Add follower counters, row version and updated_at to users'),
+    ('0002', 'Make (follower_id, followee_id) the primary key of followers'),
+    ('0003', 'Add the (followee_id, follower_id) index covering follower lists'),
+    ('0004', 'Add a case-insensitive index on users.username'),
+    ('0005', 'Add users.deleted_at and the deletion_jobs table'),
+    ('0006', 'Add token revocation times to users and the revoked_tokens table');